@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Nhật ký crawl dạng JSONL chỉ ghi nối (append-only).
+
+Mỗi ảnh xử lý xong được ghi ngay thành một dòng, nên dừng giữa chừng cũng
+không mất dữ liệu. Khi chạy lại với resume, các bộ (query, page, url) đã có
+trong nhật ký được bỏ qua, và các trang đã xong không cần gọi lại SerpApi.
+metadata.json và CSV cuối cùng được dựng bằng cách đọc lần lượt từng dòng
+nhật ký, không giữ toàn bộ kết quả trong bộ nhớ.
+"""
+import csv
+import json
+import os
+import threading
+from collections import Counter
+
+# Thứ tự cột của metadata.json / CSV, giống build_image_info
+FIELDNAMES = ['title', 'original_url', 'thumbnail_url', 'source_website',
+              'resolution', 'search_query', 'page_number', 'local_path']
+
+PAGE_DONE = 'page_done'
+
+
+def iter_journal(path):
+    """Đọc lần lượt từng bản ghi trong nhật ký, bỏ qua dòng cuối bị ghi dở"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def iter_images(path):
+    """Chỉ các bản ghi ảnh (bỏ qua bản ghi đánh dấu trang đã xong)"""
+    for record in iter_journal(path):
+        if record.get('event') != PAGE_DONE:
+            yield record
+
+
+def _truncate_partial_line(path):
+    """Cắt bỏ dòng cuối bị ghi dở (do tiến trình bị dừng đột ngột)"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        pos = size
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            block = f.read(step)
+            newline = block.rfind(b'\n')
+            if newline != -1:
+                pos = pos - step + newline + 1
+                break
+            pos -= step
+        if pos != size:
+            f.truncate(pos)
+
+
+class CrawlJournal:
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done_images = set()
+        self.done_pages = set()
+        self._lock = threading.Lock()
+
+        if resume:
+            _truncate_partial_line(path)
+            for record in iter_journal(path):
+                if record.get('event') == PAGE_DONE:
+                    self.done_pages.add((record['query'], record['page']))
+                else:
+                    self.done_images.add(
+                        (record['search_query'], record['page_number'], record['original_url']))
+
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def is_page_done(self, query, page):
+        return (query, page) in self.done_pages
+
+    def is_image_done(self, query, page, url):
+        return (query, page, url) in self.done_images
+
+    def _write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+
+    def append_image(self, image_info):
+        self._write(image_info)
+        self.done_images.add(
+            (image_info['search_query'], image_info['page_number'], image_info['original_url']))
+
+    def mark_page_done(self, query, page):
+        self._write({'event': PAGE_DONE, 'query': query, 'page': page})
+        self.done_pages.add((query, page))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def compile_journal(journal_path, json_path, csv_path):
+    """Dựng metadata.json và CSV từ nhật ký bằng một lượt đọc tuần tự.
+
+    Định dạng đầu ra giống hệt json.dump(..., indent=2) và DataFrame.to_csv
+    trước đây. Trả về Counter số ảnh theo từ khóa.
+    """
+    counts = Counter()
+    with open(json_path, 'w', encoding='utf-8') as jf, \
+            open(csv_path, 'w', encoding='utf-8-sig', newline='') as cf:
+        writer = csv.DictWriter(cf, fieldnames=FIELDNAMES, lineterminator='\n',
+                                extrasaction='ignore')
+        writer.writeheader()
+
+        first = True
+        for record in iter_images(journal_path):
+            entry = json.dumps(record, ensure_ascii=False, indent=2)
+            jf.write('[\n' if first else ',\n')
+            jf.write('  ' + entry.replace('\n', '\n  '))
+            first = False
+
+            writer.writerow(record)
+            counts[record.get('search_query')] += 1
+
+        jf.write('[]' if first else '\n]')
+    return counts
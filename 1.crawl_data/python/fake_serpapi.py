@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Server giả lập SerpApi (Google Images) và nguồn ảnh, chạy hoàn toàn cục bộ.
+
+Dùng để chạy thử và đo hiệu năng crawler mà không tốn credit SerpApi hay phụ
+thuộc mạng:
+  - GET /search.json?q=...&ijn=...  trả JSON có ``images_results`` giống SerpApi,
+    kết quả cố định theo (q, ijn); các từ khóa khác nhau có một phần ảnh trùng nhau
+  - GET /images/<id>.jpg            ảnh JPEG tổng hợp, kích thước cố định theo id
+  - GET /images/<id>.jpg?thumb=1    cùng ảnh thu nhỏ (cạnh dài THUMBNAIL_SIZE) như thumbnail của Google
+
+Chạy riêng:
+    python fake_serpapi.py --port 8900 --latency 0.2
+    python traffic_raw.py --search-backend http --search-url http://127.0.0.1:8900/search.json
+Hoặc trong code: ``server = start_fake_server()`` rồi dùng ``server.search_url``.
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+IMAGES_PER_PAGE = 100
+IMAGE_POOL = 2000      # Số ảnh khác nhau, nhỏ hơn số kết quả để có ảnh trùng giữa các từ khóa
+SIZES = [(1024, 768), (1280, 960), (1600, 1200), (900, 675), (640, 480)]  # 640x480 bị crawler lọc bỏ
+LAST_MODIFIED = 'Mon, 01 Jan 2024 00:00:00 GMT'
+THUMBNAIL_SIZE = 300   # Cạnh dài của ảnh thumbnail
+
+
+def _stable_int(text):
+    return int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+
+
+def image_size(image_id):
+    return SIZES[image_id % len(SIZES)]
+
+
+@lru_cache(maxsize=256)
+def render_image(image_id, quality=85, thumbnail=False):
+    """Ảnh JPEG tổng hợp (gradient + nhiễu nhẹ) cố định theo id"""
+    width, height = image_size(image_id)
+    rng = np.random.default_rng(image_id)
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+    colors = rng.uniform(0, 255, size=(3, 3)).astype(np.float32)
+    pixels = colors[0] * x + colors[1] * y + colors[2] * (1 - x) * (1 - y)
+    pixels = pixels / 2 + rng.normal(0, 6, size=(height, width, 3)).astype(np.float32)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    if thumbnail:
+        image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def search_results(query, page, base_url, per_page=IMAGES_PER_PAGE, pool=IMAGE_POOL):
+    """Response giống SerpApi cho (query, page)"""
+    results = []
+    for position in range(per_page):
+        image_id = _stable_int(f"{query}|{page}|{position}") % pool
+        width, height = image_size(image_id)
+        results.append({
+            'position': position + 1,
+            'title': f"{query} #{image_id}",
+            'original': f"{base_url}/images/{image_id}.jpg",
+            'original_width': width,
+            'original_height': height,
+            'thumbnail': f"{base_url}/images/{image_id}.jpg?thumb=1",
+            'source': f"fake-source-{image_id % 17}",
+        })
+    return {
+        'search_metadata': {'status': 'Success'},
+        'search_parameters': {'q': query, 'ijn': str(page), 'engine': 'google_images'},
+        'images_results': results,
+    }
+
+
+class FakeSerpApiHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type, extra_headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        parsed = urlparse(self.path)
+        if parsed.path == '/search.json':
+            with server.lock:
+                server.search_requests += 1
+            time.sleep(server.latency)
+            query = parse_qs(parsed.query)
+            q = query.get('q', [''])[0]
+            page = int(query.get('ijn', ['0'])[0] or 0)
+            if not q:
+                body = {'error': 'Missing query `q` parameter.'}
+            else:
+                body = search_results(q, page, server.base_url, server.per_page, server.pool)
+            self._send(200, json.dumps(body, ensure_ascii=False).encode('utf-8'), 'application/json')
+        elif parsed.path.startswith('/images/') and parsed.path.endswith('.jpg'):
+            with server.lock:
+                server.image_requests += 1
+            time.sleep(server.image_latency)
+            try:
+                image_id = int(parsed.path[len('/images/'):-len('.jpg')])
+            except ValueError:
+                self._send(404, b'not found', 'text/plain')
+                return
+            thumbnail = parse_qs(parsed.query).get('thumb', ['0'])[0] == '1'
+            self._send(200, render_image(image_id, thumbnail=thumbnail), 'image/jpeg',
+                       {'Last-Modified': LAST_MODIFIED})
+        else:
+            self._send(404, b'not found', 'text/plain')
+
+    do_HEAD = do_GET
+
+
+class FakeSerpApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, image_latency=0.0,
+                 per_page=IMAGES_PER_PAGE, pool=IMAGE_POOL):
+        super().__init__((host, port), FakeSerpApiHandler)
+        self.latency = latency
+        self.image_latency = image_latency
+        self.per_page = per_page
+        self.pool = pool
+        self.search_requests = 0
+        self.image_requests = 0
+        self.lock = threading.Lock()
+        self.base_url = f"http://{host}:{self.server_address[1]}"
+        self.search_url = self.base_url + '/search.json'
+
+
+def start_fake_server(port=0, **kwargs):
+    """Chạy server giả trong một thread nền, trả về server (gọi server.shutdown() để dừng)"""
+    server = FakeSerpApiServer(port=port, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server giả lập SerpApi và nguồn ảnh")
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.2, help="Độ trễ mỗi lần tìm kiếm (giây)")
+    parser.add_argument('--image-latency', type=float, default=0.0, help="Độ trễ mỗi lần tải ảnh (giây)")
+    parser.add_argument('--per-page', type=int, default=IMAGES_PER_PAGE)
+    args = parser.parse_args()
+
+    server = FakeSerpApiServer(port=args.port, latency=args.latency, image_latency=args.image_latency,
+                               per_page=args.per_page)
+    print(f"Fake SerpApi: {server.search_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
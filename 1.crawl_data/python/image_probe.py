@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Đọc định dạng và kích thước ảnh chỉ từ vài byte đầu của file.
+
+Dùng để loại ảnh không đạt yêu cầu (quá nhỏ, sai tỷ lệ) ngay khi mới nhận
+phần header, trước khi tải toàn bộ nội dung. Chỉ dùng thư viện chuẩn.
+Tên định dạng trả về trùng với tên của ``imghdr``.
+"""
+
+# Các marker SOF của JPEG chứa kích thước ảnh (bỏ qua DHT 0xC4, JPG 0xC8, DAC 0xCC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _probe_jpeg(data):
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None  # Dữ liệu hỏng
+        marker = data[i + 1]
+        if marker == 0xFF:  # Byte đệm
+            i += 1
+            continue
+        if marker == 0xD8 or marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        segment_length = int.from_bytes(data[i + 2:i + 4], 'big')
+        if marker in JPEG_SOF_MARKERS:
+            if i + 9 > len(data):
+                return None
+            height = int.from_bytes(data[i + 5:i + 7], 'big')
+            width = int.from_bytes(data[i + 7:i + 9], 'big')
+            return 'jpeg', width, height
+        i += 2 + segment_length
+    return None
+
+
+def _probe_webp(data):
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and len(data) >= 30:
+        width = int.from_bytes(data[26:28], 'little') & 0x3FFF
+        height = int.from_bytes(data[28:30], 'little') & 0x3FFF
+        return 'webp', width, height
+    if chunk == b'VP8L' and len(data) >= 25:
+        bits = int.from_bytes(data[21:25], 'little')
+        return 'webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(data) >= 30:
+        width = int.from_bytes(data[24:27], 'little') + 1
+        height = int.from_bytes(data[27:30], 'little') + 1
+        return 'webp', width, height
+    return None
+
+
+def probe_image_size(data):
+    """Trả về (format, width, height) từ các byte đầu của ảnh.
+
+    Trả về None nếu chưa đủ dữ liệu hoặc không nhận diện được định dạng.
+    """
+    if data[:2] == b'\xff\xd8':
+        return _probe_jpeg(data)
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        if len(data) < 24:
+            return None
+        return 'png', int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        if len(data) < 10:
+            return None
+        return 'gif', int.from_bytes(data[6:8], 'little'), int.from_bytes(data[8:10], 'little')
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return _probe_webp(data)
+    if data[:2] == b'BM':
+        if len(data) < 26:
+            return None
+        width = int.from_bytes(data[18:22], 'little', signed=True)
+        height = int.from_bytes(data[22:26], 'little', signed=True)
+        return 'bmp', width, abs(height)
+    return None
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Kho ảnh định danh theo nội dung (content-addressed).
+
+Mỗi ảnh được lưu đúng một lần dưới tên là SHA-256 của chính nội dung ảnh,
+trong cây thư mục phân tầng ``ab/cd/<hash><ext>`` để không thư mục nào quá lớn.
+Một bảng chỉ mục SQLite ánh xạ URL -> hash, nhờ đó:
+  - ảnh trùng nội dung (cùng ảnh ở nhiều từ khóa/trang/phiên bản crawl) chỉ ghi một lần,
+  - URL đã tải ở lần crawl trước không cần tải lại,
+  - không còn chuyện hai ảnh cùng giây ghi đè lên nhau.
+"""
+import hashlib
+import imghdr
+import os
+import sqlite3
+import threading
+
+# Ánh xạ kết quả imghdr sang phần mở rộng file
+IMGHDR_EXTENSIONS = {
+    'jpeg': '.jpg',
+    'png': '.png',
+    'gif': '.gif',
+    'webp': '.webp',
+    'bmp': '.bmp',
+    'tiff': '.tiff',
+}
+
+
+class ImageStore:
+    def __init__(self, root_dir, index_name='index.sqlite'):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root_dir, index_name), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS url_index ("
+            " url TEXT PRIMARY KEY,"
+            " sha256 TEXT NOT NULL,"
+            " ext TEXT NOT NULL,"
+            " size INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+
+    def blob_path(self, digest, ext):
+        """Đường dẫn blob theo cấu trúc phân tầng ab/cd/<hash><ext>"""
+        return os.path.join(self.root_dir, digest[:2], digest[2:4], digest + ext)
+
+    def lookup(self, url):
+        """Trả về đường dẫn blob của URL đã lưu, hoặc None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256, ext FROM url_index WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        path = self.blob_path(*row)
+        return path if os.path.exists(path) else None
+
+    def temp_path(self):
+        """Đường dẫn file tạm nằm trong kho, để đổi tên sang blob là thao tác nguyên tử"""
+        tmp_dir = os.path.join(self.root_dir, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        return os.path.join(tmp_dir, f"{os.getpid()}_{threading.get_ident()}.part")
+
+    def put(self, url, data, fallback_ext='.jpg'):
+        """Lưu nội dung ảnh, ghi nhận URL vào chỉ mục và trả về đường dẫn blob"""
+        digest = hashlib.sha256(data).hexdigest()
+        ext = IMGHDR_EXTENSIONS.get(imghdr.what(None, h=data), fallback_ext)
+        path = self.blob_path(digest, ext)
+
+        # Chỉ ghi khi blob chưa tồn tại
+        if not os.path.exists(path):
+            tmp_path = self.temp_path()
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+
+        self._record(url, digest, ext, len(data))
+        return path
+
+    def put_file(self, url, tmp_path, digest, ext):
+        """Chuyển file tạm đã ghi xong (hash ``digest``) thành blob và ghi nhận URL.
+
+        Nếu blob đã tồn tại thì file tạm bị xóa, không ghi lại lần nữa.
+        """
+        path = self.blob_path(digest, ext)
+        size = os.path.getsize(tmp_path)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+
+        self._record(url, digest, ext, size)
+        return path
+
+    def _record(self, url, digest, ext, size):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO url_index (url, sha256, ext, size) VALUES (?, ?, ?, ?)",
+                (url, digest, ext, size)
+            )
+            self._conn.commit()
+
+    def stats(self):
+        """Số URL trong chỉ mục, số blob duy nhất và tổng dung lượng blob"""
+        with self._lock:
+            urls, blobs, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT sha256),"
+                " (SELECT COALESCE(SUM(size), 0) FROM"
+                "  (SELECT size FROM url_index GROUP BY sha256))"
+                " FROM url_index"
+            ).fetchone()
+        return {'urls': urls, 'unique_blobs': blobs, 'bytes': total_bytes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
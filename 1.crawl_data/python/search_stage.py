@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Bước tìm kiếm ảnh: gọi SerpApi có cache trên đĩa, giới hạn tốc độ và chạy song song.
+
+- Mỗi response thô của SerpApi được lưu thành một file JSON, khóa là sha256 của
+  bộ tham số đã chuẩn hóa (bỏ api_key, sắp xếp khóa, gom khoảng trắng thừa).
+  Chạy lại crawl (ví dụ để sửa lỗi tải ảnh) không tốn thêm credit SerpApi.
+- Chế độ offline chỉ đọc từ cache: có thể phát lại một lần crawl mà không cần mạng.
+- Backend có thể thay thế:
+    SerpApiBackend: thư viện serpapi (GoogleSearch), mặc định
+    HTTPBackend:    GET tới một endpoint trả JSON giống SerpApi, ví dụ
+                    https://serpapi.com/search.json hoặc server giả fake_serpapi.py
+- Thay cho ``time.sleep(2)`` cố định giữa các lần gọi, số lần gọi backend bị giới
+  hạn bằng TokenBucket (lần đọc từ cache không bị tính).
+"""
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Module dùng chung giữa các bước nằm trong thư mục common/ ở gốc repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from rate_limit import TokenBucket
+
+SEARCH_CACHE_DIR = "../output/search_cache"
+SERPAPI_ENDPOINT = "https://serpapi.com/search.json"
+SEARCH_RPM = 30        # Số lần gọi backend tối đa mỗi phút (tương đương sleep 2s)
+SEARCH_WORKERS = 4     # Số lần tìm kiếm chạy song song
+
+# Tham số không ảnh hưởng tới kết quả tìm kiếm
+IGNORED_PARAMS = {'api_key', 'output', 'async', 'no_cache'}
+
+
+class OfflineCacheMiss(Exception):
+    """Tham số tìm kiếm chưa có trong cache khi đang chạy offline"""
+
+
+def normalize_params(params):
+    """Bộ tham số chuẩn hóa dùng làm khóa cache"""
+    normalized = {}
+    for key, value in params.items():
+        key = str(key).strip().lower()
+        if key in IGNORED_PARAMS or value is None:
+            continue
+        normalized[key] = ' '.join(str(value).split())
+    return dict(sorted(normalized.items()))
+
+
+def params_key(params):
+    text = json.dumps(normalize_params(params), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class SerpApiBackend:
+    """Gọi SerpApi qua thư viện serpapi"""
+
+    name = 'serpapi'
+
+    def search(self, params):
+        from serpapi import GoogleSearch
+        return GoogleSearch(params).get_dict()
+
+
+class HTTPBackend:
+    """Gọi một endpoint HTTP trả JSON giống SerpApi (SerpApi thật hoặc server giả)"""
+
+    name = 'http'
+
+    def __init__(self, base_url=SERPAPI_ENDPOINT, timeout=30, session=None):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.session = session or requests.Session()
+
+    def search(self, params):
+        response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+        try:
+            return response.json()
+        except ValueError:
+            return {'error': f"HTTP {response.status_code}: response không phải JSON"}
+
+
+class CachedSearch:
+    """Tìm kiếm qua backend, lưu response thô trên đĩa và giới hạn tốc độ gọi backend"""
+
+    def __init__(self, backend=None, cache_dir=SEARCH_CACHE_DIR, offline=False, rate_per_minute=SEARCH_RPM):
+        self.backend = backend or SerpApiBackend()
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.limiter = TokenBucket(rate_per_minute, capacity=1) if rate_per_minute else None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def _load(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, path, params, response):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'params': normalize_params(params), 'response': response}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def search(self, params):
+        """Trả về response (dict) của SerpApi, ưu tiên bản đã cache"""
+        path = self._path(params_key(params))
+        cached = self._load(path)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            return cached['response']
+
+        with self._lock:
+            self.misses += 1
+        if self.offline:
+            raise OfflineCacheMiss(f"Chưa có trong cache: {normalize_params(params)}")
+
+        if self.limiter is not None:
+            self.limiter.acquire()
+        response = self.backend.search(params)
+        # Không cache lỗi (hết quota, key sai...) để lần sau gọi lại
+        if 'error' not in response:
+            self._store(path, params, response)
+        return response
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'backend': self.backend.name,
+                'offline': self.offline}
+
+
+def search_many(searcher, param_list, max_workers=SEARCH_WORKERS):
+    """Chạy song song nhiều lần tìm kiếm, trả về iterator kết quả đúng thứ tự đầu vào.
+
+    Mỗi phần tử là response (dict) hoặc {'error': ...} nếu lần tìm kiếm đó lỗi.
+    """
+    def run(params):
+        try:
+            return searcher.search(params)
+        except Exception as e:
+            logging.error(f"Lỗi tìm kiếm {normalize_params(params)}: {str(e)}")
+            return {'error': str(e)}
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = [executor.submit(run, params) for params in param_list]
+    executor.shutdown(wait=False)
+    for future in futures:
+        yield future.result()
@@ -1,30 +1,70 @@
 # -*- coding: utf-8 -*-
-from serpapi import GoogleSearch
-import pandas as pd
 import time
 from tqdm import tqdm
 import requests
 import os
-import json
-from urllib.parse import urlparse, unquote
-from pathlib import Path
+from urllib.parse import urlparse
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 import logging
 import imghdr
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import hashlib
+import sys
+from image_store import ImageStore, IMGHDR_EXTENSIONS
+from image_probe import probe_image_size
+from crawl_journal import CrawlJournal, compile_journal
+from search_stage import (CachedSearch, SerpApiBackend, HTTPBackend, search_many,
+                          SEARCH_CACHE_DIR, SEARCH_RPM, SEARCH_WORKERS, SERPAPI_ENDPOINT)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('../output/crawler.log'),
-        logging.StreamHandler()
-    ]
-)
+# Module dùng chung giữa các bước nằm trong thư mục common/ ở gốc repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from metrics import get_default_metrics, instrument
+from host_health import SKIP_HOST_OPEN, get_default_host_health
 
-# Tạo thư mục images nếu chưa có
 IMAGES_DIR = "../outputimages"
-os.makedirs(IMAGES_DIR, exist_ok=True)
+OUTPUT_DIR = "../output"
+JOURNAL_PATH = os.path.join(OUTPUT_DIR, "crawl_journal.jsonl")
+SERPAPI_KEY = "2514b459d190bed57a97218bcxxxxxxxxxxxxxxxxxxxxxxx"
+
+# Cấu hình chế độ crawl bất đồng bộ
+CONCURRENCY = 16      # Số lượt tải ảnh đồng thời tối đa
+PER_HOST_LIMIT = 4    # Số lượt tải đồng thời tối đa trên cùng một host
+
+# Cấu hình tải ảnh dạng stream
+MAX_IMAGE_BYTES = 20 * 1024 * 1024  # Bỏ ảnh lớn hơn 20MB
+PROBE_BYTES = 64 * 1024             # Số byte đầu tối đa dùng để đọc kích thước ảnh
+CHUNK_SIZE = 64 * 1024
+
+PAGES_PER_QUERY = 3
+
+_image_store = None
+_image_store_lock = threading.Lock()
+_searcher = None
+
+def get_image_store():
+    """Kho ảnh content-addressed dùng chung, khởi tạo lần đầu khi cần"""
+    global _image_store
+    with _image_store_lock:
+        if _image_store is None:
+            _image_store = ImageStore(IMAGES_DIR)
+        return _image_store
+
+def get_searcher():
+    """Bước tìm kiếm dùng chung (mặc định: SerpApi có cache trên đĩa)"""
+    global _searcher
+    with _image_store_lock:
+        if _searcher is None:
+            _searcher = CachedSearch(SerpApiBackend(), SEARCH_CACHE_DIR)
+        return _searcher
+
+def set_searcher(searcher):
+    global _searcher
+    with _image_store_lock:
+        _searcher = searcher
 
 def clean_filename(filename):
     # Xử lý tên file, loại bỏ ký tự đặc biệt
@@ -33,15 +73,59 @@ def clean_filename(filename):
         filename = filename.replace(char, '')
     return filename[:200]  # Giới hạn độ dài tên file
 
-def download_image(url, search_query):
+def _failed(outcome, reason, retry=False):
+    """Ghi lý do tải thất bại vào ``outcome`` (nếu nơi gọi cần), trả về None"""
+    if outcome is not None:
+        outcome['reason'] = reason
+        outcome['retry'] = retry
+    return None
+
+@instrument('download_image')
+def download_image(url, search_query, session=None, store=None, outcome=None):
+    """Tải ảnh vào kho, trả về đường dẫn đã lưu hoặc None.
+
+    Khi trả về None và ``outcome`` là dict, outcome['reason'] là lý do và
+    outcome['retry'] cho biết lỗi tạm thời (host tạm ngắt, timeout, 5xx, 429)
+    nên thử lại sau, hay ảnh bị loại hẳn (bị lọc, không phải ảnh, 4xx...).
+    """
     try:
-        session = create_session_with_retries()
-        response = session.get(url, timeout=10)
-        if response.status_code == 200:
+        if store is None:
+            store = get_image_store()
+
+        # URL đã có trong kho (kể cả từ lần crawl trước) thì không tải lại
+        stored_path = store.lookup(url)
+        if stored_path:
+            return stored_path
+
+        # URL lỗi đã biết hoặc host đang bị ngắt: bỏ qua, không chờ timeout
+        health = get_default_host_health()
+        skip_reason = health.check(url)
+        if skip_reason is not None:
+            get_default_metrics().record_response('download_image', url, 'skipped')
+            return _failed(outcome, skip_reason, retry=skip_reason == SKIP_HOST_OPEN)
+
+        # Dùng lại session dùng chung nếu có để tái sử dụng kết nối
+        if session is None:
+            session = create_session_with_retries()
+        started = time.perf_counter()
+        with session.get(url, timeout=10, stream=True) as response:
+            metrics = get_default_metrics()
+            # stream=True: get() trả về ngay khi có header, body chưa được đọc
+            metrics.record_phase('download_image', 'headers', time.perf_counter() - started)
+            health.record_response(url, response.status_code, response.headers)
+            metrics.record_response('download_image', url, str(response.status_code))
+            # Số lần urllib3 đã thử lại (lỗi kết nối, 5xx) trước khi có response này
+            retries = getattr(response.raw, 'retries', None)
+            if retries is not None:
+                metrics.add_retries('download_image', len(retries.history))
+            if response.status_code != 200:
+                return _failed(outcome, f"HTTP {response.status_code}",
+                               retry=response.status_code >= 500 or response.status_code in (408, 429))
             # Kiểm tra Content-Type
             content_type = response.headers.get('Content-Type', '')
             if 'image' not in content_type.lower():
-                return None
+                health.mark_bad(url, "không phải ảnh")
+                return _failed(outcome, "không phải ảnh")
                 
             # Kiểm tra thời gian tồn tại của ảnh qua Last-Modified header
             last_modified = response.headers.get('Last-Modified')
@@ -51,34 +135,94 @@ def download_image(url, search_query):
                     current_time = time.time()
                     # Bỏ qua ảnh cũ hơn 5 năm
                     if (current_time - modified_time) > (5 * 365 * 24 * 60 * 60):
-                        return None
+                        return _failed(outcome, "ảnh cũ hơn 5 năm")
                 except:
                     pass
                 
-            # Tạo tên file từ URL và query
+            # Bỏ sớm ảnh quá lớn nếu server báo trước dung lượng
+            content_length = response.headers.get('Content-Length')
+            if content_length and content_length.isdigit() and int(content_length) > MAX_IMAGE_BYTES:
+                return _failed(outcome, "ảnh quá lớn")
+
+            # Phần mở rộng dự phòng lấy từ URL, khi không nhận diện được từ nội dung
             parsed_url = urlparse(url)
             file_extension = os.path.splitext(parsed_url.path)[1]
             if not file_extension:
                 file_extension = '.jpg'
-            
-            # Tạo tên file an toàn
-            base_filename = f"{clean_filename(search_query)}_{int(time.time())}{file_extension}"
-            file_path = os.path.join(IMAGES_DIR, base_filename)
-            
-            # Lưu file
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
-            return file_path
+
+            saved_path = stream_to_store(response, url, store, file_extension)
+            if saved_path is None:
+                return _failed(outcome, "ảnh bị lọc, quá lớn hoặc rỗng")
+            return saved_path
     except Exception as e:
+        get_default_host_health().record_exception(url, e)
+        get_default_metrics().record_response('download_image', url, type(e).__name__)
         print(f"Lỗi tải ảnh: {str(e)}")
-        return None
+        # Lỗi mạng hoặc lỗi không lường trước: thử lại sau
+        return _failed(outcome, type(e).__name__, retry=True)
+
+def stream_to_store(response, url, store, fallback_ext='.jpg'):
+    """Ghi nội dung ảnh thẳng xuống đĩa theo từng chunk, có giới hạn dung lượng.
+
+    Khi vừa nhận đủ header để biết kích thước ảnh, ảnh không qua được
+    filter_image bị bỏ ngay, phần còn lại của ảnh không được tải về.
+    """
+    tmp_path = store.temp_path()
+    sha256 = hashlib.sha256()
+    head = b''
+    probed = None
+    total = 0
+    metrics = get_default_metrics()
+    started = time.perf_counter()
+    first_chunk_at = None
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if not chunk:
+                    continue
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                    metrics.record_phase('download_image', 'first_chunk', first_chunk_at - started)
+                total += len(chunk)
+                if total > MAX_IMAGE_BYTES:
+                    return None
+
+                if probed is None and len(head) < PROBE_BYTES:
+                    head += chunk
+                    probed = probe_image_size(head)
+                    if probed is not None:
+                        _, width, height = probed
+                        if not filter_image({'original_width': width, 'original_height': height}):
+                            return None
+
+                sha256.update(chunk)
+                f.write(chunk)
+
+        if total == 0:
+            return None
+
+        if probed is not None:
+            ext = IMGHDR_EXTENSIONS.get(probed[0], fallback_ext)
+        else:
+            ext = IMGHDR_EXTENSIONS.get(imghdr.what(None, h=head), fallback_ext)
+
+        # Lưu vào kho theo hash nội dung: ảnh trùng chỉ ghi một lần
+        path = store.put_file(url, tmp_path, sha256.hexdigest(), ext)
+        tmp_path = None
+        return path
+    finally:
+        if first_chunk_at is not None:
+            metrics.record_phase('download_image', 'body', time.perf_counter() - first_chunk_at)
+        metrics.add_bytes('download_image', total)
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 def filter_image(image_data):
     # Kiểm tra kích thước tối thiểu
     min_width = 800
     min_height = 600
-    width = image_data.get('original_width', 0)
-    height = image_data.get('original_height', 0)
+    width = image_data.get('original_width') or 0
+    height = image_data.get('original_height') or 0
     
     if width < min_width or height < min_height:
         return False
@@ -90,13 +234,17 @@ def filter_image(image_data):
         
     return True
 
-def create_session_with_retries():
+def create_session_with_retries(pool_connections=10, pool_maxsize=10):
     session = requests.Session()
     retries = Retry(total=3,
                    backoff_factor=0.5,
                    status_forcelist=[500, 502, 503, 504])
-    session.mount('http://', HTTPAdapter(max_retries=retries))
-    session.mount('https://', HTTPAdapter(max_retries=retries))
+    session.mount('http://', HTTPAdapter(max_retries=retries,
+                                         pool_connections=pool_connections,
+                                         pool_maxsize=pool_maxsize))
+    session.mount('https://', HTTPAdapter(max_retries=retries,
+                                          pool_connections=pool_connections,
+                                          pool_maxsize=pool_maxsize))
     return session
 
 search_queries = [
@@ -164,91 +312,258 @@ search_queries = [
     "đèn đường năng lượng mặt trời"
 ]
 
-all_results = []
+def validate_image_info(image_info):
+    required_fields = ['title', 'original_url', 'search_query']
+    return all(image_info.get(field) for field in required_fields)
 
-def save_checkpoint(current_query, current_page, results):
-    checkpoint = {
-        'query': current_query,
-        'page': current_page,
-        'results': results
+def cleanup_invalid_images():
+    for dirpath, _, files in os.walk(IMAGES_DIR):
+        for file in files:
+            if file.startswith('index.sqlite'):  # Bỏ qua chỉ mục của kho ảnh
+                continue
+            file_path = os.path.join(dirpath, file)
+            try:
+                if not imghdr.what(file_path):  # Kiểm tra file có phải ảnh không
+                    os.remove(file_path)
+                    logging.info(f"Removed invalid image: {file_path}")
+            except Exception as e:
+                logging.error(f"Error checking {file_path}: {str(e)}")
+
+def build_params(query, page):
+    return {
+        "q": query,
+        "engine": "google_images",
+        "ijn": str(page),
+        "api_key": SERPAPI_KEY,
+        "location": "Vietnam",
+        "safe": "off",
+        "num": "200"
+    }
+
+def build_image_info(image, query, page, saved_path):
+    return {
+        'title': image.get('title'),
+        'original_url': image.get('original'),
+        'thumbnail_url': image.get('thumbnail'),
+        'source_website': image.get('source'),
+        'resolution': f"{image.get('original_width')}x{image.get('original_height')}",
+        'search_query': query,
+        'page_number': page,
+        'local_path': saved_path
     }
-    with open('checkpoint.json', 'w', encoding='utf-8') as f:
-        json.dump(checkpoint, f, ensure_ascii=False)
 
-def load_checkpoint():
+def parse_search_results(results, query, page):
+    """Lấy images_results từ response SerpApi, trả về None nếu lỗi"""
+    if "error" in results:
+        print(f"Lỗi với từ khóa '{query}', trang {page}:", results["error"])
+        return None
+
+    return results.get("images_results", [])
+
+def search_images(query, page):
+    """Gọi SerpApi (qua cache), trả về danh sách images_results hoặc None nếu lỗi"""
     try:
-        with open('checkpoint.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
+        results = get_searcher().search(build_params(query, page))
+    except Exception as e:
+        print(f"Lỗi với từ khóa '{query}', trang {page}:", str(e))
         return None
+    return parse_search_results(results, query, page)
 
-def validate_image_info(image_info):
-    required_fields = ['title', 'original_url', 'search_query']
-    return all(image_info.get(field) for field in required_fields)
+def iter_search_pages(queries, journal=None, search_workers=SEARCH_WORKERS, pages_per_query=PAGES_PER_QUERY):
+    """Tìm kiếm song song (giới hạn tốc độ trong searcher) các trang chưa xong.
 
-def cleanup_invalid_images():
-    for file in os.listdir(IMAGES_DIR):
-        file_path = os.path.join(IMAGES_DIR, file)
-        try:
-            if not imghdr.what(file_path):  # Kiểm tra file có phải ảnh không
-                os.remove(file_path)
-                logging.info(f"Removed invalid image: {file_path}")
-        except Exception as e:
-            logging.error(f"Error checking {file_path}: {str(e)}")
-
-for query in tqdm(search_queries, desc="Đang xử lý từ khóa"):
-    for page in range(0, 3):
-        params = {
-            "q": query,
-            "engine": "google_images",
-            "ijn": str(page),
-            "api_key": "2514b459d190bed57a97218bcxxxxxxxxxxxxxxxxxxxxxxx",
-            "location": "Vietnam",
-            "safe": "off",
-            "num": "200"
-        }
+    Trả về lần lượt (query, page, images) theo đúng thứ tự query/trang.
+    Không có ``journal`` thì tìm kiếm mọi trang.
+    """
+    pages = [(query, page) for query in queries for page in range(pages_per_query)
+             if journal is None or not journal.is_page_done(query, page)]
+    responses = search_many(get_searcher(), [build_params(query, page) for query, page in pages],
+                            max_workers=search_workers)
+    for (query, page), results in zip(pages, responses):
+        yield query, page, parse_search_results(results, query, page)
 
-        try:
-            search = GoogleSearch(params)
-            results = search.get_dict()
+def crawl(queries, journal, search_workers=SEARCH_WORKERS):
+    """Crawl tuần tự: tải từng ảnh một, ghi nhật ký ngay khi xong mỗi ảnh"""
+    session = create_session_with_retries()
 
-            if "error" in results:
-                print(f"Lỗi với từ khóa '{query}', trang {page}:", results["error"])
+    for query, page, images in tqdm(iter_search_pages(queries, journal, search_workers),
+                                    desc="Đang xử lý trang kết quả"):
+        try:
+            if images is None:
                 continue
 
-            if "images_results" in results:
-                for image in tqdm(results["images_results"], desc=f"Đang tải ảnh cho '{query}' trang {page}"):
-                    # Tải ảnh
-                    saved_path = download_image(image.get('original'), query)
-                    
-                    # Lưu thông tin
-                    image_info = {
-                        'title': image.get('title'),
-                        'original_url': image.get('original'),
-                        'thumbnail_url': image.get('thumbnail'),
-                        'source_website': image.get('source'),
-                        'resolution': f"{image.get('original_width')}x{image.get('original_height')}",
-                        'search_query': query,
-                        'page_number': page,
-                        'local_path': saved_path
-                    }
-                    all_results.append(image_info)
-
-            time.sleep(2)
+            for image in tqdm(images, desc=f"Đang tải ảnh cho '{query}' trang {page}"):
+                url = image.get('original')
+                if journal.is_image_done(query, page, url):
+                    continue
+
+                # Tải ảnh
+                saved_path = download_image(url, query, session)
+
+                # Lưu thông tin
+                journal.append_image(build_image_info(image, query, page, saved_path))
+
+            journal.mark_page_done(query, page)
 
         except Exception as e:
             print(f"Lỗi xử lý từ khóa '{query}', trang {page}:", str(e))
             continue
 
-# Lưu metadata dạng JSON (giữ nguyên Unicode)
-with open('../output/metadata.json', 'w', encoding='utf-8') as f:
-    json.dump(all_results, f, ensure_ascii=False, indent=2)
+    session.close()
+
+async def _download_limited(url, query, session, executor, global_limit, host_limits, per_host_limit):
+    """Tải một ảnh trong giới hạn đồng thời toàn cục và theo từng host"""
+    host = urlparse(url).netloc if url else ''
+    if host not in host_limits:
+        host_limits[host] = asyncio.Semaphore(per_host_limit)
+
+    # Giữ slot của host trước rồi mới lấy slot toàn cục, để một host chậm
+    # không chiếm hết slot toàn cục trong lúc chờ
+    async with host_limits[host]:
+        async with global_limit:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, download_image, url, query, session)
+
+async def _journal_pages(page_queue, journal):
+    """Ghi nhật ký theo đúng thứ tự trang/ảnh khi các lượt tải hoàn tất"""
+    with tqdm(desc="Đang tải ảnh") as pbar:
+        while True:
+            item = await page_queue.get()
+            if item is None:
+                break
+            query, page, pending = item
+            for image, task in pending:
+                try:
+                    saved_path = await task
+                except Exception as e:
+                    print(f"Lỗi tải ảnh: {str(e)}")
+                    saved_path = None
+                journal.append_image(build_image_info(image, query, page, saved_path))
+                pbar.update(1)
+            journal.mark_page_done(query, page)
+
+async def crawl_async(queries, journal, concurrency=CONCURRENCY, per_host_limit=PER_HOST_LIMIT,
+                      search_workers=SEARCH_WORKERS):
+    """Crawl bất đồng bộ: tải ảnh song song qua một connection pool dùng chung.
+
+    Các trang kết quả được tìm kiếm song song trước (giới hạn tốc độ trong
+    searcher), còn việc tải ảnh của các trang trước chạy nền trong lúc chờ
+    kết quả các trang sau. Nhật ký được ghi đúng thứ tự như chế độ tuần tự.
+    """
+    loop = asyncio.get_running_loop()
+    session = create_session_with_retries(pool_connections=concurrency,
+                                          pool_maxsize=per_host_limit)
+    global_limit = asyncio.Semaphore(concurrency)
+    host_limits = {}
+    page_queue = asyncio.Queue()
+    pages = iter_search_pages(queries, journal, search_workers)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        writer = asyncio.create_task(_journal_pages(page_queue, journal))
+
+        with tqdm(desc="Đang xử lý trang kết quả") as pbar:
+            while True:
+                # Lấy trang kế tiếp mà không chặn event loop
+                item = await loop.run_in_executor(executor, next, pages, None)
+                if item is None:
+                    break
+                query, page, images = item
+                pbar.update(1)
+                try:
+                    if images is None:
+                        continue
+
+                    pending = [
+                        (image, asyncio.create_task(_download_limited(
+                            image.get('original'), query, session, executor,
+                            global_limit, host_limits, per_host_limit)))
+                        for image in images
+                        if not journal.is_image_done(query, page, image.get('original'))
+                    ]
+                    await page_queue.put((query, page, pending))
+
+                except Exception as e:
+                    print(f"Lỗi xử lý từ khóa '{query}', trang {page}:", str(e))
+                    continue
+
+        await page_queue.put(None)
+        await writer
+
+    session.close()
+
+def save_results(journal_path):
+    # Dựng metadata.json (giữ nguyên Unicode) và CSV (utf-8-sig để hỗ trợ Excel) từ nhật ký
+    counts = compile_journal(journal_path,
+                             os.path.join(OUTPUT_DIR, 'metadata.json'),
+                             os.path.join(OUTPUT_DIR, 'traffic_images_dataset.csv'))
+
+    # In thống kê
+    print(f"\nTổng số ảnh đã crawl: {sum(counts.values())}")
+    print(f"Số lượng ảnh theo từ khóa:")
+    for query, count in counts.most_common():
+        print(f"{query}    {count}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl ảnh giao thông từ Google Images qua SerpApi")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="Tải ảnh song song qua asyncio với connection pool dùng chung")
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY,
+                        help="Số lượt tải ảnh đồng thời tối đa (chế độ --async)")
+    parser.add_argument('--per-host', type=int, default=PER_HOST_LIMIT,
+                        help="Số lượt tải đồng thời tối đa trên một host (chế độ --async)")
+    parser.add_argument('--resume', action='store_true',
+                        help="Tiếp tục từ nhật ký crawl, bỏ qua các ảnh/trang đã xong")
+    parser.add_argument('--compile-only', action='store_true',
+                        help="Chỉ dựng lại metadata.json và CSV từ nhật ký, không crawl")
+    parser.add_argument('--search-backend', choices=['serpapi', 'http'], default='serpapi',
+                        help="serpapi: thư viện serpapi; http: endpoint JSON (SerpApi thật hoặc fake_serpapi.py)")
+    parser.add_argument('--search-url', default=SERPAPI_ENDPOINT,
+                        help="Endpoint cho --search-backend http")
+    parser.add_argument('--search-cache', default=SEARCH_CACHE_DIR,
+                        help="Thư mục cache response tìm kiếm")
+    parser.add_argument('--search-workers', type=int, default=SEARCH_WORKERS,
+                        help="Số lần tìm kiếm chạy song song")
+    parser.add_argument('--search-rpm', type=float, default=SEARCH_RPM,
+                        help="Số lần gọi backend tìm kiếm tối đa mỗi phút (0: không giới hạn)")
+    parser.add_argument('--offline', action='store_true',
+                        help="Chỉ dùng kết quả tìm kiếm đã cache, không gọi backend")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(os.path.join(OUTPUT_DIR, 'crawler.log')),
+            logging.StreamHandler()
+        ]
+    )
+
+    # Tạo thư mục images nếu chưa có
+    os.makedirs(IMAGES_DIR, exist_ok=True)
+
+    backend = HTTPBackend(args.search_url) if args.search_backend == 'http' else SerpApiBackend()
+    set_searcher(CachedSearch(backend, args.search_cache, offline=args.offline,
+                              rate_per_minute=args.search_rpm))
+
+    if not args.compile_only:
+        journal = CrawlJournal(JOURNAL_PATH, resume=args.resume)
+        try:
+            if args.use_async:
+                asyncio.run(crawl_async(search_queries, journal, args.concurrency, args.per_host,
+                                        args.search_workers))
+            else:
+                crawl(search_queries, journal, args.search_workers)
+        finally:
+            journal.close()
+
+        stats = get_searcher().stats()
+        print(f"Tìm kiếm ({stats['backend']}): {stats['hits']} lần dùng cache, {stats['misses']} lần chưa có trong cache")
+
+    save_results(JOURNAL_PATH)
 
-# Lưu CSV với encoding phù hợp
-df = pd.DataFrame(all_results)
-df.to_csv('../output/traffic_images_dataset.csv', index=False, encoding='utf-8-sig')  # utf-8-sig để hỗ trợ Excel
+    stats = get_image_store().stats()
+    print(f"Kho ảnh: {stats['urls']} URL -> {stats['unique_blobs']} ảnh duy nhất "
+          f"({stats['bytes'] / 1024 / 1024:.1f} MB)")
 
-# In thống kê
-print(f"\nTổng số ảnh đã crawl: {len(all_results)}")
-print(f"Số lượng ảnh theo từ khóa:")
-print(df['search_query'].value_counts())
\ No newline at end of file
+if __name__ == "__main__":
+    main()
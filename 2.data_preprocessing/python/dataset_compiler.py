@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""Gộp dần các phiên bản crawl (traffic_images_dataset_v*.csv/.parquet) vào một dataset chính.
+
+Thay cho việc nối lại toàn bộ v1, v2, ... trong notebook mỗi lần có bản crawl mới:
+  - dataset chính và chỉ mục URL được lưu trong SQLite,
+  - chỉ những file chưa từng nạp mới được đọc (so theo kích thước/mtime, rồi sha256),
+  - URL được chuẩn hóa trước khi so trùng (http/https, www., tham số tracking,
+    tham số resize của các CDN ảnh đã biết, hậu tố -300x200 của WordPress, ...),
+    khóa so trùng là sha256 của URL đã chuẩn hóa,
+  - chỉ các dòng mới (delta) được ghi ra để kiểm tra URL và gán caption tiếp.
+
+Chạy (đầu vào là file hoặc thư mục chứa traffic_images_dataset_v*.csv/.parquet,
+mặc định là thư mục output của bước crawl):
+    python dataset_compiler.py ../../1.crawl_data/output \\
+        --delta ../output/delta.csv --master ../output/master_dataset.csv
+    python url_validator.py ../output/delta.csv ../output/valid_urls_delta.csv
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import pandas as pd
+
+# Module dùng chung giữa các bước nằm trong thư mục common/ ở gốc repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from dataset_io import read_table, write_table
+
+INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output', 'dataset_index.sqlite')
+CRAWL_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '1.crawl_data', 'output')
+VERSION_PATTERNS = ('traffic_images_dataset_v*.csv', 'traffic_images_dataset_v*.parquet')
+
+# Cột giữ lại cho các bước sau, giống notebook tiền xử lý
+SELECTED_COLUMNS = ['original_url', 'source_website', 'resolution', 'search_query', 'local_path']
+
+# Tham số query bỏ qua với mọi host: tracking và tham số chỉ CDN ảnh dùng. Các khóa
+# chung như v, size, format, w, h có thể chọn ảnh khác trên server thường nên được giữ
+IGNORED_QUERY_PARAMS = {
+    'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'igshid', 'ixlib', 'ixid', 'dpr', 'quality', 'itok',
+}
+IGNORED_QUERY_PREFIXES = ('utm_',)
+# Tham số resize/định dạng chỉ bỏ qua với CDN ảnh đã biết (cùng ảnh gốc, khác kích thước)
+CDN_RESIZE_PARAMS = {
+    'w', 'h', 'width', 'height', 'resize', 'fit', 'crop', 'auto', 'fm', 'q', 'ssl', 'strip',
+    'zoom', 'scale', 'sharpen',
+}
+CDN_HOSTS = ('imgix.net', 'wp.com', 'images.unsplash.com', 'cdn.shopify.com')
+
+# Hậu tố kích thước do CMS tự sinh: anh-300x200.jpg -> anh.jpg
+SIZE_SUFFIX_PATTERN = re.compile(r'-\d{2,5}x\d{2,5}(?=\.[A-Za-z0-9]+$)')
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def _is_cdn_host(host):
+    return any(host == cdn or host.endswith('.' + cdn) for cdn in CDN_HOSTS)
+
+
+def _ignored_param(key, cdn):
+    key = key.lower()
+    return (key in IGNORED_QUERY_PARAMS or key.startswith(IGNORED_QUERY_PREFIXES)
+            or (cdn and key in CDN_RESIZE_PARAMS))
+
+
+def normalize_url(url):
+    """Dạng chuẩn của URL ảnh để nhận ra các URL chỉ khác nhau không đáng kể"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+
+    path = re.sub(r'/{2,}', '/', parts.path or '/')
+    path = SIZE_SUFFIX_PATTERN.sub('', path).rstrip('/') or '/'
+
+    cdn = _is_cdn_host(host)
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not _ignored_param(key, cdn)
+    )
+    # Bỏ scheme: http và https của cùng một đường dẫn được coi là một ảnh
+    normalized = host + path
+    if query:
+        normalized += '?' + urlencode(query)
+    return normalized
+
+
+def version_files(inputs):
+    """Danh sách file phiên bản crawl: thư mục được mở rộng theo VERSION_PATTERNS (CSV và Parquet)"""
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for pattern in VERSION_PATTERNS:
+                paths.extend(glob.glob(os.path.join(path, pattern)))
+        else:
+            paths.append(path)
+    return sorted(dict.fromkeys(paths))
+
+
+def url_key(normalized_url):
+    return hashlib.sha256(normalized_url.encode('utf-8')).hexdigest()
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DatasetIndex:
+    """Dataset chính + chỉ mục URL chuẩn hóa + danh sách file đã nạp"""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT,"
+            " rows INTEGER, added INTEGER, ingested_at REAL);"
+            "CREATE TABLE IF NOT EXISTS records ("
+            " url_key TEXT PRIMARY KEY, normalized_url TEXT NOT NULL, original_url TEXT NOT NULL,"
+            " data TEXT NOT NULL, source_file TEXT NOT NULL, run_id INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS records_run ON records (run_id);"
+            "CREATE TABLE IF NOT EXISTS url_aliases ("
+            " original_url TEXT PRIMARY KEY, url_key TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, started_at REAL, files INTEGER, added INTEGER);"
+        )
+        self._conn.commit()
+
+    def _is_ingested(self, path, stat):
+        """Kiểm tra nhanh theo kích thước/mtime; nếu khác thì so sha256 nội dung"""
+        row = self._conn.execute("SELECT size, mtime_ns FROM sources WHERE path = ?", (path,)).fetchone()
+        if row is not None and row == (stat.st_size, stat.st_mtime_ns):
+            return True, None
+        digest = file_sha256(path)
+        if self._conn.execute("SELECT 1 FROM sources WHERE sha256 = ?", (digest,)).fetchone():
+            # Nội dung đã nạp (file được chạm vào hoặc đổi tên): chỉ cập nhật thông tin file
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sources (path, size, mtime_ns, sha256, rows, added, ingested_at)"
+                " VALUES (?, ?, ?, ?, 0, 0, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, digest, time.time()))
+            return True, digest
+        return False, digest
+
+    def _read_version(self, path):
+        """Đọc một file crawl, bỏ dòng trùng URL chuẩn hóa trong file rồi bỏ dòng thiếu dữ liệu.
+
+        Cùng thứ tự với notebook (drop_duplicates rồi dropna): nếu dòng đầu tiên của
+        một URL thiếu dữ liệu thì URL đó bị bỏ, không lấy dòng trùng phía sau thay thế.
+        """
+        df = read_table(path)
+        if 'resolution' in df.columns:
+            # width/height do read_table suy ra từ resolution: bỏ để dữ liệu lưu giống file CSV gốc
+            df = df.drop(columns=[c for c in ('width', 'height') if c in df.columns])
+        # Dòng không có URL đằng nào cũng bị dropna bỏ, không ảnh hưởng việc bỏ trùng
+        df = df[df['original_url'].notna() & (df['original_url'].astype(str).str.strip() != '')]
+        normalized = df['original_url'].astype(str).map(normalize_url)
+        df = df.assign(normalized_url=normalized, url_key=normalized.map(url_key))
+        return df.drop_duplicates(subset=['url_key'], keep='first').dropna()
+
+    def ingest(self, paths):
+        """Nạp các file chưa có trong chỉ mục; trả về (run_id, số file mới, số dòng mới)"""
+        with self._lock:
+            cursor = self._conn.execute("INSERT INTO runs (started_at, files, added) VALUES (?, 0, 0)",
+                                        (time.time(),))
+            run_id = cursor.lastrowid
+            new_files = total_added = 0
+
+            for path in paths:
+                path = os.path.abspath(path)
+                stat = os.stat(path)
+                ingested, digest = self._is_ingested(path, stat)
+                if ingested:
+                    continue
+
+                df = self._read_version(path)
+                columns = [column for column in df.columns if column not in ('normalized_url', 'url_key')]
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO records"
+                    " (url_key, normalized_url, original_url, data, source_file, run_id)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    ((key, normalized, original, json.dumps(record, ensure_ascii=False, default=str),
+                      os.path.basename(path), run_id)
+                     for key, normalized, original, record in zip(
+                        df['url_key'], df['normalized_url'], df['original_url'],
+                        df[columns].to_dict('records')))
+                )
+                added = self._conn.total_changes - before
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO url_aliases (original_url, url_key) VALUES (?, ?)",
+                    zip(df['original_url'], df['url_key']))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sources (path, size, mtime_ns, sha256, rows, added, ingested_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime_ns, digest, len(df), added, time.time()))
+                print(f"{os.path.basename(path)}: {len(df)} dòng hợp lệ, {added} dòng mới")
+                new_files += 1
+                total_added += added
+
+            self._conn.execute("UPDATE runs SET files = ?, added = ? WHERE id = ?",
+                               (new_files, total_added, run_id))
+            self._conn.commit()
+        return run_id, new_files, total_added
+
+    def to_dataframe(self, run_id=None, columns=SELECTED_COLUMNS):
+        """Dataset chính (hoặc chỉ các dòng thêm trong lần chạy ``run_id``) theo thứ tự nạp"""
+        query = "SELECT data FROM records"
+        params = ()
+        if run_id is not None:
+            query += " WHERE run_id = ?"
+            params = (run_id,)
+        with self._lock:
+            rows = [json.loads(data) for (data,) in self._conn.execute(query + " ORDER BY rowid", params)]
+        df = pd.DataFrame(rows, columns=columns)
+        # Cột caption rỗng cho bước gán caption, như final_df trong notebook
+        df['short_caption'] = ''
+        return df
+
+    def stats(self):
+        with self._lock:
+            records = self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            aliases = self._conn.execute("SELECT COUNT(*) FROM url_aliases").fetchone()[0]
+            sources = self._conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+        return {'records': records, 'url_aliases': aliases, 'source_files': sources}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gộp dần các phiên bản crawl vào dataset chính")
+    parser.add_argument('inputs', nargs='*', default=[CRAWL_OUTPUT_DIR],
+                        help="File hoặc thư mục chứa traffic_images_dataset_v*.csv/.parquet")
+    parser.add_argument('--index', default=INDEX_PATH, help="File SQLite chứa dataset chính và chỉ mục URL")
+    parser.add_argument('--delta', default='delta.csv', help="CSV/Parquet chỉ gồm các dòng mới của lần chạy này")
+    parser.add_argument('--master', help="Xuất thêm toàn bộ dataset chính ra CSV/Parquet (khi có dòng mới)")
+    args = parser.parse_args()
+
+    start = time.time()
+    index = DatasetIndex(args.index)
+    run_id, new_files, added = index.ingest(version_files(args.inputs))
+
+    write_table(index.to_dataframe(run_id), args.delta)
+    if args.master and (added or not os.path.exists(args.master)):
+        write_table(index.to_dataframe(), args.master)
+
+    stats = index.stats()
+    index.close()
+    print(f"{new_files} file mới, {added} dòng mới -> {args.delta} "
+          f"(dataset chính: {stats['records']} dòng, {stats['url_aliases']} URL gốc) "
+          f"trong {time.time() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""Phát hiện ảnh gần trùng (resize, nén lại, đóng watermark) bằng perceptual hash.
+
+Mỗi ảnh được tính pHash (DCT) và dHash (gradient) 64 bit. Hai ảnh được coi là
+bản sao khi khoảng cách Hamming của pHash <= ``threshold`` và của dHash <=
+``dhash_threshold``. Tra cứu theo bán kính Hamming dùng multi-index hashing:
+pHash chia thành 4 đoạn 16 bit, hai hash cách nhau <= r thì (nguyên lý
+Dirichlet) có ít nhất một đoạn cách nhau <= r // 4, nên chỉ cần tra bảng băm
+các giá trị đoạn lân cận thay vì so với toàn bộ ảnh.
+
+Ảnh gần trùng được gom cụm; mỗi cụm giữ một ảnh (ảnh có độ phân giải lớn nhất
+trong lần nạp đầu tiên). Chỉ mục lưu trong SQLite nên lần chạy sau chỉ tính
+hash cho ảnh mới, và ảnh được giữ trước đó không bị thay bởi ảnh mới để các
+bước caption/augment đã chạy không phải làm lại.
+
+Chạy:
+    python near_duplicates.py ./csv/valid_urls_dataset_v12.csv ./csv/dedup_dataset_v12.csv \\
+        --clusters ./csv/near_duplicate_clusters.csv
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+from tqdm import tqdm
+
+# Module dùng chung giữa các bước nằm trong thư mục common/ ở gốc repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from http_cache import get_default_cache
+from image_loader import open_image
+from dataset_io import read_table, write_table
+
+INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output', 'phash_index.sqlite')
+# Đo trên 84 ảnh thật: bản resize 1/2-1/4 + nén lại JPEG cách ảnh gốc pHash <= 4
+# (82/84 ảnh) và dHash <= 7; hai ảnh khác nhau gần nhất (cặp ảnh stereo cùng cảnh)
+# cách pHash 6, dHash 11. Ngưỡng 8/12 trước đây gộp cả cặp đó.
+THRESHOLD = 6          # Khoảng cách Hamming tối đa của pHash
+DHASH_THRESHOLD = 10   # Khoảng cách Hamming tối đa của dHash (lọc bớt trùng nhầm)
+MAX_WORKERS = 16
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def _dct_matrix(n):
+    """Ma trận DCT-II trực chuẩn n x n"""
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+DCT_32 = _dct_matrix(32)
+
+
+def _bits_to_int(bits):
+    return int(''.join('1' if b else '0' for b in bits.ravel()), 2)
+
+
+def compute_hashes(data):
+    """Trả về (phash, dhash, width, height) của ảnh; giải mã ở độ phân giải thấp"""
+    image, _, size = open_image(data, min_size=(64, 64), mode='L')
+
+    small = np.asarray(image.resize((32, 32), Image.Resampling.LANCZOS), dtype=np.float64)
+    low = (DCT_32 @ small @ DCT_32.T)[:8, :8]
+    # Bỏ hệ số DC khi tính trung vị để hash không phụ thuộc độ sáng trung bình
+    phash = _bits_to_int(low > np.median(low.ravel()[1:]))
+
+    tiny = np.asarray(image.resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    dhash = _bits_to_int(tiny[:, 1:] > tiny[:, :-1])
+    return phash, dhash, size[0], size[1]
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _chunks(value):
+    return [(value >> (CHUNK_BITS * i)) & CHUNK_MASK for i in range(CHUNKS)]
+
+
+_flip_masks = {}
+
+
+def _neighbor_masks(radius):
+    """Các mặt nạ XOR có tối đa ``radius`` bit 1 trong một đoạn 16 bit (tính một lần)"""
+    if radius not in _flip_masks:
+        masks = [0]
+        for distance in range(1, radius + 1):
+            for positions in combinations(range(CHUNK_BITS), distance):
+                masks.append(sum(1 << position for position in positions))
+        _flip_masks[radius] = masks
+    return _flip_masks[radius]
+
+
+class MultiIndexHash:
+    """Chỉ mục trong bộ nhớ cho truy vấn bán kính Hamming trên hash 64 bit"""
+
+    def __init__(self):
+        self.tables = [defaultdict(list) for _ in range(CHUNKS)]
+        self.hashes = {}  # id -> (phash, dhash)
+
+    def add(self, item_id, phash, dhash):
+        self.hashes[item_id] = (phash, dhash)
+        for table, chunk in zip(self.tables, _chunks(phash)):
+            table[chunk].append(item_id)
+
+    def query(self, phash, dhash, radius=THRESHOLD, dhash_radius=DHASH_THRESHOLD):
+        """Các id có pHash cách <= radius và dHash cách <= dhash_radius, kèm khoảng cách pHash"""
+        candidates = set()
+        masks = _neighbor_masks(radius // CHUNKS)
+        for table, chunk in zip(self.tables, _chunks(phash)):
+            for mask in masks:
+                bucket = table.get(chunk ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+
+        matches = []
+        for item_id in candidates:
+            other_phash, other_dhash = self.hashes[item_id]
+            distance = hamming(phash, other_phash)
+            if distance <= radius and hamming(dhash, other_dhash) <= dhash_radius:
+                matches.append((item_id, distance))
+        return matches
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+class NearDuplicateIndex:
+    """Hash và cụm của các ảnh đã nạp, lưu trong SQLite.
+
+    cluster_id của một cụm là id của ảnh được giữ (ảnh nạp sớm nhất của cụm).
+    """
+
+    def __init__(self, path=INDEX_PATH, threshold=THRESHOLD, dhash_threshold=DHASH_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.dhash_threshold = dhash_threshold
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " id INTEGER PRIMARY KEY,"
+            " url TEXT UNIQUE NOT NULL,"
+            " phash TEXT NOT NULL,"
+            " dhash TEXT NOT NULL,"
+            " width INTEGER,"
+            " height INTEGER,"
+            " cluster_id INTEGER NOT NULL,"
+            " added_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS images_cluster ON images (cluster_id)")
+        self._conn.commit()
+
+        self.mih = MultiIndexHash()
+        self.cluster_of = {}
+        for item_id, phash, dhash, cluster_id in self._conn.execute(
+                "SELECT id, phash, dhash, cluster_id FROM images"):
+            self.mih.add(item_id, int(phash, 16), int(dhash, 16))
+            self.cluster_of[item_id] = cluster_id
+
+    def known_urls(self):
+        with self._lock:
+            return {url for (url,) in self._conn.execute("SELECT url FROM images")}
+
+    def add_many(self, items):
+        """Nạp [(url, phash, dhash, width, height)], ảnh lớn trước để được giữ trong cụm mới"""
+        items = sorted(items, key=lambda item: -(item[3] or 0) * (item[4] or 0))
+        now = time.time()
+        with self._lock:
+            next_id = (self._conn.execute("SELECT MAX(id) FROM images").fetchone()[0] or 0) + 1
+            rows = []
+            for url, phash, dhash, width, height in items:
+                item_id = next_id
+                next_id += 1
+                clusters = {self.cluster_of[other]
+                            for other, _ in self.mih.query(phash, dhash, self.threshold, self.dhash_threshold)}
+                # Ảnh nối nhiều cụm cũ: gộp về cụm có ảnh giữ được nạp sớm nhất
+                cluster_id = min(clusters) if clusters else item_id
+                merged = clusters - {cluster_id}
+                if merged:
+                    for other, other_cluster in self.cluster_of.items():
+                        if other_cluster in merged:
+                            self.cluster_of[other] = cluster_id
+                    self._conn.executemany("UPDATE images SET cluster_id = ? WHERE cluster_id = ?",
+                                           [(cluster_id, old) for old in merged])
+                    for row in rows:
+                        if row[6] in merged:
+                            row[6] = cluster_id
+                self.mih.add(item_id, phash, dhash)
+                self.cluster_of[item_id] = cluster_id
+                rows.append([item_id, url, f"{phash:016x}", f"{dhash:016x}", width, height, cluster_id, now])
+
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO images (id, url, phash, dhash, width, height, cluster_id, added_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+        return len(rows)
+
+    def assignments(self):
+        """DataFrame url, cluster_id, keep, cluster_size, distance (pHash tới ảnh được giữ)"""
+        with self._lock:
+            df = pd.read_sql_query("SELECT id, url, phash, width, height, cluster_id FROM images", self._conn)
+        df['keep'] = df['id'] == df['cluster_id']
+        df['cluster_size'] = df.groupby('cluster_id')['id'].transform('size')
+        keeper_hash = df.set_index('id')['phash']
+        df['distance'] = [hamming(int(h, 16), int(keeper_hash[c], 16))
+                          for h, c in zip(df['phash'], df['cluster_id'])]
+        return df.drop(columns=['id'])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def hash_url(url, http_cache):
+    """Tải ảnh (qua cache HTTP dùng chung) và tính hash; trả về None nếu lỗi"""
+    try:
+        response = http_cache.get(url, timeout=10, verify=False)
+        if response.status_code != 200:
+            return None
+        return compute_hashes(response.content)
+    except Exception:
+        return None
+
+
+def update_index(index, urls, max_workers=MAX_WORKERS):
+    """Tính hash cho các URL chưa có trong chỉ mục và nạp vào; trả về số ảnh mới"""
+    known = index.known_urls()
+    pending = [url for url in dict.fromkeys(urls) if isinstance(url, str) and url not in known]
+    if not pending:
+        return 0
+
+    http_cache = get_default_cache()
+    items = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(hash_url, url, http_cache): url for url in pending}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Đang tính perceptual hash"):
+            hashes = future.result()
+            if hashes is not None:
+                items.append((futures[future],) + hashes)
+    return index.add_many(items)
+
+
+def filter_keep_list(df, assignments, url_column='original_url'):
+    """Bỏ các dòng là bản sao; dòng không tính được hash vẫn được giữ"""
+    duplicates = set(assignments.loc[~assignments['keep'], 'url'])
+    return df[~df[url_column].isin(duplicates)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loại ảnh gần trùng bằng perceptual hash")
+    parser.add_argument('input_csv', help="CSV đầu vào có cột original_url")
+    parser.add_argument('output_csv', help="CSV đầu ra chỉ gồm ảnh được giữ (dùng cho bước gán caption)")
+    parser.add_argument('--index', default=INDEX_PATH, help="File SQLite lưu hash và cụm")
+    parser.add_argument('--clusters', help="Ghi thêm CSV phân cụm (url, cluster_id, keep, ...)")
+    parser.add_argument('--threshold', type=int, default=THRESHOLD, help="Khoảng cách Hamming pHash tối đa")
+    parser.add_argument('--dhash-threshold', type=int, default=DHASH_THRESHOLD)
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS)
+    args = parser.parse_args()
+
+    df = read_table(args.input_csv)
+    index = NearDuplicateIndex(args.index, args.threshold, args.dhash_threshold)
+    added = update_index(index, df['original_url'], args.workers)
+
+    assignments = index.assignments()
+    index.close()
+    kept = filter_keep_list(df, assignments)
+    write_table(kept, args.output_csv)
+    if args.clusters:
+        write_table(assignments, args.clusters)
+
+    in_input = assignments[assignments['url'].isin(df['original_url'])]
+    print(f"Đã nạp {added} ảnh mới, chỉ mục có {len(assignments)} ảnh "
+          f"trong {assignments['cluster_id'].nunique()} cụm")
+    print(f"Giữ {len(kept)}/{len(df)} dòng, bỏ {len(df) - len(kept)} bản sao "
+          f"({(~in_input['keep']).sum()} ảnh gần trùng)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra hàng loạt URL ảnh song song.
+
+Thay cho vòng lặp ``check_image_url`` tuần tự trong notebook tiền xử lý:
+  - các HEAD request chạy song song trên một connection pool dùng chung,
+  - giới hạn số request đồng thời trên mỗi host để không làm quá tải server,
+  - kết quả được lưu vào cache SQLite có TTL, lần chạy sau chỉ kiểm tra lại
+    các URL đã hết hạn.
+
+Dùng trong notebook:
+    from url_validator import validate_dataframe
+    clean_df, failed_urls, error_stats = validate_dataframe(final_df)
+
+Hoặc từ dòng lệnh:
+    python url_validator.py input.csv ./csv/valid_urls_dataset_v12.csv
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import pandas as pd
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+# Module dùng chung giữa các bước nằm trong thư mục common/ ở gốc repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from http_cache import get_default_cache
+from dataset_io import read_table, write_table
+from metrics import get_default_metrics, instrument
+from host_health import SKIP_BAD_URL, SKIP_HOST_OPEN, get_default_host_health
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+MAX_WORKERS = 32          # Số request đồng thời tối đa
+PER_HOST_LIMIT = 4        # Số request đồng thời tối đa trên một host
+CACHE_PATH = "url_check_cache.sqlite"
+CACHE_TTL = 7 * 24 * 3600  # Kết quả kiểm tra có hiệu lực trong 7 ngày
+# Lỗi HTTP 4xx không đổi khi thử lại sau; 408/429 là lỗi tạm thời
+TRANSIENT_HTTP_STATUSES = {408, 429}
+INVALID_URL_ERROR = "URL trống hoặc không phải chuỗi"
+
+
+def create_session(pool_size=MAX_WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(HEADERS)
+    return session
+
+
+@instrument('check_image_url')
+def check_image_url(url, max_retries=2, session=None, http_cache=None):
+    """Kiểm tra URL ảnh bằng HEAD request, trả về (thành công, thông báo lỗi).
+
+    Nếu ảnh đã có trong cache HTTP dùng chung (đã được tải ở bước khác)
+    thì coi là hợp lệ mà không cần gửi request. URL lỗi đã biết (cache âm của
+    host_health) bị coi là lỗi ngay, không chờ timeout. URL thuộc host đang bị
+    ngắt chưa kiểm tra được: trả về (None, SKIP_HOST_OPEN) để kiểm tra lại sau.
+    """
+    if http_cache is not None:
+        cached = http_cache.cached_headers(url)
+        if cached is not None and 'image' in cached.get('content-type', ''):
+            return True, None
+
+    http = session if session is not None else requests
+    metrics = get_default_metrics()
+    health = get_default_host_health()
+
+    for attempt in range(max_retries):
+        if attempt:
+            metrics.add_retries('check_image_url')
+        skip_reason = health.check(url)
+        if skip_reason is not None:
+            metrics.record_response('check_image_url', url, 'skipped')
+            return (None if skip_reason == SKIP_HOST_OPEN else False), skip_reason
+        try:
+            # Chỉ gửi HEAD request để kiểm tra metadata, không tải nội dung
+            response = http.head(
+                url,
+                headers=HEADERS,
+                timeout=5,  # Giảm timeout xuống vì chỉ check metadata
+                verify=False,
+                allow_redirects=True
+            )
+            metrics.record_response('check_image_url', url, str(response.status_code))
+            health.record_response(url, response.status_code, response.headers)
+
+            if response.status_code == 200:
+                content_type = response.headers.get('content-type', '')
+                if 'image' in content_type:
+                    return True, None
+                else:
+                    health.mark_bad(url, "không phải ảnh")
+                    return False, "Không phải file ảnh"
+            else:
+                return False, f"Lỗi HTTP {response.status_code}"
+
+        except requests.exceptions.SSLError as e:
+            health.record_exception(url, e)
+            metrics.record_response('check_image_url', url, 'SSLError')
+            if attempt == max_retries - 1:
+                return False, "Lỗi SSL"
+        except requests.exceptions.Timeout as e:
+            health.record_exception(url, e)
+            metrics.record_response('check_image_url', url, 'Timeout')
+            if attempt == max_retries - 1:
+                return False, "Timeout"
+        except requests.exceptions.ConnectionError as e:
+            health.record_exception(url, e)
+            metrics.record_response('check_image_url', url, 'ConnectionError')
+            if attempt == max_retries - 1:
+                return False, "Lỗi kết nối"
+            time.sleep(1)
+        except Exception as e:
+            # Ghi kết quả để request thử (half-open) của host không bị treo ở trạng thái đang thử
+            health.record_exception(url, e)
+            return False, f"Lỗi không xác định: {str(e)}"
+
+    return False, f"Thất bại sau {max_retries} lần thử"
+
+
+def is_cacheable(ok, error):
+    """Chỉ lưu kết quả ổn định: URL hợp lệ và lỗi vĩnh viễn (HTTP 4xx, không phải ảnh,
+    URL lỗi đã biết). Timeout, lỗi kết nối/SSL, 5xx... được kiểm tra lại ở lần chạy sau.
+    """
+    if ok is None:
+        return False
+    if ok or error in ("Không phải file ảnh", SKIP_BAD_URL):
+        return True
+    if error and error.startswith("Lỗi HTTP "):
+        status = error[len("Lỗi HTTP "):]
+        return status.isdigit() and 400 <= int(status) < 500 and int(status) not in TRANSIENT_HTTP_STATUSES
+    return False
+
+
+class ResultCache:
+    """Cache kết quả kiểm tra URL trong SQLite, mỗi kết quả có hạn dùng (TTL)"""
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS url_checks ("
+            " url TEXT PRIMARY KEY,"
+            " ok INTEGER NOT NULL,"
+            " error TEXT,"
+            " checked_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_fresh(self, urls):
+        """Trả về {url: (ok, error)} cho các URL có kết quả còn hạn"""
+        cutoff = time.time() - self.ttl
+        fresh = {}
+        urls = list(urls)
+        with self._lock:
+            # SQLite giới hạn số tham số trong một câu lệnh
+            for start in range(0, len(urls), 500):
+                chunk = urls[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT url, ok, error FROM url_checks"
+                    f" WHERE checked_at >= ? AND url IN ({placeholders})",
+                    [cutoff] + chunk
+                ).fetchall()
+                for url, ok, error in rows:
+                    fresh[url] = (bool(ok), error)
+        return fresh
+
+    def put_many(self, results):
+        """Lưu các kết quả ổn định (xem is_cacheable), bỏ qua lỗi tạm thời"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO url_checks (url, ok, error, checked_at) VALUES (?, ?, ?, ?)",
+                [(url, int(ok), error, now) for url, (ok, error) in results.items()
+                 if is_cacheable(ok, error)]
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _interleave_by_host(urls):
+    """Xếp URL xen kẽ giữa các host, để các worker không cùng chờ một host"""
+    by_host = defaultdict(deque)
+    for url in urls:
+        by_host[urlparse(url).netloc].append(url)
+    queues = list(by_host.values())
+    ordered = []
+    while queues:
+        queues = [q for q in queues if q]
+        for q in queues:
+            ordered.append(q.popleft())
+    return ordered
+
+
+def validate_urls(urls, max_workers=MAX_WORKERS, per_host_limit=PER_HOST_LIMIT,
+                  cache=None, max_retries=2, use_http_cache=True):
+    """Kiểm tra song song danh sách URL, trả về {url: (ok, error)}.
+
+    URL có kết quả còn hạn trong cache sẽ không bị kiểm tra lại. ok là None
+    với URL chưa kiểm tra được (host tạm ngắt). Chỉ kết quả ổn định được ghi
+    vào cache (is_cacheable), lỗi tạm thời được kiểm tra lại ở lần chạy sau.
+    """
+    urls = list(dict.fromkeys(u for u in urls if isinstance(u, str)))
+    results = cache.get_fresh(urls) if cache is not None else {}
+    pending = [u for u in urls if u not in results]
+    if results:
+        print(f"Dùng lại {len(results)} kết quả từ cache, cần kiểm tra {len(pending)} URL")
+
+    host_limits = defaultdict(lambda: threading.BoundedSemaphore(per_host_limit))
+    host_limits_lock = threading.Lock()
+    session = create_session(max_workers)
+    http_cache = get_default_cache() if use_http_cache else None
+
+    def check(url):
+        host = urlparse(url).netloc
+        with host_limits_lock:
+            limit = host_limits[host]
+        with limit:
+            return check_image_url(url, max_retries=max_retries, session=session,
+                                   http_cache=http_cache)
+
+    new_results = {}
+    batch = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(check, url): url for url in _interleave_by_host(pending)}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Đang kiểm tra URLs"):
+            url = futures[future]
+            try:
+                batch[url] = future.result()
+            except Exception as e:
+                get_default_host_health().record_exception(url, e)
+                batch[url] = (False, f"Lỗi không xác định: {str(e)}")
+
+            # Ghi cache theo đợt để dừng giữa chừng vẫn giữ được kết quả
+            if len(batch) >= 500:
+                if cache is not None:
+                    cache.put_many(batch)
+                new_results.update(batch)
+                batch = {}
+
+    if cache is not None and batch:
+        cache.put_many(batch)
+    new_results.update(batch)
+    session.close()
+
+    results.update(new_results)
+    return results
+
+
+def validate_dataframe(df, url_column='original_url', **kwargs):
+    """Kiểm tra URL của DataFrame, trả về (clean_df, failed_urls, error_stats).
+
+    failed_urls là danh sách (url, lỗi) và error_stats là {lỗi: số URL},
+    giống kết quả của vòng lặp trong notebook. clean_df chỉ gồm URL đã kiểm tra
+    là hợp lệ; URL chưa kiểm tra được (host tạm ngắt) nằm trong failed_urls với
+    lỗi SKIP_HOST_OPEN, lấy lại các dòng đó bằng retry_rows() để kiểm tra lại sau.
+    """
+    results = validate_urls(df[url_column], **kwargs)
+
+    results_df = pd.DataFrame(
+        [(url, ok, error) for url, (ok, error) in results.items()],
+        columns=[url_column, '_url_ok', '_url_error']
+    )
+    merged = df.merge(results_df, on=url_column, how='left', validate='many_to_one')
+    # URL NaN/không phải chuỗi không được kiểm tra: ghi lỗi rõ ràng để được đếm trong error_stats
+    invalid = ~merged[url_column].map(lambda url: isinstance(url, str)).to_numpy(dtype=bool)
+    merged.loc[invalid, '_url_ok'] = False
+    merged.loc[invalid, '_url_error'] = INVALID_URL_ERROR
+    ok_mask = merged['_url_ok'].eq(True).to_numpy()
+
+    failed = merged.loc[~ok_mask, [url_column, '_url_error']]
+    failed_urls = list(failed.itertuples(index=False, name=None))
+    error_stats = failed['_url_error'].value_counts(sort=False).to_dict()
+
+    clean_df = df[ok_mask]
+    return clean_df, failed_urls, error_stats
+
+
+def retry_rows(df, failed_urls, url_column='original_url'):
+    """Các dòng của ``df`` có URL chưa kiểm tra được vì host tạm ngắt (cần kiểm tra lại sau)"""
+    pending = {url for url, error in failed_urls if error == SKIP_HOST_OPEN}
+    return df[df[url_column].isin(pending)]
+
+
+def save_invalid_urls(failed_urls, path='invalid_urls.txt'):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("URL,Lỗi\n")
+        for url, error in failed_urls:
+            f.write(f"{url},{error}\n")
+
+
+def print_report(df, clean_df, failed_urls, error_stats):
+    print("\n=== THỐNG KÊ KẾT QUẢ KIỂM TRA URL ===")
+    print(f"Tổng số URL: {len(df)}")
+    pending = error_stats.get(SKIP_HOST_OPEN, 0)
+    print(f"Số URL hợp lệ: {len(df) - len(failed_urls)}")
+    print(f"Số URL không hợp lệ: {len(failed_urls) - pending}")
+    if pending:
+        print(f"Số URL chưa kiểm tra được (host tạm ngắt, cần kiểm tra lại): {pending}")
+
+    print("\n=== CHI TIẾT LỖI ===")
+    for error_type, count in error_stats.items():
+        print(f"{error_type}: {count} URLs")
+
+    print("\n=== THÔNG TIN DATASET SAU KHI LỌC ===")
+    print(f"Kích thước ban đầu: {df.shape}")
+    print(f"Kích thước sau khi lọc: {clean_df.shape}")
+    if 'source_website' in clean_df.columns:
+        print("\nPhân bố dữ liệu theo source_website:")
+        print(clean_df['source_website'].value_counts().head())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm tra song song URL ảnh trong file CSV")
+    parser.add_argument('input_csv', help="CSV/Parquet đầu vào có cột original_url")
+    parser.add_argument('output_csv', help="CSV đầu ra chỉ gồm các URL hợp lệ")
+    parser.add_argument('--invalid-out', default='invalid_urls.txt',
+                        help="File ghi danh sách URL không hợp lệ")
+    parser.add_argument('--retry-out', default='retry_urls.csv',
+                        help="CSV/Parquet các dòng chưa kiểm tra được (host tạm ngắt), dùng làm đầu vào lần chạy sau")
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help="Số request đồng thời tối đa")
+    parser.add_argument('--per-host', type=int, default=PER_HOST_LIMIT,
+                        help="Số request đồng thời tối đa trên một host")
+    parser.add_argument('--cache', default=CACHE_PATH,
+                        help="File cache kết quả kiểm tra")
+    parser.add_argument('--ttl-hours', type=float, default=CACHE_TTL / 3600,
+                        help="Thời gian hiệu lực của kết quả trong cache (giờ)")
+    parser.add_argument('--no-cache', action='store_true', help="Không dùng cache")
+    args = parser.parse_args()
+
+    df = read_table(args.input_csv)
+    cache = None if args.no_cache else ResultCache(args.cache, ttl=args.ttl_hours * 3600)
+
+    clean_df, failed_urls, error_stats = validate_dataframe(
+        df, max_workers=args.workers, per_host_limit=args.per_host, cache=cache)
+    if cache is not None:
+        cache.close()
+
+    print_report(df, clean_df, failed_urls, error_stats)
+    save_invalid_urls([(url, error) for url, error in failed_urls if error != SKIP_HOST_OPEN], args.invalid_out)
+    write_table(clean_df, args.output_csv)
+    retry_df = retry_rows(df, failed_urls)
+    if len(retry_df):
+        write_table(retry_df, args.retry_out)
+        print(f"{len(retry_df)} dòng cần kiểm tra lại -> {args.retry_out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Gộp nhiều ảnh vào một request Gemini và tách câu trả lời về từng ảnh.
+
+Mỗi ảnh được đặt sau nhãn "Ảnh k:" và model được yêu cầu trả lời đúng một
+dòng "k: <mô tả>" cho mỗi ảnh. Caption bị thiếu, trùng số thứ tự hoặc sai
+định dạng được coi là không hợp lệ để bên gọi gán lại bằng request một ảnh.
+"""
+import re
+
+BATCH_INSTRUCTION = """Bạn sẽ nhận {count} ảnh, được đánh số từ 1 đến {count}.
+Với MỖI ảnh, thực hiện yêu cầu sau:
+{prompt}
+
+Trả lời đúng {count} dòng, mỗi dòng có dạng "<số thứ tự ảnh>: <mô tả>", theo thứ tự từ 1 đến {count}.
+Không thêm lời dẫn, tiêu đề hay dòng trống nào khác."""
+
+# "1: ...", "1. ...", "1) ...", "Ảnh 1: ...", "- **1**: ..."
+LINE_PATTERN = re.compile(r'^\s*(?:[-*•]\s*)?\**\s*(?:ảnh|image)?\s*(\d+)\s*\**\s*[:.)\-–]\s*(.+?)\s*$',
+                          re.IGNORECASE)
+
+MAX_CAPTION_WORDS = 40  # Dài hơn mức này coi như model trả lời sai định dạng
+
+
+def build_batch_parts(prompt, images):
+    """Danh sách phần nội dung cho generate_multi: hướng dẫn rồi lần lượt nhãn + ảnh"""
+    parts = [BATCH_INSTRUCTION.format(count=len(images), prompt=prompt)]
+    for index, image in enumerate(images, start=1):
+        parts.append(f"Ảnh {index}:")
+        parts.append(image)
+    return parts
+
+
+def _clean_caption(caption):
+    caption = caption.strip().strip('"“”\'').strip()
+    caption = re.sub(r'^\*+|\*+$', '', caption).strip()
+    return caption
+
+
+def parse_batch_response(text, count):
+    """Tách câu trả lời thành {số thứ tự (1..count): caption}, chỉ giữ caption hợp lệ"""
+    captions = {}
+    duplicated = set()
+    for line in (text or '').splitlines():
+        match = LINE_PATTERN.match(line)
+        if not match:
+            continue
+        index = int(match.group(1))
+        caption = _clean_caption(match.group(2))
+        if not 1 <= index <= count:
+            continue
+        if index in captions:
+            duplicated.add(index)
+            continue
+        if caption and len(caption.split()) <= MAX_CAPTION_WORDS:
+            captions[index] = caption
+
+    for index in duplicated:
+        captions.pop(index, None)
+    return captions
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Cache caption theo (hash nội dung ảnh, hash prompt, tên model, tham số sinh).
+
+get_prediction tra cache này trước khi gọi API: ảnh đã được gán caption với
+đúng prompt và model đó thì không phải trả tiền gọi lại, kể cả khi ảnh nằm
+ở một phiên bản CSV khác hay dưới một URL khác.
+
+Xem thống kê và dọn cache từ dòng lệnh:
+    python caption_cache.py stats
+    python caption_cache.py prune --older-than-days 90
+    python caption_cache.py prune --model gemini-1.5-flash
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  '..', 'output', 'caption_cache.sqlite')
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class CaptionCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS captions ("
+            " key TEXT PRIMARY KEY,"
+            " image_sha256 TEXT NOT NULL,"
+            " prompt_sha256 TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " params TEXT NOT NULL,"
+            " caption TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_hit REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(image_sha256, prompt, model, params=None):
+        """Khóa cache; trả về (key, prompt_sha256, params_json)"""
+        prompt_sha256 = hash_text(prompt)
+        params_json = json.dumps(params or {}, sort_keys=True, ensure_ascii=False)
+        key = hash_text('\n'.join([image_sha256, prompt_sha256, model, params_json]))
+        return key, prompt_sha256, params_json
+
+    def get(self, image_sha256, prompt, model, params=None):
+        key, _, _ = self.make_key(image_sha256, prompt, model, params)
+        with self._lock:
+            row = self._conn.execute("SELECT caption FROM captions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE captions SET last_hit = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return row[0]
+
+    def put(self, image_sha256, prompt, model, caption, params=None):
+        key, prompt_sha256, params_json = self.make_key(image_sha256, prompt, model, params)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO captions"
+                " (key, image_sha256, prompt_sha256, model, params, caption, created_at, last_hit)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, image_sha256, prompt_sha256, model, params_json, caption, now, now)
+            )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM captions").fetchone()[0]
+            by_model = self._conn.execute(
+                "SELECT model, prompt_sha256, COUNT(*) FROM captions"
+                " GROUP BY model, prompt_sha256 ORDER BY COUNT(*) DESC"
+            ).fetchall()
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'by_model_prompt': [
+                {'model': model, 'prompt_sha256': prompt_sha256[:12], 'entries': count}
+                for model, prompt_sha256, count in by_model
+            ],
+        }
+
+    def prune(self, older_than_days=None, model=None, prompt_sha256=None):
+        """Xóa các entry thỏa mọi điều kiện đã cho, trả về số entry bị xóa"""
+        conditions, params = [], []
+        if older_than_days is not None:
+            conditions.append("last_hit < ?")
+            params.append(time.time() - older_than_days * 24 * 3600)
+        if model is not None:
+            conditions.append("model = ?")
+            params.append(model)
+        if prompt_sha256 is not None:
+            conditions.append("prompt_sha256 LIKE ?")
+            params.append(prompt_sha256 + '%')
+        if not conditions:
+            return 0
+
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM captions WHERE " + " AND ".join(conditions), params)
+            self._conn.commit()
+        with self._lock:
+            self._conn.execute("VACUUM")
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_caption_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = CaptionCache()
+        return _default_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xem thống kê và dọn cache caption")
+    parser.add_argument('--path', default=DEFAULT_CACHE_PATH, help="File cache caption")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help="In thống kê cache")
+    prune_parser = subparsers.add_parser('prune', help="Xóa bớt entry trong cache")
+    prune_parser.add_argument('--older-than-days', type=float,
+                              help="Xóa entry không được dùng trong N ngày gần đây")
+    prune_parser.add_argument('--model', help="Chỉ xóa entry của model này")
+    prune_parser.add_argument('--prompt-hash', help="Chỉ xóa entry của prompt có hash bắt đầu bằng chuỗi này")
+    args = parser.parse_args()
+
+    cache = CaptionCache(args.path)
+    if args.command == 'stats':
+        print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+    else:
+        removed = cache.prune(args.older_than_days, args.model, args.prompt_hash)
+        print(f"Đã xóa {removed} entry, còn lại {cache.stats()['entries']}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
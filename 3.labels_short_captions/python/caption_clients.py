@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Các client sinh caption dùng cho get_prediction / process_dataset.
+
+Mọi client có chung hai hàm:
+  - ``generate(prompt, image) -> str``: một ảnh, một caption
+  - ``generate_multi(parts) -> str``: một request gồm nhiều phần (chuỗi và ảnh xen kẽ),
+    dùng cho chế độ gán caption theo lô
+nhờ đó có thể thay Gemini bằng FakeCaptionClient để chạy thử và đo hiệu năng
+pipeline mà không cần gọi API thật.
+"""
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from image_loader import encode_jpeg
+
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+
+
+class GeminiClient:
+    """Client gọi Gemini qua google.generativeai (cần gọi init_gemini trước)"""
+
+    def __init__(self, model_name=GEMINI_MODEL_NAME, generation_config=None):
+        import google.generativeai as genai
+        self.model_name = model_name
+        self.generation_config = generation_config or {}
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt, image):
+        return self.generate_multi([prompt, image])
+
+    def generate_multi(self, parts):
+        # Tự mã hóa JPEG gọn với chất lượng cố định để kiểm soát kích thước payload
+        contents = [part if isinstance(part, str)
+                    else {'mime_type': 'image/jpeg', 'data': encode_jpeg(part)}
+                    for part in parts]
+        if self.generation_config:
+            response = self.model.generate_content(contents, generation_config=self.generation_config)
+        else:
+            response = self.model.generate_content(contents)
+        return response.text
+
+
+class FakeRateLimitError(Exception):
+    """Lỗi giả lập HTTP 429 / hết quota"""
+
+
+class FakeCaptionClient:
+    """Model giả chạy cục bộ: có độ trễ cấu hình được và giả lập lỗi 429.
+
+    - ``latency``/``jitter``: thời gian xử lý mỗi request (giây)
+    - ``rpm_limit``: vượt quá số request này trong 60 giây gần nhất sẽ báo 429
+    - ``error_rate``: tỷ lệ request báo 429 ngẫu nhiên
+    - ``per_image_latency``: thời gian cộng thêm cho mỗi ảnh trong request nhiều ảnh
+    - ``drop_rate``: tỷ lệ caption bị thiếu trong câu trả lời nhiều ảnh
+    """
+
+    CAPTIONS = [
+        "Đường phố đông xe máy, người đi bộ chờ sang đường tại vạch kẻ.",
+        "Ngã tư có đèn tín hiệu đỏ, các phương tiện đang dừng chờ.",
+        "Vỉa hè bị xe máy lấn chiếm, người đi bộ phải đi dưới lòng đường.",
+        "Đường ngập nước sau mưa, xe cộ di chuyển chậm và khó khăn.",
+    ]
+
+    def __init__(self, latency=0.5, jitter=0.1, rpm_limit=None, error_rate=0.0,
+                 per_image_latency=0.05, drop_rate=0.0, model_name='fake-caption-model', seed=0):
+        self.model_name = model_name
+        self.generation_config = {}
+        self.per_image_latency = per_image_latency
+        self.drop_rate = drop_rate
+        self.latency = latency
+        self.jitter = jitter
+        self.rpm_limit = rpm_limit
+        self.error_rate = error_rate
+        self.calls = 0
+        self.rate_limited = 0
+        self._recent = deque()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _start_request(self, image_count):
+        """Đếm request, giả lập 429 và trả về thời gian xử lý"""
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            over_quota = self.rpm_limit is not None and len(self._recent) >= self.rpm_limit
+            random_error = self._random.random() < self.error_rate
+            if over_quota or random_error:
+                self.rate_limited += 1
+                raise FakeRateLimitError("429 Resource has been exhausted (e.g. check quota).")
+            self._recent.append(now)
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+            return max(0.0, delay + self.per_image_latency * (image_count - 1))
+
+    def _caption_for(self, image, prompt):
+        # Caption cố định theo ảnh để kết quả lặp lại được giữa các lần chạy
+        digest = hashlib.md5(f"{getattr(image, 'size', '')}{prompt}".encode('utf-8')).digest()
+        return self.CAPTIONS[digest[0] % len(self.CAPTIONS)]
+
+    def generate(self, prompt, image):
+        time.sleep(self._start_request(1))
+        return self._caption_for(image, prompt)
+
+    def generate_multi(self, parts):
+        prompt = next(part for part in parts if isinstance(part, str))
+        images = [part for part in parts if not isinstance(part, str)]
+        time.sleep(self._start_request(len(images)))
+        lines = []
+        for index, image in enumerate(images, start=1):
+            with self._lock:
+                dropped = self._random.random() < self.drop_rate
+            if not dropped:
+                lines.append(f"{index}: {self._caption_for(image, prompt)}")
+        return '\n'.join(lines)
+
+
+def is_rate_limit_error(error):
+    """Nhận biết lỗi 429/hết quota (Gemini báo ResourceExhausted)"""
+    name = type(error).__name__
+    if name in ('ResourceExhausted', 'TooManyRequests', 'FakeRateLimitError'):
+        return True
+    message = str(error).lower()
+    return '429' in message or 'quota' in message or 'rate limit' in message
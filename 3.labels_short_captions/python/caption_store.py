@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Lưu caption tăng dần vào SQLite thay vì ghi lại toàn bộ CSV.
+
+Mỗi caption được ghi thành một dòng (khóa là URL ảnh) và commit ngay, nên
+tiến trình dừng đột ngột cũng không làm hỏng dữ liệu đã có. CSV cuối cùng
+chỉ được ghi một lần, bằng một lượt ghép caption vào DataFrame, và được
+thay thế nguyên tử (ghi ra file tạm rồi đổi tên). Nguồn ảnh đã dùng để gán
+caption (ảnh gốc hay thumbnail) được lưu cùng và ghi ra cột ``caption_source``.
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import pandas as pd
+
+# Module dùng chung giữa các bước nằm trong thư mục common/ ở gốc repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from dataset_io import write_table
+
+
+class CaptionStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS captions ("
+            " url TEXT PRIMARY KEY,"
+            " caption TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        # Store tạo trước khi có cột source
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(captions)")}
+        if 'source' not in columns:
+            self._conn.execute("ALTER TABLE captions ADD COLUMN source TEXT")
+        self._conn.commit()
+
+    def put(self, url, caption, source=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO captions (url, caption, created_at, source) VALUES (?, ?, ?, ?)",
+                (url, caption, time.time(), source)
+            )
+            self._conn.commit()
+
+    def put_many(self, items):
+        """Ghi nhiều (url, caption) trong một transaction"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO captions (url, caption, created_at) VALUES (?, ?, ?)",
+                [(url, caption, now) for url, caption in items]
+            )
+            self._conn.commit()
+
+    def urls(self):
+        """Tập URL đã có caption"""
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT url FROM captions")}
+
+    def to_series(self):
+        """Toàn bộ caption dạng Series (index là URL)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT url, caption FROM captions").fetchall()
+        urls = [url for url, _ in rows]
+        captions = [caption for _, caption in rows]
+        return pd.Series(captions, index=urls, dtype=object)
+
+    def sources(self):
+        """Nguồn ảnh của các caption có ghi nguồn, dạng Series (index là URL)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT url, source FROM captions WHERE source IS NOT NULL").fetchall()
+        return pd.Series([source for _, source in rows], index=[url for url, _ in rows], dtype=object)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM captions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def default_store_path(csv_path):
+    return os.path.splitext(csv_path)[0] + '_captions.sqlite'
+
+
+def seed_from_dataframe(store, df, url_column='original_url', caption_column='short_caption'):
+    """Nạp các caption đã có sẵn trong CSV vào store (chỉ cần ở lần chạy đầu)"""
+    has_caption = df[caption_column].notna() & df[url_column].notna()
+    existing = df.loc[has_caption, [url_column, caption_column]].drop_duplicates(url_column)
+    if len(existing):
+        store.put_many(existing.itertuples(index=False, name=None))
+
+
+def pending_rows(store, df, url_column='original_url'):
+    """Chỉ số các dòng chưa có caption trong store"""
+    done = store.urls()
+    mask = ~df[url_column].isin(done) & df[url_column].notna()
+    return list(df.index[mask])
+
+
+def write_merged_csv(store, df, csv_path, url_column='original_url', caption_column='short_caption',
+                     source_column='caption_source'):
+    """Ghép caption (và nguồn ảnh nếu có) từ store vào DataFrame, ghi CSV/Parquet nguyên tử trong một lượt"""
+    captions = store.to_series()
+    merged = df.copy()
+    merged[caption_column] = merged[url_column].map(captions).combine_first(merged[caption_column])
+    sources = store.sources()
+    if len(sources):
+        mapped = merged[url_column].map(sources)
+        merged[source_column] = mapped.combine_first(merged[source_column]) if source_column in merged else mapped
+    write_table(merged, csv_path)
+    return merged
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""So sánh caption gán từ thumbnail và từ ảnh gốc trên một mẫu dữ liệu.
+
+Với mỗi dòng mẫu có cả ``original_url`` và ``thumbnail_url``: tải hai ảnh, gán
+caption cho từng ảnh bằng cùng prompt/model, rồi đo độ trùng giữa hai caption
+(Jaccard trên tập từ sau khi bỏ dấu câu, chữ thường). Báo cáo gồm tỷ lệ đồng ý
+(Jaccard >= ``--threshold``), dung lượng và thời gian tải trung bình theo nguồn,
+và tỷ lệ thumbnail đạt cạnh ngắn tối thiểu của chế độ --thumbnail-first.
+
+Chạy:
+    python compare_caption_sources.py --csv ./cleaned_dataset.csv --sample 100
+    python compare_caption_sources.py --csv ... --fake-model --output compare.csv   # ghi từng cặp caption
+Kết quả tổng hợp in ra dạng JSON. Caption của --fake-model chỉ phụ thuộc kích
+thước ảnh nên tỷ lệ đồng ý khi đó không có ý nghĩa (chỉ để chạy thử).
+
+Ảnh được tải thẳng qua mạng, không qua cache HTTP dùng chung: URL đã có trong
+cache sẽ cho thời gian tải gần 0 và làm lệch phép so sánh.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from label_short_captions import (OPTIMIZED_PROMPT, THUMBNAIL_MIN_SIDE, FakeCaptionClient,
+                                  get_default_client, get_prediction, image_min_side, init_gemini)
+from dataset_io import read_table, write_table
+
+AGREEMENT_THRESHOLD = 0.5
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def caption_words(caption):
+    return set(WORD_PATTERN.findall(str(caption).lower()))
+
+
+def jaccard(first, second):
+    first, second = caption_words(first), caption_words(second)
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def create_session(pool_size=8):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def timed_fetch(url, session):
+    """Tải ảnh qua mạng (bỏ qua cache HTTP), trả về (bytes hoặc None, số giây)"""
+    start = time.perf_counter()
+    try:
+        response = session.get(url, timeout=10, verify=False)
+        data = response.content if response.status_code == 200 else None
+    except requests.exceptions.RequestException as e:
+        print(f"Error loading image from URL: {e}")
+        data = None
+    return data, time.perf_counter() - start
+
+
+def compare_row(row, prompt, client, session):
+    """Gán caption từ hai nguồn cho một dòng, trả về dict kết quả"""
+    result = {'original_url': row['original_url'], 'thumbnail_url': row['thumbnail_url']}
+    for source, url in (('thumbnail', row['thumbnail_url']), ('original', row['original_url'])):
+        data, elapsed = timed_fetch(url, session)
+        result[f'{source}_fetch_s'] = elapsed
+        result[f'{source}_bytes'] = len(data) if data is not None else None
+        result[f'{source}_min_side'] = None
+        result[f'{source}_caption'] = None
+        if data is None:
+            continue
+        try:
+            result[f'{source}_min_side'] = image_min_side(data)
+        except Exception:
+            continue
+        result[f'{source}_caption'] = get_prediction(url, prompt, client=client, image_bytes=data)
+    if result['thumbnail_caption'] and result['original_caption']:
+        result['jaccard'] = jaccard(result['thumbnail_caption'], result['original_caption'])
+    else:
+        result['jaccard'] = None
+    return result
+
+
+def summarize(results, threshold=AGREEMENT_THRESHOLD, min_side=THUMBNAIL_MIN_SIDE):
+    df = pd.DataFrame(results)
+    pairs = df[df['jaccard'].notna()]
+    summary = {
+        'rows': len(df),
+        'pairs': len(pairs),
+        'agreement_rate': float((pairs['jaccard'] >= threshold).mean()) if len(pairs) else None,
+        'exact_match_rate': float((pairs['thumbnail_caption'] == pairs['original_caption']).mean())
+        if len(pairs) else None,
+        'jaccard_mean': float(pairs['jaccard'].mean()) if len(pairs) else None,
+        'threshold': threshold,
+        'thumbnail_usable_rate': float((df['thumbnail_min_side'].fillna(0) >= min_side).mean()) if len(df) else None,
+        'thumbnail_min_side': min_side,
+    }
+    for source in ('thumbnail', 'original'):
+        fetched = df[df[f'{source}_bytes'].notna()]
+        summary[source] = {
+            'fetched': len(fetched),
+            'failed': len(df) - len(fetched),
+            'kb_mean': float(fetched[f'{source}_bytes'].mean() / 1024) if len(fetched) else None,
+            'fetch_s_p50': percentile(df[f'{source}_fetch_s'].tolist(), 0.5),
+            'fetch_s_p95': percentile(df[f'{source}_fetch_s'].tolist(), 0.95),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh caption từ thumbnail và từ ảnh gốc")
+    parser.add_argument('--csv', required=True, help="CSV/Parquet có original_url và thumbnail_url")
+    parser.add_argument('--sample', type=int, default=100, help="Số dòng lấy mẫu")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--threshold', type=float, default=AGREEMENT_THRESHOLD,
+                        help="Jaccard tối thiểu để coi hai caption là đồng ý")
+    parser.add_argument('--thumbnail-min-side', type=int, default=THUMBNAIL_MIN_SIDE)
+    parser.add_argument('--output', help="Ghi từng cặp caption ra CSV/Parquet")
+    parser.add_argument('--fake-model', action='store_true', help="Dùng model giả cục bộ thay cho Gemini")
+    args = parser.parse_args()
+
+    if args.fake_model:
+        client = FakeCaptionClient()
+    else:
+        init_gemini(os.environ.get('GEMINI_API_KEY', "AIzaSxxxxxxxxxxxxxxxxxxx"))
+        client = get_default_client()
+
+    df = read_table(args.csv)
+    if 'thumbnail_url' not in df.columns:
+        raise SystemExit(f"{args.csv} không có cột thumbnail_url")
+    candidates = df[df['original_url'].notna() & df['thumbnail_url'].notna()]
+    sample = candidates.sample(min(args.sample, len(candidates)), random_state=args.seed)
+    rows = sample[['original_url', 'thumbnail_url']].to_dict('records')
+
+    session = create_session(args.workers)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(tqdm(executor.map(lambda row: compare_row(row, OPTIMIZED_PROMPT, client, session), rows),
+                            total=len(rows), desc="Comparing"))
+    session.close()
+
+    if args.output:
+        write_table(pd.DataFrame(results), args.output)
+    print(json.dumps(summarize(results, args.threshold, args.thumbnail_min_side), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
 import os
+import sys
 import logging
 import warnings
 import urllib3
+import argparse
+import threading
 import pandas as pd
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm  # Để hiển thị progress bar
 
 # Suppress all warnings
@@ -12,91 +16,475 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 logging.getLogger().setLevel(logging.ERROR)
 
-import google.generativeai as genai
 import requests
 from PIL import Image
 from io import BytesIO
 
+# Module dùng chung giữa các bước nằm trong thư mục common/ ở gốc repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from http_cache import get_default_cache
+from dataset_io import read_table
+from image_loader import load_thumbnail
+from rate_limit import TokenBucket, AdaptiveConcurrency
+from caption_clients import GeminiClient, FakeCaptionClient, is_rate_limit_error
+from caption_cache import get_default_caption_cache, hash_bytes
+from batch_prompt import build_batch_parts, parse_batch_response
+from metrics import get_default_metrics, instrument
+from caption_store import CaptionStore, default_store_path, seed_from_dataframe, pending_rows, write_merged_csv
+
+# Cấu hình chế độ gán caption song song
+MAX_WORKERS = 16          # Số lời gọi đồng thời tối đa
+INITIAL_CONCURRENCY = 4   # Số lời gọi đồng thời lúc bắt đầu (tự điều chỉnh sau đó)
+REQUESTS_PER_MINUTE = 1000
+TOKENS_PER_MINUTE = 1000000
+IMAGE_TOKENS = 258        # Số token Gemini tính cho một ảnh
+OUTPUT_TOKENS = 60        # Ước lượng token của một caption 10-15 từ
+IMAGES_PER_REQUEST = 1    # Số ảnh gộp trong một request (chế độ theo lô khi > 1)
+THUMBNAIL_MIN_SIDE = 200  # Cạnh ngắn tối thiểu để dùng thumbnail thay ảnh gốc (chế độ thumbnail trước)
+
+# Nguồn ảnh đã dùng để gán caption (cột caption_source)
+SOURCE_ORIGINAL = 'original'
+SOURCE_THUMBNAIL = 'thumbnail'
+SOURCE_THUMBNAIL_LOWRES = 'thumbnail_lowres'  # thumbnail nhỏ hơn ngưỡng, dùng vì ảnh gốc không tải được
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
 def init_gemini(api_key):
     """Initialize Gemini API"""
+    import google.generativeai as genai
     genai.configure(api_key=api_key)
 
-def load_image_from_url(url):
-    """Load image from URL with resize"""
+def get_default_client():
+    """Client Gemini dùng chung: model chỉ được tạo một lần và dùng lại cho mọi lời gọi"""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = GeminiClient()
+        return _default_client
+
+def estimate_tokens(prompt, image_count=1):
+    """Ước lượng số token một request tiêu tốn (prompt + ảnh + caption)"""
+    return len(prompt) // 4 + image_count * (IMAGE_TOKENS + OUTPUT_TOKENS)
+
+class CaptionStats:
+    """Thống kê số request, số ảnh gộp theo lô và số ảnh phải gán lại từng ảnh.
+
+    Request thất bại (model không trả caption sau mọi lần thử) được đếm riêng,
+    không tính vào requests/fallbacks và số ảnh trung bình mỗi request.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.failed_requests = 0
+        self.batched_images = 0
+        self.batch_parsed = 0
+        self.fallbacks = 0
+        self.singles = 0
+        self._lock = threading.Lock()
+
+    def record_batch(self, images, parsed, ok=True):
+        with self._lock:
+            if not ok:
+                self.failed_requests += 1
+                return
+            self.requests += 1
+            self.batched_images += images
+            self.batch_parsed += parsed
+
+    def record_single(self, fallback=False, ok=True):
+        with self._lock:
+            if not ok:
+                self.failed_requests += 1
+                return
+            self.requests += 1
+            if fallback:
+                self.fallbacks += 1
+            else:
+                self.singles += 1
+
+    def summary(self):
+        images = self.batch_parsed + self.fallbacks + self.singles
+        return (f"requests={self.requests}, failed requests={self.failed_requests}, "
+                f"batched images={self.batched_images}, "
+                f"parsed from batches={self.batch_parsed}, single-image fallbacks={self.fallbacks}, "
+                f"avg images/request={images / max(self.requests, 1):.2f}")
+
+class CaptionRateController:
+    """Gộp giới hạn request/phút, token/phút và số lời gọi đồng thời tự điều chỉnh.
+
+    Giới hạn request/phút hoặc token/phút bằng 0 nghĩa là không giới hạn (như search_stage).
+    """
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 initial_concurrency=INITIAL_CONCURRENCY, max_concurrency=MAX_WORKERS):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.concurrency = AdaptiveConcurrency(initial=initial_concurrency, maximum=max_concurrency)
+
+    def call(self, func, tokens):
+        self.concurrency.acquire()
+        try:
+            if self.requests is not None:
+                self.requests.acquire(1)
+            if self.tokens is not None:
+                self.tokens.acquire(tokens)
+            result = func()
+        except Exception as e:
+            if is_rate_limit_error(e):
+                self.concurrency.on_rate_limit()
+            raise
+        finally:
+            self.concurrency.release()
+        self.concurrency.on_success()
+        return result
+
+@instrument('fetch_image_bytes')
+def fetch_image_bytes(url):
+    """Tải nội dung ảnh gốc (qua cache HTTP dùng chung), trả về bytes hoặc None"""
+    metrics = get_default_metrics()
     try:
-        response = requests.get(url, timeout=10, verify=False)  # Bỏ qua SSL verify
+        response = get_default_cache().get(url, timeout=10, verify=False)  # Bỏ qua SSL verify
+        metrics.record_response('fetch_image_bytes', url, str(response.status_code))
         response.raise_for_status()
-        image = Image.open(BytesIO(response.content))
-        
-        # Resize image if too large
-        max_size = (800, 800)  # Giới hạn kích thước tối đa
-        if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
-            image.thumbnail(max_size, Image.Resampling.LANCZOS)
-            
-        return image
+        metrics.add_bytes('fetch_image_bytes', len(response.content))
+        return response.content
+    except requests.exceptions.HTTPError as e:
+        print(f"Error loading image from URL: {e}")
+        return None
     except Exception as e:
+        metrics.record_response('fetch_image_bytes', url, type(e).__name__)
         print(f"Error loading image from URL: {e}")
         return None
 
-def get_prediction(image_url, prompt, max_retries=3):
-    """Get prediction with retries"""
+def image_min_side(data):
+    """Cạnh ngắn của ảnh, chỉ đọc header (không giải mã)"""
+    with Image.open(BytesIO(data)) as image:
+        return min(image.size)
+
+def fetch_caption_image(original_url, thumbnail_url=None, min_side=THUMBNAIL_MIN_SIDE):
+    """Chọn ảnh để gán caption: thumbnail nếu cạnh ngắn >= ``min_side``, ngược lại ảnh gốc.
+
+    Thumbnail (ảnh Google lưu sẵn, vài chục KB) đủ cho caption 10-15 từ và
+    tránh phải tải ảnh gốc nhiều MB từ host chậm. Trả về (bytes, nguồn),
+    hoặc (None, None) khi không tải được ảnh nào.
+    """
+    thumbnail = None
+    if thumbnail_url and not pd.isna(thumbnail_url):
+        thumbnail = fetch_image_bytes(thumbnail_url)
+        if thumbnail is not None:
+            try:
+                if image_min_side(thumbnail) >= min_side:
+                    get_default_metrics().inc('caption_source_total', source=SOURCE_THUMBNAIL)
+                    return thumbnail, SOURCE_THUMBNAIL
+            except Exception as e:
+                print(f"Error loading image from URL: {e}")
+                thumbnail = None
+
+    data = fetch_image_bytes(original_url)
+    source = SOURCE_ORIGINAL
+    if data is None and thumbnail is not None:
+        data, source = thumbnail, SOURCE_THUMBNAIL_LOWRES
+    if data is None:
+        return None, None
+    get_default_metrics().inc('caption_source_total', source=source)
+    return data, source
+
+def decode_image(data):
+    """Giải mã ảnh từ bytes, thu nhỏ nếu quá lớn (JPEG được giải mã thẳng ở độ phân giải thấp)"""
+    return load_thumbnail(data, max_size=(800, 800))  # Giới hạn kích thước tối đa
+
+@instrument('load_image_from_url')
+def load_image_from_url(url):
+    """Load image from URL with resize (qua cache HTTP dùng chung)"""
+    data = fetch_image_bytes(url)
+    if data is None:
+        return None
+    try:
+        return decode_image(data)
+    except Exception as e:
+        print(f"Error loading image from URL: {e}")
+        return None
+
+@instrument('model_call')
+def _call_model(func, tokens, controller=None, max_retries=3):
+    """Gọi model có thử lại; đi qua controller (giới hạn tốc độ) nếu có"""
     for attempt in range(max_retries):
+        if attempt:
+            get_default_metrics().add_retries('model_call')
         try:
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            image = load_image_from_url(image_url)
-            if image is None:
-                return None
-
-            response = model.generate_content([prompt, image])
-            return response.text
-            
+            if controller is not None:
+                return controller.call(func, tokens)
+            return func()
         except Exception as e:
             if attempt == max_retries - 1:  # Last attempt
                 print(f"Error generating content: {e}")
                 return None
             time.sleep(2 * (attempt + 1))  # Exponential backoff
 
-def process_dataset(csv_path, prompt, batch_size=10):
+@instrument('get_prediction')
+def get_prediction(image_url, prompt, max_retries=3, client=None, controller=None, caption_cache=None,
+                   stats=None, image_bytes=None):
+    """Get prediction with retries.
+
+    Cache caption (mặc định: get_default_caption_cache()) được tra trước khi gọi
+    API, theo hash nội dung ảnh, prompt, model và tham số sinh.
+    Truyền ``caption_cache=False`` để bỏ qua cache.
+    ``image_bytes``: nội dung ảnh đã có sẵn (ví dụ ảnh crawler vừa tải), khi đó không tải lại.
+    """
+    if client is None:
+        client = get_default_client()
+    if caption_cache is None:
+        caption_cache = get_default_caption_cache()
+
+    data = image_bytes if image_bytes is not None else fetch_image_bytes(image_url)
+    if data is None:
+        return None
+
+    if caption_cache:
+        image_sha256 = hash_bytes(data)
+        cached = caption_cache.get(image_sha256, prompt, client.model_name, client.generation_config)
+        if cached is not None:
+            return cached
+
+    try:
+        image = decode_image(data)
+    except Exception as e:
+        print(f"Error loading image from URL: {e}")
+        return None
+
+    caption = _call_model(lambda: client.generate(prompt, image), estimate_tokens(prompt),
+                          controller, max_retries)
+    if stats is not None:
+        stats.record_single(ok=bool(caption))
+    if caption_cache and caption:
+        caption_cache.put(image_sha256, prompt, client.model_name, caption, client.generation_config)
+    return caption
+
+def get_prediction_batch(image_urls, prompt, max_retries=3, client=None, controller=None,
+                         caption_cache=None, stats=None, images_bytes=None):
+    """Gán caption cho nhiều ảnh bằng một request, trả về danh sách caption cùng thứ tự.
+
+    Ảnh có sẵn trong cache caption không được gửi đi. Ảnh nào không tách được
+    caption hợp lệ từ câu trả lời sẽ được gán lại bằng request một ảnh.
+    ``images_bytes``: nội dung ảnh đã tải sẵn cùng thứ tự ``image_urls`` (None: bỏ qua ảnh đó).
+    """
+    if client is None:
+        client = get_default_client()
+    if caption_cache is None:
+        caption_cache = get_default_caption_cache()
+
+    captions = [None] * len(image_urls)
+    todo = []  # (vị trí, hash ảnh, ảnh đã giải mã)
+    for position, url in enumerate(image_urls):
+        data = images_bytes[position] if images_bytes is not None else fetch_image_bytes(url)
+        if data is None:
+            continue
+        image_sha256 = hash_bytes(data)
+        if caption_cache:
+            cached = caption_cache.get(image_sha256, prompt, client.model_name, client.generation_config)
+            if cached is not None:
+                captions[position] = cached
+                continue
+        try:
+            todo.append((position, image_sha256, decode_image(data)))
+        except Exception as e:
+            print(f"Error loading image from URL: {e}")
+
+    parsed = {}
+    if len(todo) > 1:
+        parts = build_batch_parts(prompt, [image for _, _, image in todo])
+        text = _call_model(lambda: client.generate_multi(parts), estimate_tokens(prompt, len(todo)),
+                           controller, max_retries)
+        parsed = parse_batch_response(text, len(todo))
+        if stats is not None:
+            stats.record_batch(len(todo), len(parsed), ok=text is not None)
+
+    for number, (position, image_sha256, image) in enumerate(todo, start=1):
+        caption = parsed.get(number)
+        if caption is None:
+            caption = _call_model(lambda: client.generate(prompt, image), estimate_tokens(prompt),
+                                  controller, max_retries)
+            if stats is not None:
+                stats.record_single(fallback=len(todo) > 1, ok=bool(caption))
+        if caption:
+            captions[position] = caption
+            if caption_cache:
+                caption_cache.put(image_sha256, prompt, client.model_name, caption, client.generation_config)
+    return captions
+
+def print_cache_stats():
+    stats = get_default_caption_cache().stats()
+    print(f"Caption cache: {stats['hits']} hits, {stats['misses']} misses "
+          f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries")
+
+def open_caption_store(csv_path, store_path=None):
+    """Đọc CSV và mở store caption đi kèm, trả về (df, store, các dòng cần xử lý).
+
+    Lần đầu (store còn rỗng) các caption có sẵn trong CSV được nạp vào store;
+    các lần sau, việc tiếp tục chỉ dựa vào store.
+    """
+    df = read_table(csv_path)
+    # Cột caption toàn rỗng sẽ bị đọc thành float, ép về object để gán chuỗi
+    df['short_caption'] = df['short_caption'].astype(object)
+    print(f"Loaded {len(df)} rows from CSV")
+
+    store = CaptionStore(store_path or default_store_path(csv_path))
+    if len(store) == 0:
+        seed_from_dataframe(store, df)
+    pending = pending_rows(store, df)
+    print(f"{len(store)} captions in {store.path}, {len(pending)} rows to process")
+    return df, store, pending
+
+def thumbnail_url_of(df, idx):
+    return df.at[idx, 'thumbnail_url'] if 'thumbnail_url' in df.columns else None
+
+def caption_row(df, idx, prompt, thumbnail_min_side=None, **kwargs):
+    """Gán caption cho dòng ``idx``, trả về (caption, nguồn ảnh).
+
+    ``thumbnail_min_side``: thử thumbnail_url trước (xem fetch_caption_image);
+    None thì luôn dùng ảnh gốc như trước.
+    """
+    url = df.at[idx, 'original_url']
+    if thumbnail_min_side is None:
+        return get_prediction(url, prompt, **kwargs), SOURCE_ORIGINAL
+    data, source = fetch_caption_image(url, thumbnail_url_of(df, idx), thumbnail_min_side)
+    if data is None:
+        return None, None
+    return get_prediction(url, prompt, image_bytes=data, **kwargs), source
+
+def caption_rows_batch(df, group, prompt, thumbnail_min_side=None, **kwargs):
+    """Gán caption cho nhiều dòng bằng một request, trả về danh sách (caption, nguồn ảnh)"""
+    urls = [df.at[idx, 'original_url'] for idx in group]
+    if thumbnail_min_side is None:
+        return [(caption, SOURCE_ORIGINAL) for caption in get_prediction_batch(urls, prompt, **kwargs)]
+    fetched = [fetch_caption_image(url, thumbnail_url_of(df, idx), thumbnail_min_side)
+               for url, idx in zip(urls, group)]
+    captions = get_prediction_batch(urls, prompt, images_bytes=[data for data, _ in fetched], **kwargs)
+    return [(caption, source) for caption, (_, source) in zip(captions, fetched)]
+
+def process_dataset(csv_path, prompt, batch_size=10, client=None, store_path=None, thumbnail_min_side=None):
     """Process dataset with longer delays"""
     try:
-        df = pd.read_csv(csv_path)
-        print(f"Loaded {len(df)} rows from CSV")
-        
-        backup_path = csv_path.replace('.csv', '_backup.csv')
-        df.to_csv(backup_path, index=False)
-        print(f"Created backup at {backup_path}")
+        df, store, pending = open_caption_store(csv_path, store_path)
         
-        for idx in tqdm(range(len(df))):
-            if pd.notna(df.at[idx, 'short_caption']):
-                continue
-                
+        for done, idx in enumerate(tqdm(pending), start=1):
             url = df.at[idx, 'original_url']
-            caption = get_prediction(url, prompt)
+            caption, source = caption_row(df, idx, prompt, thumbnail_min_side, client=client)
             
             if caption:
-                df.at[idx, 'short_caption'] = caption
+                store.put(url, caption, source)  # Commit ngay từng caption
                 
-            if idx % batch_size == 0:
-                df.to_csv(csv_path, index=False)
-                print(f"\nSaved progress at row {idx}")
+            if done % batch_size == 0:
                 time.sleep(2)  # Tăng delay giữa các batch
             
-        df.to_csv(csv_path, index=False)
+        write_merged_csv(store, df, csv_path)
+        store.close()
         print("\nProcessing completed!")
+        print_cache_stats()
         
     except Exception as e:
         print(f"Error processing dataset: {e}")
         return None
 
+def process_dataset_concurrent(csv_path, prompt, client=None, max_workers=MAX_WORKERS,
+                               controller=None, store_path=None, images_per_request=IMAGES_PER_REQUEST,
+                               thumbnail_min_side=None):
+    """Gán caption song song: nhiều worker, giới hạn RPM/TPM và tự giảm tải khi gặp 429.
+
+    ``images_per_request > 1`` gộp nhiều ảnh vào một request (xem get_prediction_batch).
+    ``thumbnail_min_side``: thử thumbnail trước ảnh gốc (xem caption_row).
+    """
+    try:
+        df, store, pending = open_caption_store(csv_path, store_path)
+
+        if client is None:
+            client = get_default_client()
+        if controller is None:
+            controller = CaptionRateController(max_concurrency=max_workers)
+        stats = CaptionStats()
+
+        # Chia các dòng cần xử lý thành từng lô ảnh gửi chung một request
+        step = max(1, images_per_request)
+        groups = [pending[i:i + step] for i in range(0, len(pending), step)]
+
+        start = time.time()
+        done = 0
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for group in groups:
+                if step > 1:
+                    future = executor.submit(caption_rows_batch, df, group, prompt, thumbnail_min_side,
+                                             client=client, controller=controller, stats=stats)
+                else:
+                    future = executor.submit(lambda idx: [caption_row(df, idx, prompt, thumbnail_min_side,
+                                                                      client=client, controller=controller,
+                                                                      stats=stats)], group[0])
+                futures[future] = group
+
+            with tqdm(total=len(pending)) as pbar:
+                for future in as_completed(futures):
+                    group = futures[future]
+                    for idx, (caption, source) in zip(group, future.result()):
+                        if caption:
+                            store.put(df.at[idx, 'original_url'], caption, source)  # Commit ngay từng caption
+                    done += len(group)
+                    pbar.update(len(group))
+
+        write_merged_csv(store, df, csv_path)
+        store.close()
+        elapsed = time.time() - start
+        print(f"\nProcessing completed! {done} rows in {elapsed:.1f}s "
+              f"({done / max(elapsed, 1e-9):.2f} rows/s, "
+              f"images/request={step}, "
+              f"concurrency={controller.concurrency.limit}, "
+              f"rate limited={controller.concurrency.rate_limited})")
+        print(stats.summary())
+        print_cache_stats()
+
+    except Exception as e:
+        print(f"Error processing dataset: {e}")
+        return None
+
 # Optimized prompt
 OPTIMIZED_PROMPT = """Mô tả tổng quan nhất về nội dung trong tấm hình, tập trung vào tình hình giao thông hiện tại. Hãy giữ mô tả ngắn gọn(khoảng 10-15 từ trong 1 câu), sao cho cả câu mô tả không được quá 15 từ, để người mù có thể nắm bắt được thông tin nhanh chóng."""
 
 
 if __name__ == "__main__":
-    # Initialize Gemini
-    API_KEY = "AIzaSxxxxxxxxxxxxxxxxxxx"  # Replace with your actual API key
-    init_gemini(API_KEY)
-    
+    parser = argparse.ArgumentParser(description="Gán caption ngắn cho ảnh bằng Gemini")
+    parser.add_argument('--csv', default="./cleaned_dataset.csv", help="CSV cần gán caption")
+    parser.add_argument('--concurrent', action='store_true',
+                        help="Gán caption song song với giới hạn RPM/TPM tự điều chỉnh")
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help="Số lời gọi đồng thời tối đa (chế độ --concurrent)")
+    parser.add_argument('--rpm', type=int, default=REQUESTS_PER_MINUTE, help="Giới hạn request/phút (0 = không giới hạn)")
+    parser.add_argument('--tpm', type=int, default=TOKENS_PER_MINUTE, help="Giới hạn token/phút (0 = không giới hạn)")
+    parser.add_argument('--images-per-request', type=int, default=IMAGES_PER_REQUEST,
+                        help="Số ảnh gộp trong một request (chế độ --concurrent)")
+    parser.add_argument('--fake-model', action='store_true',
+                        help="Dùng model giả cục bộ thay cho Gemini (chạy thử/đo hiệu năng)")
+    parser.add_argument('--thumbnail-first', action='store_true',
+                        help="Dùng thumbnail_url khi đủ lớn, chỉ tải ảnh gốc khi cần (ghi nguồn vào caption_source)")
+    parser.add_argument('--thumbnail-min-side', type=int, default=THUMBNAIL_MIN_SIDE,
+                        help="Cạnh ngắn tối thiểu (px) của thumbnail để dùng thay ảnh gốc")
+    args = parser.parse_args()
+    thumbnail_min_side = args.thumbnail_min_side if args.thumbnail_first else None
+
+    if args.fake_model:
+        client = FakeCaptionClient()
+    else:
+        # Initialize Gemini
+        API_KEY = "AIzaSxxxxxxxxxxxxxxxxxxx"  # Replace with your actual API key
+        init_gemini(API_KEY)
+        client = get_default_client()
+
     # Process dataset
-    csv_path = "./cleaned_dataset.csv"
-    process_dataset(csv_path, OPTIMIZED_PROMPT)
\ No newline at end of file
+    if args.concurrent:
+        controller = CaptionRateController(args.rpm, args.tpm, max_concurrency=args.workers)
+        process_dataset_concurrent(args.csv, OPTIMIZED_PROMPT, client=client,
+                                   max_workers=args.workers, controller=controller,
+                                   images_per_request=args.images_per_request,
+                                   thumbnail_min_side=thumbnail_min_side)
+    else:
+        process_dataset(args.csv, OPTIMIZED_PROMPT, client=client, thumbnail_min_side=thumbnail_min_side)
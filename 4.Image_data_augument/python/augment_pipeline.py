@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Pipeline augmentation nhiều giai đoạn: tải ảnh bằng luồng, augment bằng tiến trình.
+
+    luồng tải (I/O) --> hàng đợi giới hạn --> ProcessPoolExecutor (giải mã,
+    transforms, mã hóa và lưu ảnh) --> ResultWriter (ghi CSV ngay khi xong)
+
+Phần giải mã/augment/mã hóa tốn CPU và bị GIL tuần tự hóa khi chạy bằng luồng,
+nên được chuyển sang tiến trình để tận dụng hết số lõi. Bytes ảnh đã tải được
+đặt vào shared memory, tiến trình augment chỉ nhận tên vùng nhớ thay vì bản
+sao bytes qua pipe. Hàng đợi và số việc đang chạy đều có giới hạn nên bộ nhớ
+không tăng theo kích thước dataset.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from data_augument import RESULT_COLUMNS, augment_bytes, download_image_bytes, iter_records
+from metrics import init_worker_metrics
+
+FETCH_THREADS = 16
+
+_DONE = object()
+
+
+def _init_worker():
+    """Khởi tạo tiến trình augment"""
+    # Gieo lại random để mỗi tiến trình sinh ra biến đổi khác nhau (kể cả khi
+    # tiến trình được fork và kế thừa cùng trạng thái random)
+    seed = int.from_bytes(os.urandom(4), 'little')
+    random.seed(seed)
+    np.random.seed(seed)
+    # Mỗi tiến trình dùng một luồng OpenCV, tránh tranh chấp lõi giữa các tiến trình
+    cv2.setNumThreads(1)
+    # Số đo transforms/save_image của tiến trình này, ghi ra khi tiến trình thoát
+    init_worker_metrics()
+
+
+def _to_shared(data):
+    """Chép bytes ảnh vào một vùng shared memory mới, trả về None nếu không tạo được"""
+    try:
+        block = shared_memory.SharedMemory(create=True, size=len(data))
+    except OSError as e:
+        logging.warning(f"Không tạo được shared memory, gửi bytes trực tiếp: {e}")
+        return None
+    block.buf[:len(data)] = data
+    return block
+
+
+def augment_task(idx, row, output_dir, shm_name=None, size=0, data=None, virtual=False, packed=False):
+    """Chạy trong tiến trình augment: đọc bytes từ shared memory rồi augment"""
+    if shm_name is not None:
+        block = shared_memory.SharedMemory(name=shm_name)
+        try:
+            data = bytes(block.buf[:size])
+        finally:
+            block.close()
+    return augment_bytes(data, row, idx, output_dir, virtual, packed)
+
+
+def run_pipeline(df, output_dir, writer, workers=None, fetch_threads=FETCH_THREADS, queue_size=None,
+                 virtual=False, packed=False):
+    """Augment toàn bộ ``df``, ghi kết quả qua ``writer`` (data_augument.ResultWriter)"""
+    workers = workers or os.cpu_count() or 1
+    queue_size = queue_size or workers * 2
+    fetched = queue.Queue(maxsize=queue_size)   # ảnh đã tải, chờ augment
+    in_flight = threading.BoundedSemaphore(queue_size)  # số ảnh đang nằm trong process pool
+
+    def fetch(idx, row):
+        data = None
+        try:
+            if not pd.isna(row['original_url']):
+                data = download_image_bytes(row['original_url'])
+        finally:
+            fetched.put((idx, row, data))  # chặn khi hàng đợi đầy
+
+    rows = [(idx, {key: row[key] for key in RESULT_COLUMNS if key in row})
+            for idx, row in iter_records(df)]
+
+    # Process pool được tạo khi luồng tải đã có thể chạy: fork lúc đó có thể sao chép
+    # lock đang bị giữ (logging, metrics...) và treo tiến trình con, nên dùng forkserver
+    with ThreadPoolExecutor(max_workers=fetch_threads) as fetchers, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                mp_context=multiprocessing.get_context('forkserver')) as pool, \
+            tqdm(total=len(rows), desc="Processing images") as pbar:
+
+        def finish(future, block):
+            if block is not None:
+                block.close()
+                block.unlink()
+            in_flight.release()
+            try:
+                writer.write(future.result())
+            except Exception as e:
+                logging.error(f"Lỗi khi augment ảnh: {str(e)}")
+            pbar.update(1)
+
+        def feed():
+            for idx, row in rows:
+                fetchers.submit(fetch, idx, row)
+            fetchers.shutdown(wait=True)
+            fetched.put(_DONE)
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        while True:
+            item = fetched.get()
+            if item is _DONE:
+                break
+            idx, row, data = item
+            if data is None:
+                pbar.update(1)
+                continue
+
+            in_flight.acquire()
+            block = _to_shared(data)
+            if block is not None:
+                future = pool.submit(augment_task, idx, row, output_dir, block.name, len(data),
+                                     virtual=virtual, packed=packed)
+            else:
+                future = pool.submit(augment_task, idx, row, output_dir, data=data, virtual=virtual,
+                                     packed=packed)
+            future.add_done_callback(lambda f, block=block: finish(f, block))
+
+        feeder.join()
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""Augmentation theo lô: biến đổi cường độ pixel chạy vector hóa trên cả lô.
+
+Pipeline ``transforms`` của data_augument.py được tách thành hai phần:
+  - biến đổi không gian (ShiftScaleRotate/Affine, RandomResizedCrop, Resize):
+    vẫn chạy albumentations từng ảnh qua render_variant với seed riêng của ảnh
+    (khóa dùng chung chỉ giữ trong lúc biến đổi một ảnh, nên nhiều luồng vẫn
+    chạy xen kẽ), kết quả ghi thẳng vào một buffer (N, AUG_SIZE, AUG_SIZE, 3)
+  - biến đổi cường độ (RandomBrightnessContrast, ColorJitter, GaussNoise):
+    tham số được lấy mẫu theo đúng cấu hình và xác suất trong ``transforms``
+    (OneOf, p, các khoảng limit), rồi áp dụng bằng NumPy trên cả lô, tại chỗ
+    trên buffer float32 để không tạo mảng tạm cỡ ảnh.
+
+RandomBrightnessContrast và ColorJitter đều là phép biến đổi affine trên màu
+(ColorJitter lấy thứ tự ngẫu nhiên như albumentations) nên được gộp thành một
+ma trận 3x3 + độ lệch cho mỗi ảnh và áp dụng bằng một phép matmul cho cả lô.
+GaussianBlur (cùng OneOf với GaussNoise) chạy cv2 từng ảnh ngay trên buffer.
+
+Khác biệt so với chạy ``transforms`` từng ảnh (phân phối tham số giữ nguyên):
+  - biến đổi cường độ chạy sau biến đổi không gian, nên viền đen của phép
+    xoay/dịch cũng bị đổi độ sáng, nhiễu và làm mờ áp dụng ở kích thước
+    AUG_SIZE thay vì kích thước ảnh nguồn
+  - chỉ cắt về [0, 255] một lần ở cuối thay vì sau từng bước
+  - hue của ColorJitter là phép quay màu quanh trục xám (ma trận
+    feHueRotate) thay vì dịch kênh H trong HSV
+
+Dùng:
+    augmented = augment_batch([image1, image2], seed=42)   # mảng (2, 512, 512, 3) uint8
+"""
+import threading
+
+import albumentations as A
+import cv2
+import numpy as np
+
+from data_augument import AUG_SIZE, render_variant, transforms
+from metrics import instrument
+
+PHOTOMETRIC_TYPES = (A.RandomBrightnessContrast, A.ColorJitter)
+NOISE_TYPES = (A.GaussNoise, A.GaussianBlur)
+
+# Trọng số độ sáng của cv2.COLOR_RGB2GRAY (albumentations dùng cho contrast/saturation)
+GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float64)
+
+
+def _is_group(transform, types):
+    return isinstance(transform, A.OneOf) and all(isinstance(t, types) for t in transform.transforms)
+
+
+def split_pipeline(pipeline):
+    """Tách Compose thành (nhóm OneOf cường độ, nhóm OneOf nhiễu/mờ, Compose không gian)"""
+    photometric, noise, geometric = [], [], []
+    for transform in pipeline.transforms:
+        if _is_group(transform, PHOTOMETRIC_TYPES):
+            photometric.append(transform)
+        elif _is_group(transform, NOISE_TYPES):
+            noise.append(transform)
+        elif isinstance(transform, PHOTOMETRIC_TYPES + NOISE_TYPES):
+            # Biến đổi đứng riêng: coi như OneOf một phần tử
+            group = A.OneOf([transform], p=transform.p)
+            (photometric if isinstance(transform, PHOTOMETRIC_TYPES) else noise).append(group)
+        else:
+            geometric.append(transform)
+    return photometric, noise, A.Compose(geometric)
+
+
+def hue_matrix(factor):
+    """Ma trận quay hue (feHueRotate) ứng với hệ số hue của ColorJitter (1.0 = 360 độ)"""
+    angle = np.deg2rad(factor * 360)
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([
+        [0.213 + 0.787 * c - 0.213 * s, 0.715 - 0.715 * c - 0.715 * s, 0.072 - 0.072 * c + 0.928 * s],
+        [0.213 - 0.213 * c + 0.143 * s, 0.715 + 0.285 * c + 0.140 * s, 0.072 - 0.072 * c - 0.283 * s],
+        [0.213 - 0.213 * c - 0.787 * s, 0.715 - 0.715 * c + 0.715 * s, 0.072 + 0.928 * c + 0.072 * s],
+    ])
+
+
+def brightness_contrast_affine(transform, rng):
+    """Tham số RandomBrightnessContrast -> (ma trận, độ lệch)"""
+    alpha = 1.0 + rng.uniform(*transform.contrast_limit)
+    beta = rng.uniform(*transform.brightness_limit)
+    if not transform.brightness_by_max:
+        raise ValueError("batch_augment chỉ hỗ trợ RandomBrightnessContrast(brightness_by_max=True)")
+    return alpha * np.eye(3), np.full(3, beta * 255.0)
+
+
+def color_jitter_affine(transform, rng, mean_rgb):
+    """Tham số ColorJitter -> (ma trận, độ lệch), các bước theo thứ tự ngẫu nhiên như albumentations.
+
+    ``mean_rgb``: màu trung bình của ảnh trước bước này (contrast trộn với độ sáng trung bình).
+    """
+    brightness = rng.uniform(*transform.brightness)
+    contrast = rng.uniform(*transform.contrast)
+    saturation = rng.uniform(*transform.saturation)
+    hue = rng.uniform(*transform.hue)
+    matrix, offset = np.eye(3), np.zeros(3)
+    for step in rng.permutation(4):
+        if step == 0:
+            step_matrix, step_offset = brightness * np.eye(3), np.zeros(3)
+        elif step == 1:
+            mean_gray = GRAY_WEIGHTS @ (matrix @ mean_rgb + offset)
+            step_matrix, step_offset = contrast * np.eye(3), np.full(3, mean_gray * (1 - contrast))
+        elif step == 2:
+            step_matrix = saturation * np.eye(3) + (1 - saturation) * np.outer(np.ones(3), GRAY_WEIGHTS)
+            step_offset = np.zeros(3)
+        else:
+            step_matrix, step_offset = hue_matrix(hue), np.zeros(3)
+        matrix, offset = step_matrix @ matrix, step_matrix @ offset + step_offset
+    return matrix, offset
+
+
+def blur_params(transform, rng):
+    """ksize/sigma của GaussianBlur, cùng cách chọn với albumentations (ksize chẵn làm tròn lên lẻ)"""
+    low, high = transform.blur_limit
+    ksize = int(rng.integers(low, high + 1))
+    if ksize != 0 and ksize % 2 != 1:
+        ksize = (ksize + 1) % (high + 1)
+    return ksize, rng.uniform(*transform.sigma_limit)
+
+
+def _choose(group, rng):
+    """Quyết định của một OneOf: None nếu không áp dụng, ngược lại là biến đổi được chọn"""
+    if rng.random() >= group.p:
+        return None
+    return group.transforms[rng.choice(len(group.transforms), p=group.transforms_ps)]
+
+
+class BatchAugmenter:
+    """Chạy ``pipeline`` (mặc định: transforms của data_augument) cho cả lô ảnh.
+
+    Buffer được giữ lại giữa các lần gọi nên mỗi luồng dùng một đối tượng
+    riêng (xem get_batch_augmenter).
+    """
+
+    def __init__(self, pipeline=None, size=AUG_SIZE):
+        self.size = size
+        self.photometric, self.noise, self.geometric = split_pipeline(pipeline or transforms)
+        self._pixels = None   # float32 (N, H*W, 3): ảnh đang biến đổi
+        self._scratch = None  # float32 cùng cỡ: kết quả matmul / nhiễu
+
+    def _buffers(self, count):
+        if self._pixels is None or len(self._pixels) < count:
+            shape = (count, self.size * self.size, 3)
+            self._pixels = np.empty(shape, dtype=np.float32)
+            self._scratch = np.empty(shape, dtype=np.float32)
+        return self._pixels[:count], self._scratch[:count]
+
+    def _apply_geometric(self, images, out, seeds):
+        # albumentations lấy số ngẫu nhiên từ random/np.random: render_variant gieo
+        # seed của từng ảnh và chỉ giữ khóa dùng chung trong lúc biến đổi ảnh đó
+        for i, image in enumerate(images):
+            result = render_variant(image, int(seeds[i]), self.geometric)
+            if result.shape[:2] != (self.size, self.size):
+                result = cv2.resize(result, (self.size, self.size), interpolation=cv2.INTER_LINEAR)
+            np.copyto(out[i], result.reshape(-1, 3), casting='unsafe')
+
+    def _apply_photometric(self, pixels, scratch, rng):
+        count = len(pixels)
+        matrices = np.tile(np.eye(3), (count, 1, 1))
+        offsets = np.zeros((count, 3))
+        ones = np.ones(pixels.shape[1], dtype=np.float32)
+        for group in self.photometric:
+            for i in range(count):
+                transform = _choose(group, rng)
+                if transform is None:
+                    continue
+                if isinstance(transform, A.RandomBrightnessContrast):
+                    step_matrix, step_offset = brightness_contrast_affine(transform, rng)
+                else:
+                    # Tổng theo pixel bằng matmul (BLAS) nhanh hơn nhiều so với mean(axis=0)
+                    mean_rgb = (ones @ pixels[i]).astype(np.float64) / len(ones)
+                    current_mean = matrices[i] @ mean_rgb + offsets[i]
+                    step_matrix, step_offset = color_jitter_affine(transform, rng, current_mean)
+                matrices[i] = step_matrix @ matrices[i]
+                offsets[i] = step_matrix @ offsets[i] + step_offset
+
+        identity = np.all(matrices == np.eye(3), axis=(1, 2)) & np.all(offsets == 0, axis=1)
+        # matmul (H*W, 3) x (3, 3) từng ảnh nhanh hơn matmul 3 chiều cho cả lô
+        # (NumPy không gọi BLAS cho lô ma trận nhỏ), chỉ chạy cho ảnh có đổi màu
+        for i in np.flatnonzero(~identity):
+            np.matmul(pixels[i], matrices[i].T.astype(np.float32), out=scratch[i])
+            pixels[i] = scratch[i]
+            self._add_offset(pixels[i], offsets[i])
+
+    def _add_offset(self, image, offset):
+        """image (H*W, 3) += offset (3,), cộng theo từng hàng ảnh (size*3 phần tử)
+        vì broadcast trên trục cuối chỉ 3 phần tử chậm hơn vài lần"""
+        row = np.tile(offset.astype(np.float32), self.size)
+        image.reshape(self.size, -1)[...] += row
+
+    def _apply_noise(self, pixels, scratch, rng):
+        height = width = self.size
+        noisy = []
+        for group in self.noise:
+            for i in range(len(pixels)):
+                transform = _choose(group, rng)
+                if isinstance(transform, A.GaussNoise):
+                    sigma = rng.uniform(*transform.var_limit) ** 0.5
+                    noisy.append((i, transform, sigma))
+                elif isinstance(transform, A.GaussianBlur):
+                    ksize, sigma = blur_params(transform, rng)
+                    image = pixels[i].reshape(height, width, 3)
+                    cv2.GaussianBlur(image, (ksize, ksize), sigmaX=sigma, dst=image)
+        if not noisy:
+            return
+        # Sinh nhiễu float32 cho mọi ảnh cần nhiễu trong một lần gọi
+        noise = scratch[:len(noisy)]
+        rng.standard_normal(dtype=np.float32, out=noise)
+        for j, (i, transform, sigma) in enumerate(noisy):
+            if transform.per_channel:
+                noise[j] *= sigma
+                pixels[i] += noise[j]
+            else:
+                channel = noise[j][:, :1]
+                channel *= sigma
+                pixels[i] += channel
+            if transform.mean:
+                pixels[i] += transform.mean
+
+    def augment(self, images, seed=None):
+        """Augment danh sách ảnh RGB uint8 (kích thước tùy ý), trả về mảng (N, size, size, 3) uint8.
+
+        Ảnh thứ i được biến đổi không gian như render_variant với seed thứ i của
+        ``np.random.default_rng(seed).integers(2 ** 31, size=N)``.
+        """
+        rng = np.random.default_rng(seed)
+        count = len(images)
+        seeds = rng.integers(2 ** 31, size=count)
+        pixels, scratch = self._buffers(count)
+        self._apply_geometric(images, pixels, seeds)
+        self._apply_photometric(pixels, scratch, rng)
+        self._apply_noise(pixels, scratch, rng)
+        np.clip(pixels, 0, 255, out=pixels)
+        output = np.empty((count, self.size, self.size, 3), dtype=np.uint8)
+        np.copyto(output.reshape(count, -1, 3), pixels, casting='unsafe')
+        return output
+
+
+_local = threading.local()
+
+
+def get_batch_augmenter():
+    """BatchAugmenter riêng của luồng hiện tại (buffer không dùng chung giữa các luồng)"""
+    augmenter = getattr(_local, 'augmenter', None)
+    if augmenter is None:
+        augmenter = _local.augmenter = BatchAugmenter()
+    return augmenter
+
+
+@instrument('batch_transforms')
+def augment_batch(images, seed=None):
+    """Augment cả lô ảnh bằng BatchAugmenter của luồng hiện tại"""
+    return get_batch_augmenter().augment(images, seed)
@@ -1,23 +1,47 @@
 import pandas as pd
 import os
+import sys
+import csv
+import json
+import random
+import hashlib
+import argparse
+import threading
 import cv2
 import numpy as np
-from PIL import Image
-import albumentations as A
 from io import BytesIO
+from PIL import Image, ImageCms, ImageOps
+import albumentations as A
 import requests
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 
+# Module dùng chung giữa các bước nằm trong thư mục common/ ở gốc repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from http_cache import get_default_cache
+from image_loader import open_image
+from dataset_io import read_table, iter_records
+from metrics import get_default_metrics, instrument
+
 # Định nghĩa các đường dẫn
 INPUT_CSV = "./csv_with_captions/valid_urls_dataset_v12.csv"
 OUTPUT_DIR = "./augmented"
 OUTPUT_CSV = os.path.join(OUTPUT_DIR, "captions_augmented.csv")
 
-# Tạo thư mục output nếu chưa tồn tại
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-os.makedirs(os.path.join(OUTPUT_DIR, "images"), exist_ok=True)
+AUG_SIZE = 512  # Kích thước ảnh sau augmentation
+NUM_AUGMENTATIONS = 3
+ORIENTATION_TAG = 0x0112  # Tag EXIF Orientation
+SRGB_PROFILE = ImageCms.createProfile('sRGB')
+# Cách chạy transforms: 'albumentations' (từng ảnh) hoặc 'batch' (cả lô biến thể
+# của một ảnh, biến đổi cường độ vector hóa bằng NumPy - xem batch_augment.py)
+AUGMENT_ENGINE = os.environ.get('AUGMENT_ENGINE', 'albumentations')
+
+RESULT_COLUMNS = ['original_url', 'source_website', 'resolution', 'search_query', 'local_path', 'short_caption']
+# Chế độ ảo: dòng augmented ghi ảnh nguồn + seed thay vì file ảnh (xem virtual_augment.py)
+VIRTUAL_COLUMNS = RESULT_COLUMNS + ['source_path', 'aug_seed', 'transform_hash']
+# Chế độ đóng gói: ảnh augmented nằm trong shard uint8 thay vì file JPEG (xem packed_store.py)
+PACKED_COLUMNS = RESULT_COLUMNS + ['shard', 'shard_row']
 
 # Định nghĩa các augmentation transforms
 transforms = A.Compose([
@@ -62,24 +86,109 @@ transforms = A.Compose([
     
     # Random crop với tỷ lệ cao
     A.RandomResizedCrop(
-        height=512,
-        width=512,
+        height=AUG_SIZE,
+        width=AUG_SIZE,
         scale=(0.8, 1.0),
         ratio=(0.9, 1.1),
         p=0.5
     ),
     
     # Đảm bảo kích thước output đồng nhất
-    A.Resize(512, 512, p=1.0)
+    A.Resize(AUG_SIZE, AUG_SIZE, p=1.0)
 ])
 
-def download_image(url, timeout=10):
-    """Tải ảnh từ URL"""
+def transform_config_hash(pipeline=None):
+    """Hash cấu hình transforms (kèm phiên bản albumentations).
+
+    Một biến thể ảo chỉ được tái tạo đúng khi hash này không đổi.
+    """
+    config = A.to_dict(pipeline or transforms)
+    text = json.dumps(config, sort_keys=True, default=str) + A.__version__
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+TRANSFORM_HASH = transform_config_hash()
+
+@instrument('transforms')
+def apply_transforms(image):
+    """Chạy pipeline transforms trên một ảnh (mảng RGB)"""
+    return transforms(image=image)['image']
+
+def derive_seed(source_key, variant, base_seed=0):
+    """Seed cố định cho biến thể thứ ``variant`` của ảnh ``source_key`` (thường là URL gốc)"""
+    digest = hashlib.sha256(f"{base_seed}:{source_key}:{variant}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'little') & 0x7FFFFFFF
+
+_render_lock = threading.Lock()
+
+def render_variant(image, seed, pipeline=None):
+    """Tạo đúng biến thể augmentation ứng với ``seed`` (image: mảng RGB từ process_image).
+
+    albumentations lấy số ngẫu nhiên từ random và np.random nên phải gieo seed
+    và chạy transforms trong cùng một khóa. ``pipeline``: Compose khác thay cho
+    ``transforms`` (batch_augment dùng cho phần biến đổi không gian).
+    """
+    with _render_lock:
+        random.seed(seed)
+        np.random.seed(seed)
+        if pipeline is not None:
+            return pipeline(image=image)['image']
+        return apply_transforms(image)
+
+@instrument('download_image_bytes')
+def download_image_bytes(url, timeout=10):
+    """Tải nội dung ảnh từ URL (qua cache HTTP dùng chung)"""
+    metrics = get_default_metrics()
     try:
-        response = requests.get(url, timeout=timeout, verify=False)
+        response = get_default_cache().get(url, timeout=timeout, verify=False)
+        metrics.record_response('download_image_bytes', url, str(response.status_code))
         if response.status_code != 200:
             raise Exception(f"HTTP error {response.status_code}")
-        return Image.open(BytesIO(response.content))
+        metrics.add_bytes('download_image_bytes', len(response.content))
+        return response.content
+    except requests.exceptions.RequestException as e:
+        metrics.record_response('download_image_bytes', url, type(e).__name__)
+        logging.error(f"Lỗi khi tải ảnh từ {url}: {str(e)}")
+        return None
+    except Exception as e:
+        logging.error(f"Lỗi khi tải ảnh từ {url}: {str(e)}")
+        return None
+
+def decode_image(data):
+    """Giải mã ảnh, với JPEG chỉ giải mã ở độ phân giải vừa đủ (>= AUG_SIZE mỗi chiều).
+
+    Trả về (ảnh, định dạng gốc).
+    """
+    image, source_format, _ = open_image(data, min_size=(AUG_SIZE, AUG_SIZE), mode=None)
+    return image, source_format
+
+def is_plain_rgb(image):
+    """Ảnh đã là RGB, không có tag xoay EXIF và không kèm ICC profile"""
+    return (image.mode == 'RGB'
+            and image.getexif().get(ORIENTATION_TAG, 1) == 1
+            and not image.info.get('icc_profile'))
+
+def normalize_image(image):
+    """Xoay ảnh theo tag EXIF, chuyển ICC profile về sRGB rồi đưa về RGB"""
+    image = ImageOps.exif_transpose(image)
+    icc_profile = image.info.get('icc_profile')
+    if icc_profile and image.mode in ('RGB', 'CMYK'):
+        try:
+            image = ImageCms.profileToProfile(
+                image, ImageCms.ImageCmsProfile(BytesIO(icc_profile)),
+                SRGB_PROFILE, outputMode='RGB')
+        except (ImageCms.PyCMSError, OSError) as e:
+            logging.warning(f"Không chuyển được ICC profile sang sRGB: {str(e)}")
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+def download_image(url, timeout=10):
+    """Tải ảnh từ URL"""
+    data = download_image_bytes(url, timeout)
+    if data is None:
+        return None
+    try:
+        return decode_image(data)[0]
     except Exception as e:
         logging.error(f"Lỗi khi tải ảnh từ {url}: {str(e)}")
         return None
@@ -97,6 +206,7 @@ def process_image(image):
     
     return image
 
+@instrument('save_image')
 def save_image(image, path):
     """Lưu ảnh với xử lý lỗi"""
     try:
@@ -105,82 +215,208 @@ def save_image(image, path):
         if image.mode != 'RGB':
             image = image.convert('RGB')
         image.save(path)
+        get_default_metrics().add_bytes('save_image', os.path.getsize(path))
         return True
     except Exception as e:
         logging.error(f"Lỗi khi lưu ảnh {path}: {str(e)}")
         return False
 
-def process_single_row(row, idx, output_dir):
-    """Xử lý một hàng dữ liệu"""
+@instrument('save_bytes')
+def save_bytes(data, path):
+    """Ghi nguyên nội dung file ảnh"""
+    try:
+        with open(path, 'wb') as f:
+            f.write(data)
+        get_default_metrics().add_bytes('save_bytes', len(data))
+        return True
+    except Exception as e:
+        logging.error(f"Lỗi khi lưu ảnh {path}: {str(e)}")
+        return False
+
+def make_result(row, local_path):
+    """Một dòng của captions_augmented.csv"""
+    return {
+        'original_url': row['original_url'],
+        'source_website': row['source_website'],
+        'resolution': row['resolution'],
+        'search_query': row['search_query'],
+        'local_path': local_path,
+        'short_caption': row['short_caption']
+    }
+
+def augment_bytes(data, row, idx, output_dir, virtual=False, packed=False):
+    """Giải mã ảnh đã tải, lưu ảnh gốc và các ảnh augmented; trả về các dòng kết quả.
+
+    ``virtual=True``: không tạo file augmented, mỗi biến thể chỉ là một dòng ghi
+    ảnh nguồn, seed và hash cấu hình transforms.
+    ``packed=True``: ảnh augmented được nối vào shard trong ``<output_dir>/packed``,
+    dòng kết quả ghi ``shard``/``shard_row`` thay cho ``local_path``.
+    """
     results = []
     image_url = row['original_url']
-    if pd.isna(image_url):
-        return results
-
     original_filename = f"image_{idx}.jpg"
     new_original_path = os.path.join(output_dir, "images", original_filename)
 
-    # Tải và lưu ảnh gốc
-    original_image = download_image(image_url)
-    if original_image is None:
+    try:
+        original_image, source_format = decode_image(data)
+    except Exception as e:
+        logging.error(f"Lỗi khi giải mã ảnh từ {image_url}: {str(e)}")
         return results
 
-    if save_image(original_image, new_original_path):
-        results.append({
-            'original_url': row['original_url'],
-            'source_website': row['source_website'],
-            'resolution': row['resolution'],
-            'search_query': row['search_query'],
-            'local_path': new_original_path,
-            'short_caption': row['short_caption']
-        })
+    # Ảnh gốc JPEG RGB thuần được ghi thẳng từ bytes đã tải, không cần mã hóa lại
+    # (ảnh đã giải mã ở độ phân giải thấp chỉ dùng cho augmentation).
+    # CMYK, có tag xoay EXIF hoặc ICC profile thì giải mã đủ và mã hóa lại như
+    # mọi ảnh khác để dataset chỉ có ảnh RGB đúng chiều.
+    if source_format == 'JPEG' and is_plain_rgb(original_image):
+        saved = save_bytes(data, new_original_path)
+    else:
+        full_image = original_image
+        if source_format == 'JPEG':
+            full_image, _, _ = open_image(data, mode=None)
+        saved = save_image(normalize_image(full_image), new_original_path)
+        original_image = normalize_image(original_image)
+
+    if saved:
+        results.append(make_result(row, new_original_path))
+
+    if virtual:
+        if not saved:
+            return results
+        for aug_idx in range(NUM_AUGMENTATIONS):
+            result = make_result(row, '')
+            result.update({
+                'source_path': new_original_path,
+                'aug_seed': derive_seed(image_url, aug_idx),
+                'transform_hash': TRANSFORM_HASH,
+            })
+            results.append(result)
+        return results
 
     # Tạo augmented images
     processed_image = process_image(original_image)
-    for aug_idx in range(3):  # num_augmentations = 3
-        augmented = transforms(image=processed_image)['image']
+    if AUGMENT_ENGINE == 'batch':
+        from batch_augment import augment_batch
+        augmented_images = augment_batch([processed_image] * NUM_AUGMENTATIONS)
+    else:
+        augmented_images = (apply_transforms(processed_image) for _ in range(NUM_AUGMENTATIONS))
+    for aug_idx, augmented in enumerate(augmented_images):
+        if packed:
+            from packed_store import get_packed_writer
+            try:
+                shard, shard_row = get_packed_writer(os.path.join(output_dir, 'packed')).append(augmented)
+            except Exception as e:
+                logging.error(f"Lỗi khi ghi ảnh augmented của {image_url}: {str(e)}")
+                continue
+            result = make_result(row, '')
+            result.update({'shard': os.path.join('packed', shard), 'shard_row': shard_row})
+            results.append(result)
+            continue
         name, ext = os.path.splitext(original_filename)
         new_name = f"{name}_aug_{aug_idx}{ext}"
         new_path = os.path.join(output_dir, "images", new_name)
-        
+
         if save_image(augmented, new_path):
-            results.append({
-                'original_url': row['original_url'],
-                'source_website': row['source_website'],
-                'resolution': row['resolution'],
-                'search_query': row['search_query'],
-                'local_path': new_path,
-                'short_caption': row['short_caption']
-            })
+            results.append(make_result(row, new_path))
 
     return results
 
+def process_single_row(row, idx, output_dir, virtual=False, packed=False):
+    """Xử lý một hàng dữ liệu"""
+    image_url = row['original_url']
+    if pd.isna(image_url):
+        return []
+
+    # Tải ảnh gốc
+    data = download_image_bytes(image_url)
+    if data is None:
+        return []
+    return augment_bytes(data, row, idx, output_dir, virtual, packed)
+
+class ResultWriter:
+    """Ghi dần kết quả vào CSV ngay khi từng ảnh xử lý xong (cùng định dạng to_csv trước đây)"""
+
+    def __init__(self, path, columns=RESULT_COLUMNS):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'w', newline='', encoding='utf-8-sig')
+        self._writer = csv.DictWriter(self._file, fieldnames=columns, lineterminator='\n')
+        self._writer.writeheader()
+
+    def write(self, results):
+        with self._lock:
+            for result in results:
+                # NaN của pandas được ghi thành ô trống như to_csv
+                self._writer.writerow({key: '' if pd.isna(value) else value
+                                       for key, value in result.items()})
+            self.count += len(results)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def run_threaded(df, output_dir, writer, max_workers=8, virtual=False, packed=False):
+    """Chế độ cũ: mỗi luồng tải, giải mã, augment và lưu trọn một ảnh"""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_idx = {
+            executor.submit(process_single_row, row, idx, output_dir, virtual, packed): idx
+            for idx, row in iter_records(df)
+        }
+
+        for future in tqdm(as_completed(future_to_idx), total=len(df), desc="Processing images"):
+            writer.write(future.result())
+
 def main():
+    global AUGMENT_ENGINE
+    parser = argparse.ArgumentParser(description="Augmentation ảnh và tạo captions_augmented.csv")
+    parser.add_argument('--input', default=INPUT_CSV, help="CSV/Parquet đầu vào (đã có caption)")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help="Thư mục lưu ảnh và CSV kết quả")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Tách tải ảnh (luồng) và augment (tiến trình) thành pipeline nhiều giai đoạn")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Số tiến trình augment (mặc định: số lõi CPU), chỉ dùng với --pipeline")
+    parser.add_argument('--fetch-threads', type=int, default=16,
+                        help="Số luồng tải ảnh, chỉ dùng với --pipeline")
+    output_format = parser.add_mutually_exclusive_group()
+    output_format.add_argument('--virtual', action='store_true',
+                               help="Không ghi ảnh augmented, chỉ ghi seed để tạo lại khi cần (virtual_augment.py)")
+    output_format.add_argument('--packed', action='store_true',
+                               help="Ghi ảnh augmented vào shard uint8 đọc bằng memory map (packed_store.py)")
+    parser.add_argument('--engine', choices=['albumentations', 'batch'], default=AUGMENT_ENGINE,
+                        help="Cách chạy transforms: từng ảnh hoặc theo lô (batch_augment.py)")
+    args = parser.parse_args()
+
+    # Tiến trình augment của --pipeline đọc lại cấu hình từ biến môi trường
+    AUGMENT_ENGINE = os.environ['AUGMENT_ENGINE'] = args.engine
+
     # Thiết lập logging
     logging.basicConfig(level=logging.INFO)
-    
+
+    # Tạo thư mục output nếu chưa tồn tại
+    os.makedirs(args.output_dir, exist_ok=True)
+    os.makedirs(os.path.join(args.output_dir, "images"), exist_ok=True)
+    output_csv = os.path.join(args.output_dir, os.path.basename(OUTPUT_CSV))
+
     # Đọc file CSV gốc
-    df = pd.read_csv(INPUT_CSV)
+    df = read_table(args.input)
     logging.info(f"Đọc được {len(df)} ảnh từ file CSV")
-    
-    all_results = []
-    
-    # Xử lý đa luồng
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        future_to_idx = {
-            executor.submit(process_single_row, row, idx, OUTPUT_DIR): idx
-            for idx, row in df.iterrows()
-        }
-        
-        for future in tqdm(as_completed(future_to_idx), total=len(df), desc="Processing images"):
-            results = future.result()
-            all_results.extend(results)
-    
-    # Tạo DataFrame mới và lưu
-    new_df = pd.DataFrame(all_results)
-    new_df.to_csv(OUTPUT_CSV, index=False, encoding='utf-8-sig')
-    logging.info(f"Đã lưu file CSV mới tại: {OUTPUT_CSV}")
-    logging.info(f"Tổng số ảnh (gốc + augmented): {len(new_df)}")
+
+    # Kết quả được ghi dần vào CSV thay vì gom hết trong bộ nhớ
+    columns = VIRTUAL_COLUMNS if args.virtual else PACKED_COLUMNS if args.packed else RESULT_COLUMNS
+    writer = ResultWriter(output_csv, columns)
+    try:
+        if args.pipeline:
+            from augment_pipeline import run_pipeline
+            run_pipeline(df, args.output_dir, writer, workers=args.workers,
+                         fetch_threads=args.fetch_threads, virtual=args.virtual, packed=args.packed)
+        else:
+            run_threaded(df, args.output_dir, writer, virtual=args.virtual, packed=args.packed)
+    finally:
+        writer.close()
+
+    logging.info(f"Đã lưu file CSV mới tại: {output_csv}")
+    logging.info(f"Tổng số ảnh (gốc + augmented): {writer.count}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""Lưu ảnh augmented dạng mảng uint8 đóng gói, đọc lại bằng memory map.
+
+``data_augument.py --packed`` không ghi mỗi ảnh augmented thành một file JPEG:
+ảnh (H, W, 3) uint8 được nối vào cuối một file shard trong ``<output-dir>/packed/``
+và dòng tương ứng trong captions_augmented.csv/.parquet ghi ``shard`` (đường dẫn
+tương đối so với file index) và ``shard_row`` thay cho ``local_path``. File
+index vẫn giữ caption và thông tin nguồn như trước; dùng đuôi .parquet để có
+index gọn (cột shard mã hóa dictionary, xem common/dataset_io.py).
+
+Shard được chia theo kích thước ảnh và theo tiến trình ghi:
+    packed/512x512-<token>-0000.u8     SHARD_ROWS ảnh 512x512x3 liền nhau, không header
+Mỗi tiến trình ghi file riêng (không cần khóa giữa các tiến trình của pipeline),
+sang file mới khi đủ SHARD_ROWS ảnh. Số dòng của shard suy ra từ kích thước
+file; dòng ghi dở khi bị dừng giữa chừng bị bỏ qua vì index chỉ ghi sau khi ảnh
+đã ghi xong.
+
+Đọc khi train (không giải mã, không mở từng file):
+    dataset = PackedImageDataset('./augmented/captions_augmented.parquet')
+    item = dataset[i]          # item['image'] là view (512, 512, 3) trên memory map
+    batch = dataset.images([3, 7, 42])
+
+Chuyển dataset JPEG đã có sang dạng đóng gói, xem thông tin:
+    python packed_store.py pack --csv ./augmented/captions_augmented.csv --output ./augmented/packed.parquet
+    python packed_store.py info --index ./augmented/packed.parquet
+"""
+import argparse
+import atexit
+import logging
+import os
+import sys
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from dataset_io import read_table, write_table
+
+SHARD_ROWS = 2048          # ~1.5GB mỗi shard với ảnh 512x512
+SHARD_SUFFIX = '.u8'
+CHANNELS = 3
+
+
+def shard_shape(path):
+    """(height, width) đọc từ tên shard "<H>x<W>-<token>-<số>.u8\""""
+    size = os.path.basename(path).split('-', 1)[0]
+    height, width = size.split('x')
+    return int(height), int(width)
+
+
+class PackedWriter:
+    """Nối ảnh uint8 vào các shard trong ``directory``, an toàn khi nhiều luồng cùng ghi"""
+
+    def __init__(self, directory, shard_rows=SHARD_ROWS):
+        self.directory = directory
+        self.shard_rows = shard_rows
+        self.token = uuid.uuid4().hex[:8]   # tên shard riêng cho mỗi writer
+        self._shards = {}   # (height, width) -> [file, tên shard, số dòng đã ghi, số thứ tự shard]
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self, height, width, number):
+        name = f"{height}x{width}-{self.token}-{number:04d}{SHARD_SUFFIX}"
+        return [open(os.path.join(self.directory, name), 'ab'), name, 0, number]
+
+    def append(self, image):
+        """Ghi một ảnh (H, W, 3) uint8, trả về (tên shard, chỉ số dòng trong shard)"""
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        if image.ndim != 3 or image.shape[2] != CHANNELS:
+            raise ValueError(f"Ảnh phải có dạng (H, W, {CHANNELS}), nhận được {image.shape}")
+        key = image.shape[:2]
+        with self._lock:
+            shard = self._shards.get(key)
+            if shard is None:
+                shard = self._shards[key] = self._open(*key, 0)
+            elif shard[2] >= self.shard_rows:
+                shard[0].close()
+                shard = self._shards[key] = self._open(*key, shard[3] + 1)
+            file, name, row, _ = shard
+            file.write(memoryview(image).cast('B'))
+            file.flush()
+            shard[2] += 1
+        return name, row
+
+    def close(self):
+        with self._lock:
+            for shard in self._shards.values():
+                shard[0].close()
+            self._shards = {}
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_packed_writer(directory):
+    """PackedWriter dùng chung trong tiến trình hiện tại cho ``directory``"""
+    key = (os.getpid(), os.path.abspath(directory))
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = PackedWriter(directory)
+            atexit.register(writer.close)
+    return writer
+
+
+class PackedImageDataset:
+    """Đọc ảnh đóng gói theo file index (CSV/Parquet có cột shard, shard_row).
+
+    Ảnh trả về là view chỉ đọc trên memory map của shard: không sao chép, không
+    giải mã; hệ điều hành chỉ nạp các trang thực sự được đọc.
+    """
+
+    def __init__(self, index_path, columns=None):
+        df = read_table(index_path, columns=columns)
+        if 'shard' not in df.columns:
+            raise ValueError(f"{index_path} không phải index ảnh đóng gói (thiếu cột shard)")
+        self.root = os.path.dirname(os.path.abspath(index_path))
+        self.rows = df[df['shard'].notna()].reset_index(drop=True)
+        self._shard_names = self.rows['shard'].astype(str).to_numpy()
+        self._shard_rows = self.rows['shard_row'].astype('int64').to_numpy()
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    def _map(self, name, row):
+        array = self._maps.get(name)
+        if array is None or row >= len(array):
+            # Mở lại khi shard đã dài thêm (đang được ghi tiếp)
+            path = os.path.join(self.root, name)
+            height, width = shard_shape(name)
+            row_bytes = height * width * CHANNELS
+            rows = os.path.getsize(path) // row_bytes
+            if row >= rows:
+                raise IndexError(f"{name} chỉ có {rows} ảnh, không có dòng {row}")
+            array = np.memmap(path, dtype=np.uint8, mode='r', shape=(rows, height, width, CHANNELS))
+            with self._lock:
+                self._maps[name] = array
+        return array
+
+    def __len__(self):
+        return len(self.rows)
+
+    def image(self, index):
+        """Ảnh thứ ``index`` của index (view, không sao chép)"""
+        name, row = self._shard_names[index], self._shard_rows[index]
+        return self._map(name, row)[row]
+
+    def images(self, indices):
+        """Lô ảnh (N, H, W, 3) cho các chỉ số cùng kích thước ảnh (sao chép vào một mảng mới)"""
+        return np.stack([self.image(index) for index in indices])
+
+    def __getitem__(self, index):
+        item = self.rows.iloc[index].to_dict()
+        item['image'] = self.image(index)
+        return item
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def pack(csv_path, output_path, directory=None):
+    """Chuyển dataset augmented dạng file ảnh sang dạng đóng gói.
+
+    Dòng ảnh augmented (tên file có "_aug_") được nạp vào shard; dòng ảnh gốc giữ
+    nguyên ``local_path``. Ghi index mới ở ``output_path``.
+    """
+    from PIL import Image
+    from tqdm import tqdm
+
+    df = read_table(csv_path)
+    root = os.path.dirname(os.path.abspath(output_path))
+    directory = directory or os.path.join(root, 'packed')
+    writer = PackedWriter(directory)
+    shards, shard_rows = [], []
+    try:
+        for local_path in tqdm(df['local_path'], desc="Packing"):
+            if pd.isna(local_path) or '_aug_' not in os.path.basename(str(local_path)):
+                shards.append(None)
+                shard_rows.append(None)
+                continue
+            try:
+                with Image.open(local_path) as image:
+                    name, row = writer.append(np.asarray(image.convert('RGB')))
+            except Exception as e:
+                logging.error(f"Lỗi khi đọc ảnh {local_path}: {str(e)}")
+                shards.append(None)
+                shard_rows.append(None)
+                continue
+            shards.append(os.path.relpath(os.path.join(directory, name), root))
+            shard_rows.append(row)
+    finally:
+        writer.close()
+
+    packed = df.drop(columns=[c for c in ('width', 'height') if c in df.columns]).copy()
+    is_packed = pd.Series([shard is not None for shard in shards], index=packed.index)
+    packed.loc[is_packed, 'local_path'] = ''
+    packed['shard'] = shards
+    packed['shard_row'] = pd.array(shard_rows, dtype='Int64')
+    write_table(packed, output_path)
+    logging.info(f"Đã đóng gói {int(is_packed.sum())}/{len(packed)} ảnh, index: {output_path}")
+    return output_path
+
+
+def info(index_path):
+    """In số ảnh, số shard và dung lượng theo kích thước ảnh"""
+    dataset = PackedImageDataset(index_path)
+    print(f"{len(dataset)} ảnh đóng gói trong {index_path}")
+    for name, group in dataset.rows.groupby('shard'):
+        path = os.path.join(dataset.root, name)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        print(f"  {name:<50} {len(group):>7} ảnh  {size / 1024 ** 2:>9.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dataset ảnh augmented đóng gói (memory map)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    pack_parser = subparsers.add_parser('pack', help="Chuyển dataset file ảnh sang dạng đóng gói")
+    pack_parser.add_argument('--csv', required=True, help="captions_augmented.csv tạo bởi data_augument.py")
+    pack_parser.add_argument('--output', required=True, help="File index mới (.parquet hoặc .csv)")
+    pack_parser.add_argument('--directory', help="Thư mục shard (mặc định: packed/ cạnh file index)")
+    info_parser = subparsers.add_parser('info', help="Thông tin shard của một index")
+    info_parser.add_argument('--index', required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'pack':
+        pack(args.csv, args.output, args.directory)
+    elif args.command == 'info':
+        info(args.index)
+
+
+if __name__ == "__main__":
+    main()
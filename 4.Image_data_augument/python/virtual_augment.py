@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Dataset augmentation ảo: tạo lại ảnh augmented từ ảnh nguồn + seed khi cần.
+
+``data_augument.py --virtual`` chỉ lưu ảnh gốc; mỗi dòng augmented trong
+captions_augmented.csv ghi ``source_path``, ``aug_seed`` và ``transform_hash``
+thay vì một file ảnh. VirtualAugmentDataset dựng lại đúng biến thể đó bằng
+``transforms`` khi truy cập, và có thể sinh số biến thể tùy ý mỗi ảnh mà không
+tốn thêm dung lượng đĩa.
+
+Xuất ra file khi cần (ví dụ để chia sẻ dataset):
+    python virtual_augment.py materialize --csv ./augmented/captions_augmented.csv
+    python virtual_augment.py materialize --csv ... --variants 10
+"""
+import argparse
+import logging
+import os
+from functools import lru_cache
+
+import pandas as pd
+from tqdm import tqdm
+
+from data_augument import (RESULT_COLUMNS, TRANSFORM_HASH, ResultWriter, decode_image,
+                           derive_seed, make_result, process_image, render_variant, save_image)
+
+SOURCE_CACHE_SIZE = 32  # Số ảnh nguồn đã giải mã giữ trong bộ nhớ
+
+
+@lru_cache(maxsize=SOURCE_CACHE_SIZE)
+def load_source(path):
+    """Giải mã ảnh nguồn giống hệt lúc build (cùng bytes, cùng độ phân giải giải mã)"""
+    with open(path, 'rb') as f:
+        image, _ = decode_image(f.read())
+    return process_image(image)
+
+
+class VirtualAugmentDataset:
+    """Danh sách biến thể augmented ảo, mỗi phần tử được tạo lại khi truy cập.
+
+    - mặc định: đúng các biến thể đã ghi trong CSV
+    - ``variants_per_source=N``: N biến thể cho mỗi ảnh gốc, seed suy ra từ URL gốc và
+      ``base_seed`` (với base_seed=0, các biến thể đầu trùng với biến thể đã ghi trong CSV)
+    """
+
+    def __init__(self, csv_path, variants_per_source=None, base_seed=0, strict=True):
+        df = pd.read_csv(csv_path, dtype={'aug_seed': 'Int64'}, encoding='utf-8-sig')
+        if 'aug_seed' not in df.columns:
+            raise ValueError(f"{csv_path} không phải CSV augmentation ảo (thiếu cột aug_seed)")
+
+        virtual = df[df['aug_seed'].notna()]
+        hashes = set(virtual['transform_hash'].dropna())
+        if strict and hashes - {TRANSFORM_HASH}:
+            raise ValueError(f"Cấu hình transforms đã thay đổi ({', '.join(sorted(hashes))} != {TRANSFORM_HASH}), "
+                             "biến thể tạo lại sẽ khác lúc build")
+
+        self.items = []  # (dòng dữ liệu, ảnh nguồn, seed, thứ tự biến thể)
+        if variants_per_source is None:
+            counters = {}
+            for _, row in virtual.iterrows():
+                variant = counters.get(row['source_path'], 0)
+                counters[row['source_path']] = variant + 1
+                self.items.append((row, row['source_path'], int(row['aug_seed']), variant))
+        else:
+            originals = df[df['aug_seed'].isna() & df['local_path'].notna()]
+            for _, row in originals.iterrows():
+                for variant in range(variants_per_source):
+                    seed = derive_seed(row['original_url'], variant, base_seed)
+                    self.items.append((row, row['local_path'], seed, variant))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        row, source_path, seed, variant = self.items[index]
+        return {
+            'image': render_variant(load_source(source_path), seed),
+            'short_caption': row['short_caption'],
+            'original_url': row['original_url'],
+            'source_path': source_path,
+            'aug_seed': seed,
+            'variant': variant,
+        }
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def materialize(csv_path, output_csv=None, variants_per_source=None, base_seed=0):
+    """Ghi các biến thể ảo ra file ảnh và tạo CSV đầy đủ ``local_path`` như chế độ thường"""
+    output_csv = output_csv or os.path.splitext(csv_path)[0] + '_materialized.csv'
+    dataset = VirtualAugmentDataset(csv_path, variants_per_source, base_seed)
+    originals = pd.read_csv(csv_path, dtype={'aug_seed': 'Int64'}, encoding='utf-8-sig')
+    originals = originals[originals['aug_seed'].isna()]
+
+    writer = ResultWriter(output_csv, RESULT_COLUMNS)
+    try:
+        writer.write([{key: row[key] for key in RESULT_COLUMNS} for _, row in originals.iterrows()])
+        for index in tqdm(range(len(dataset)), desc="Materializing"):
+            row, source_path, _, variant = dataset.items[index]
+            name, ext = os.path.splitext(source_path)
+            path = f"{name}_aug_{variant}{ext}"
+            if save_image(dataset[index]['image'], path):
+                writer.write([make_result(row, path)])
+    finally:
+        writer.close()
+    logging.info(f"Đã ghi {writer.count} dòng vào {output_csv}")
+    return output_csv
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Làm việc với dataset augmentation ảo")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    materialize_parser = subparsers.add_parser('materialize', help="Xuất biến thể ảo ra file ảnh")
+    materialize_parser.add_argument('--csv', required=True, help="CSV tạo bởi data_augument.py --virtual")
+    materialize_parser.add_argument('--output-csv', help="CSV kết quả (mặc định: <csv>_materialized.csv)")
+    materialize_parser.add_argument('--variants', type=int,
+                                    help="Số biến thể mỗi ảnh gốc (mặc định: đúng các biến thể trong CSV)")
+    materialize_parser.add_argument('--base-seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'materialize':
+        materialize(args.csv, args.output_csv, args.variants, args.base_seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""So sánh chi phí augment mỗi ảnh: albumentations từng ảnh và batch_augment theo lô.
+
+Các chế độ (mỗi chế độ chạy trong một tiến trình con riêng để peak RSS không bị lẫn):
+  - albumentations: data_augument.apply_transforms cho từng ảnh (như augment_bytes)
+  - batch:          batch_augment.BatchAugmenter.augment cho từng lô ``--batch-size`` ảnh
+
+Ảnh đầu vào là ảnh tổng hợp (gradient + nhiễu) cỡ ``--width`` x ``--height``,
+giống ảnh sau decode_image (JPEG giải mã ở độ phân giải vừa đủ >= 512).
+Ngoài thời gian, kết quả có thống kê điểm ảnh của ảnh đầu ra (trung bình theo
+kênh, độ lệch của độ sáng trung bình giữa các ảnh, độ lệch trong ảnh) để so
+phân phối của hai cách chạy trên cùng đầu vào.
+
+Chạy:
+    python benchmarks/bench_augment.py
+    python benchmarks/bench_augment.py --images 192 --batch-size 3 32 --width 1024 --height 768
+Kết quả in ra dạng JSON.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+AUGMENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '4.Image_data_augument', 'python')
+
+
+def make_images(count, width, height, seed=0):
+    """Ảnh RGB uint8 tổng hợp, mỗi ảnh một màu nền khác nhau"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+    images = []
+    for _ in range(count):
+        colors = rng.uniform(0, 255, size=(2, 3)).astype(np.float32)
+        pixels = (colors[0] * x + colors[1] * y) / 2 + rng.normal(0, 12, size=(height, width, 3)).astype(np.float32)
+        images.append(np.clip(pixels, 0, 255).astype(np.uint8))
+    return images
+
+
+def pixel_stats(outputs):
+    pixels = np.stack(outputs).reshape(len(outputs), -1, 3).astype(np.float32)
+    image_means = pixels.mean(axis=1)
+    return {
+        'channel_mean': [round(float(v), 2) for v in image_means.mean(axis=0)],
+        'image_mean_std': [round(float(v), 2) for v in image_means.std(axis=0)],
+        'within_image_std': round(float(pixels.std(axis=1).mean()), 2),
+    }
+
+
+def run_mode(mode, args, batch_size):
+    sys.path.insert(0, AUGMENT_DIR)
+    import data_augument
+    images = make_images(args.images, args.width, args.height)
+
+    outputs = []
+    timings = []   # thời gian mỗi ảnh (với batch: thời gian cả lô chia đều)
+    if mode == 'albumentations':
+        data_augument.apply_transforms(images[0])  # khởi động
+        np.random.seed(args.seed)
+        for image in images:
+            start = time.perf_counter()
+            outputs.append(data_augument.apply_transforms(image))
+            timings.append(time.perf_counter() - start)
+    else:
+        from batch_augment import BatchAugmenter
+        augmenter = BatchAugmenter()
+        augmenter.augment(images[:batch_size], seed=0)  # khởi động, cấp phát buffer
+        for offset in range(0, len(images), batch_size):
+            batch = images[offset:offset + batch_size]
+            start = time.perf_counter()
+            result = augmenter.augment(batch, seed=args.seed + offset)
+            elapsed = time.perf_counter() - start
+            outputs.extend(result)
+            timings.extend([elapsed / len(batch)] * len(batch))
+
+    timings.sort()
+    # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+    result = {
+        'mode': mode,
+        'images': len(timings),
+        'ms_per_image': 1000 * sum(timings) / len(timings),
+        'images_per_s': len(timings) / sum(timings),
+        'peak_rss_mb': peak_rss / 1024 / 1024,
+        'pixels': pixel_stats(outputs),
+    }
+    if mode == 'batch':
+        result['batch_size'] = batch_size
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark augment từng ảnh và theo lô")
+    parser.add_argument('--images', type=int, default=96)
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=768)
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[3, 32],
+                        help="Cỡ lô cho chế độ batch (3 = số biến thể mỗi ảnh trong augment_bytes)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', choices=['albumentations', 'batch'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Tiến trình con: chạy một chế độ duy nhất
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args, args.batch_size[0])))
+        return
+
+    runs = [('albumentations', args.batch_size[0])] + [('batch', size) for size in args.batch_size]
+    results = []
+    for mode, batch_size in runs:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--mode', mode, '--images', str(args.images),
+             '--width', str(args.width), '--height', str(args.height),
+             '--batch-size', str(batch_size), '--seed', str(args.seed)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output))
+
+    baseline = results[0]['ms_per_image']
+    for result in results[1:]:
+        result['speedup'] = baseline / result['ms_per_image']
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""So sánh thời gian nạp và bộ nhớ khi đọc bảng dữ liệu từ CSV và Parquet
+(common/dataset_io.py).
+
+Mỗi chế độ chạy trong một tiến trình con riêng để peak RSS không bị lẫn:
+  - *_full:       đọc toàn bộ bảng
+  - *_projection: chỉ đọc original_url, search_query, short_caption
+  - *_filter:     chỉ các dòng của một search_query có width >= 800
+Với CSV, projection/filter chỉ làm được sau khi parse (usecols vẫn phải quét cả file);
+với Parquet, cột và row group không cần thiết được bỏ qua ngay khi đọc.
+
+Chạy:
+    python benchmarks/bench_dataset_io.py                  # gộp traffic_images_dataset_v*.csv, nhân 10 lần
+    python benchmarks/bench_dataset_io.py --csv my.csv --scale 1
+Kết quả in ra dạng JSON.
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CRAWL_CSVS = os.path.join(ROOT_DIR, '1.crawl_data', 'output', 'traffic_images_dataset_v*.csv')
+MODES = ['csv_full', 'parquet_full', 'csv_projection', 'parquet_projection', 'csv_filter', 'parquet_filter']
+PROJECTION = ['original_url', 'search_query', 'short_caption']
+
+
+def peak_rss_mb():
+    # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+    return peak_rss / 1024 / 1024
+
+
+def prepare(out_dir, csv_paths, scale):
+    """Ghi bảng thử nghiệm ra CSV (utf-8-sig như các bước hiện tại) và Parquet"""
+    import pandas as pd
+    from dataset_io import write_table
+
+    df = pd.concat([pd.read_csv(path, encoding='utf-8-sig') for path in csv_paths], ignore_index=True)
+    df = pd.concat([df] * scale, ignore_index=True)
+    if 'short_caption' not in df.columns:
+        df['short_caption'] = "Đường phố đông xe máy, người đi bộ chờ sang đường tại vạch kẻ."
+    csv_path = os.path.join(out_dir, 'dataset.csv')
+    parquet_path = os.path.join(out_dir, 'dataset.parquet')
+    write_table(df, csv_path)
+    write_table(df, parquet_path)
+    # search_query phổ biến nhất, dùng cho chế độ filter
+    query = df['search_query'].value_counts().index[0]
+    return {'csv': csv_path, 'parquet': parquet_path, 'rows': len(df), 'query': query,
+            'csv_mb': os.path.getsize(csv_path) / 1024 / 1024,
+            'parquet_mb': os.path.getsize(parquet_path) / 1024 / 1024}
+
+
+def run_mode(mode, info, repeat):
+    from dataset_io import read_table
+
+    file_format, kind = mode.split('_', 1)
+    path = info[file_format]
+    columns = PROJECTION if kind == 'projection' else None
+    filters = [('search_query', '==', info['query']), ('width', '>=', 800)] if kind == 'filter' else None
+
+    rss_before = peak_rss_mb()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = read_table(path, columns=columns, filters=filters)
+        timings.append(time.perf_counter() - start)
+        rows = len(df)
+        memory_mb = df.memory_usage(deep=True).sum() / 1024 / 1024
+        del df
+
+    timings.sort()
+    return {
+        'mode': mode,
+        'rows': rows,
+        'load_ms_min': 1000 * timings[0],
+        'load_ms_p50': 1000 * timings[len(timings) // 2],
+        'dataframe_mb': memory_mb,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_delta_mb': peak_rss_mb() - rss_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark đọc bảng dữ liệu CSV và Parquet")
+    parser.add_argument('--csv', nargs='+', help="File CSV đầu vào (mặc định: traffic_images_dataset_v*.csv)")
+    parser.add_argument('--scale', type=int, default=10, help="Nhân bản dữ liệu để bảng đủ lớn")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--mode', choices=MODES + ['prepare'], help=argparse.SUPPRESS)
+    parser.add_argument('--info-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Tiến trình con: tạo dữ liệu thử nghiệm hoặc chạy một chế độ duy nhất
+    if args.mode == 'prepare':
+        info = prepare(os.path.dirname(args.info_file), args.csv, args.scale)
+        with open(args.info_file, 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False)
+        return
+    if args.mode:
+        with open(args.info_file, encoding='utf-8') as f:
+            info = json.load(f)
+        print(json.dumps(run_mode(args.mode, info, args.repeat)))
+        return
+
+    csv_paths = args.csv or sorted(glob.glob(CRAWL_CSVS))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        info_file = os.path.join(tmp_dir, 'info.json')
+        # Tạo dữ liệu trong tiến trình riêng: trên Linux tiến trình con kế thừa
+        # peak RSS của tiến trình cha nên tiến trình cha phải giữ nhẹ
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', 'prepare',
+                        '--info-file', info_file, '--scale', str(args.scale), '--csv'] + csv_paths,
+                       check=True)
+        with open(info_file, encoding='utf-8') as f:
+            info = json.load(f)
+
+        results = []
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--mode', mode,
+                 '--info-file', info_file, '--repeat', str(args.repeat)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            results.append(json.loads(output))
+
+    summary = {key: info[key] for key in ('rows', 'csv_mb', 'parquet_mb')}
+    print(json.dumps({'dataset': summary, 'results': results}, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""So sánh thời gian giải mã mỗi ảnh và bộ nhớ đỉnh (peak RSS) trước/sau khi
+dùng common/image_loader.py.
+
+Mỗi chế độ chạy trong một tiến trình con riêng để peak RSS không bị lẫn:
+  - caption_before: Image.open + thumbnail((800, 800), LANCZOS) như cũ
+  - caption_after:  load_thumbnail + encode_jpeg (payload gửi Gemini)
+  - augment_before: giải mã đầy đủ rồi np.array như data_augument.py cũ
+  - augment_after:  open_image(min_size=(512, 512)) rồi np.array
+
+Chạy:
+    python benchmarks/bench_image_loader.py                 # ảnh tổng hợp 2000x1500 và 4000x3000
+    python benchmarks/bench_image_loader.py --images ./dir   # ảnh thật
+Kết quả in ra dạng JSON.
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from image_loader import open_image, load_thumbnail, encode_jpeg
+
+MODES = ['caption_before', 'caption_after', 'augment_before', 'augment_after']
+
+
+def make_synthetic_images(out_dir, sizes=((2000, 1500), (4000, 3000)), per_size=5, seed=0):
+    """Tạo ảnh JPEG tổng hợp có nhiễu (khó nén như ảnh chụp thật)"""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for width, height in sizes:
+        for i in range(per_size):
+            # Nền gradient + nhiễu để kích thước file gần với ảnh chụp
+            x = np.linspace(0, 255, width, dtype=np.float32)
+            y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+            base = (x[None, :] * 0.5 + y * 0.5)[..., None].repeat(3, axis=2)
+            noise = rng.normal(0, 25, size=(height, width, 3)).astype(np.float32)
+            pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+            path = os.path.join(out_dir, f"synthetic_{width}x{height}_{i}.jpg")
+            Image.fromarray(pixels).save(path, quality=90)
+            paths.append(path)
+    return paths
+
+
+def run_mode(mode, paths, repeat):
+    datas = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            datas.append(f.read())
+
+    timings = []
+    payload_bytes = 0
+    for _ in range(repeat):
+        for data in datas:
+            start = time.perf_counter()
+            if mode == 'caption_before':
+                image = Image.open(BytesIO(data))
+                if image.size[0] > 800 or image.size[1] > 800:
+                    image.thumbnail((800, 800), Image.Resampling.LANCZOS)
+                image.load()
+            elif mode == 'caption_after':
+                image = load_thumbnail(data, max_size=(800, 800))
+                payload_bytes += len(encode_jpeg(image))
+            elif mode == 'augment_before':
+                image = Image.open(BytesIO(data)).convert('RGB')
+                array = np.array(image)
+            elif mode == 'augment_after':
+                image, _, _ = open_image(data, min_size=(512, 512), mode='RGB')
+                array = np.array(image)
+            timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+    result = {
+        'mode': mode,
+        'images': len(timings),
+        'decode_ms_mean': 1000 * sum(timings) / len(timings),
+        'decode_ms_p50': 1000 * timings[len(timings) // 2],
+        'decode_ms_p99': 1000 * timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+        'peak_rss_mb': peak_rss / 1024 / 1024,
+    }
+    if mode == 'caption_after':
+        result['payload_kb_mean'] = payload_bytes / len(timings) / 1024
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark giải mã ảnh trước/sau image_loader")
+    parser.add_argument('--images', help="Thư mục ảnh JPEG (mặc định: tạo ảnh tổng hợp)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--mode', choices=MODES + ['generate'], help=argparse.SUPPRESS)
+    parser.add_argument('--paths-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Tiến trình con: tạo ảnh tổng hợp hoặc chạy một chế độ duy nhất
+    if args.mode == 'generate':
+        with open(args.paths_file, 'w', encoding='utf-8') as f:
+            json.dump(make_synthetic_images(os.path.dirname(args.paths_file)), f)
+        return
+    if args.mode:
+        with open(args.paths_file, encoding='utf-8') as f:
+            paths = json.load(f)
+        print(json.dumps(run_mode(args.mode, paths, args.repeat)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths_file = os.path.join(tmp_dir, 'paths.json')
+        if args.images:
+            with open(paths_file, 'w', encoding='utf-8') as f:
+                json.dump(sorted(glob.glob(os.path.join(args.images, '*.jp*g'))), f)
+        else:
+            # Tạo ảnh trong tiến trình riêng: trên Linux tiến trình con kế thừa
+            # peak RSS của tiến trình cha nên tiến trình cha phải giữ nhẹ
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', 'generate',
+                            '--paths-file', paths_file], check=True)
+
+        results = []
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--mode', mode,
+                 '--paths-file', paths_file, '--repeat', str(args.repeat)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            results.append(json.loads(output))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""Benchmark thông lượng từng bước của pipeline, hoàn toàn offline.
+
+Không gọi Google/SerpApi/Gemini: ảnh lấy từ server ảnh tổng hợp
+(synthetic_server.py, cấu hình được kích thước, độ trễ, tỷ lệ lỗi, số host),
+caption lấy từ FakeCaptionClient (độ trễ và lỗi 429 cấu hình được). Mỗi bước
+chạy đúng code thật của repo:
+  - download: traffic_raw.download_image (stream vào ImageStore)
+  - validate: url_validator.check_image_url (HEAD)
+  - caption:  label_short_captions.get_prediction, hoặc get_prediction_batch
+              khi --images-per-request > 1
+  - augment:  data_augument.process_single_row (tải, giải mã, augment, lưu ảnh)
+
+Mỗi bước chạy trong một tiến trình con riêng (peak RSS không bị lẫn, cache
+HTTP riêng nên luôn tải lạnh từ server). Kết quả JSON mỗi bước: images/s,
+bytes/s (đo ở phía server), p50/p99 độ trễ mỗi ảnh và peak RSS.
+
+Chạy:
+    python benchmarks/bench_stages.py --images 200 --hosts 4 --latency 0.05
+    python benchmarks/bench_stages.py --stages caption --model-latency 0.3 --model-rpm-limit 600
+    python benchmarks/bench_stages.py --output bench.json                 # lưu kết quả
+    python benchmarks/bench_stages.py --baseline bench.json --tolerance 0.2  # báo chậm đi so với lần trước
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCH_DIR, '..')
+STAGE_DIRS = ('common', '1.crawl_data/python', '2.data_preprocessing/python',
+              '3.labels_short_captions/python', '4.Image_data_augument/python')
+STAGES = ['download', 'validate', 'caption', 'augment']
+# Số luồng mặc định giống cấu hình của từng bước
+DEFAULT_WORKERS = {'download': 16, 'validate': 32, 'caption': 16, 'augment': 8}
+CAPTION = "Đường phố đông xe máy, người đi bộ chờ sang đường tại vạch kẻ."
+
+
+def peak_rss_mb():
+    # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+    return peak_rss / 1024 / 1024
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+def make_task(stage, info, work_dir):
+    """Hàm xử lý một nhóm URL của bước ``stage``, trả về số ảnh thành công và thông tin thêm"""
+    for subdir in STAGE_DIRS:
+        sys.path.insert(0, os.path.join(ROOT_DIR, subdir))
+    workers = info['workers'][stage]
+
+    if stage == 'download':
+        from image_store import ImageStore
+        from traffic_raw import create_session_with_retries, download_image
+        store = ImageStore(os.path.join(work_dir, 'images'))
+        session = create_session_with_retries(workers, workers)
+        return (lambda urls: sum(download_image(url, 'benchmark', session, store) is not None for url in urls)), dict
+
+    if stage == 'validate':
+        from url_validator import check_image_url, create_session
+        session = create_session(workers)
+        return (lambda urls: sum(bool(check_image_url(url, session=session)[0]) for url in urls)), dict
+
+    if stage == 'caption':
+        from label_short_captions import (CaptionRateController, FakeCaptionClient, OPTIMIZED_PROMPT,
+                                          get_prediction, get_prediction_batch)
+        model = info['model']
+        client = FakeCaptionClient(latency=model['latency'], jitter=model['jitter'], rpm_limit=model['rpm_limit'],
+                                   error_rate=model['error_rate'])
+        controller = CaptionRateController(max_concurrency=workers)
+
+        def caption(urls):
+            if len(urls) > 1:
+                captions = get_prediction_batch(urls, OPTIMIZED_PROMPT, client=client, controller=controller,
+                                                caption_cache=False)
+            else:
+                captions = [get_prediction(urls[0], OPTIMIZED_PROMPT, client=client, controller=controller,
+                                           caption_cache=False)]
+            return sum(bool(c) for c in captions)
+
+        def extra():
+            return {'model_calls': client.calls, 'model_429': client.rate_limited,
+                    'final_concurrency': controller.concurrency.limit}
+        return caption, extra
+
+    if stage == 'augment':
+        from data_augument import process_single_row
+        output_dir = os.path.join(work_dir, 'augmented')
+        os.makedirs(os.path.join(output_dir, 'images'), exist_ok=True)
+        resolution = f"{info['server']['width']}x{info['server']['height']}"
+
+        def augment(urls):
+            ok = 0
+            for url in urls:
+                row = {'original_url': url, 'source_website': 'benchmark', 'resolution': resolution,
+                       'search_query': 'benchmark', 'short_caption': CAPTION}
+                ok += bool(process_single_row(row, url.rsplit('/', 1)[-1].split('.')[0], output_dir))
+            return ok
+        return augment, dict
+
+    raise ValueError(f"Bước không hợp lệ: {stage}")
+
+
+def run_stage(stage, info, work_dir):
+    """Chạy một bước trên toàn bộ URL bằng ThreadPoolExecutor, đo độ trễ từng nhóm"""
+    task, extra = make_task(stage, info, work_dir)
+    urls = info['urls']
+    step = info['images_per_request'] if stage == 'caption' else 1
+    groups = [urls[i:i + step] for i in range(0, len(urls), step)]
+
+    def timed(group):
+        start = time.perf_counter()
+        ok = task(group)
+        # Độ trễ của nhóm nhiều ảnh được tính cho từng ảnh trong nhóm
+        return ok, [time.perf_counter() - start] * len(group)
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=info['workers'][stage]) as executor:
+        results = list(executor.map(timed, groups))
+    wall = time.perf_counter() - start
+
+    ok = sum(r[0] for r in results)
+    latencies = sorted(latency for r in results for latency in r[1])
+    return {
+        'stage': stage,
+        'workers': info['workers'][stage],
+        'images': len(urls),
+        'ok': ok,
+        'failed': len(urls) - ok,
+        'wall_s': wall,
+        'images_per_s': len(urls) / wall,
+        'p50_ms': 1000 * percentile(latencies, 0.50),
+        'p99_ms': 1000 * percentile(latencies, 0.99),
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_delta_mb': peak_rss_mb() - rss_before,
+        **extra(),
+    }
+
+
+def start_server(args):
+    """Chạy synthetic_server.py trong tiến trình riêng, trả về (process, base_urls)"""
+    command = [sys.executable, os.path.join(BENCH_DIR, 'synthetic_server.py'),
+               '--hosts', str(args.hosts), '--width', str(args.width), '--height', str(args.height),
+               '--latency', str(args.latency), '--jitter', str(args.jitter), '--error-rate', str(args.error_rate)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line:
+        process.kill()
+        raise RuntimeError("Không khởi động được synthetic_server.py")
+    return process, json.loads(line)['base_urls']
+
+
+def server_stats(base_url):
+    with urllib.request.urlopen(base_url + '/stats', timeout=10) as response:
+        return json.load(response)
+
+
+def find_regressions(results, baseline, tolerance):
+    """So với lần chạy trước: images/s giảm hoặc p99 tăng quá ``tolerance``"""
+    previous = {r['stage']: r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        old = previous.get(result['stage'])
+        if old is None:
+            continue
+        if result['images_per_s'] < old['images_per_s'] * (1 - tolerance):
+            regressions.append({'stage': result['stage'], 'metric': 'images_per_s',
+                                'baseline': old['images_per_s'], 'current': result['images_per_s']})
+        if result['p99_ms'] > old['p99_ms'] * (1 + tolerance):
+            regressions.append({'stage': result['stage'], 'metric': 'p99_ms',
+                                'baseline': old['p99_ms'], 'current': result['p99_ms']})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline thông lượng từng bước của pipeline")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--images', type=int, default=200, help="Số ảnh mỗi bước")
+    parser.add_argument('--hosts', type=int, default=4, help="Số host ảnh khác nhau")
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=768)
+    parser.add_argument('--latency', type=float, default=0.05, help="Độ trễ server ảnh (giây)")
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.02, help="Tỷ lệ ảnh trả lỗi 404/500")
+    parser.add_argument('--model-latency', type=float, default=0.5, help="Độ trễ model caption giả (giây)")
+    parser.add_argument('--model-jitter', type=float, default=0.1)
+    parser.add_argument('--model-rpm-limit', type=int, help="Vượt quá số request/phút này model giả báo 429")
+    parser.add_argument('--model-error-rate', type=float, default=0.0, help="Tỷ lệ 429 ngẫu nhiên")
+    parser.add_argument('--images-per-request', type=int, default=1, help="Số ảnh mỗi request caption")
+    for stage in STAGES:
+        parser.add_argument(f'--{stage}-workers', type=int, default=DEFAULT_WORKERS[stage])
+    parser.add_argument('--output', help="Ghi kết quả JSON ra file")
+    parser.add_argument('--baseline', help="File kết quả của lần chạy trước để so sánh")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Mức chênh lệch cho phép so với baseline")
+    parser.add_argument('--stage', choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument('--info-file', help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Tiến trình con: chạy một bước duy nhất
+    if args.stage:
+        with open(args.info_file, encoding='utf-8') as f:
+            info = json.load(f)
+        print(json.dumps(run_stage(args.stage, info, args.work_dir)))
+        return
+
+    config = {
+        'images': args.images,
+        'server': {'hosts': args.hosts, 'width': args.width, 'height': args.height, 'latency': args.latency,
+                   'jitter': args.jitter, 'error_rate': args.error_rate},
+        'model': {'latency': args.model_latency, 'jitter': args.model_jitter, 'rpm_limit': args.model_rpm_limit,
+                  'error_rate': args.model_error_rate},
+        'images_per_request': args.images_per_request,
+        'workers': {stage: getattr(args, f'{stage}_workers') for stage in STAGES},
+    }
+    server, base_urls = start_server(args)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            info = dict(config, urls=[f"{base_urls[i % len(base_urls)]}/img/{i}.jpg" for i in range(args.images)])
+            info_file = os.path.join(tmp_dir, 'info.json')
+            with open(info_file, 'w', encoding='utf-8') as f:
+                json.dump(info, f)
+
+            for stage in args.stages:
+                work_dir = os.path.join(tmp_dir, stage)
+                os.makedirs(work_dir)
+                # Cache HTTP riêng cho mỗi bước: ảnh luôn được tải từ server
+                env = dict(os.environ, HTTP_CACHE_DIR=os.path.join(work_dir, 'http_cache'))
+                before = server_stats(base_urls[0])
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--stage', stage,
+                     '--info-file', info_file, '--work-dir', work_dir],
+                    check=True, capture_output=True, text=True, env=env
+                ).stdout
+                after = server_stats(base_urls[0])
+                # Dòng JSON là dòng cuối, các dòng trước là log của code được đo
+                result = json.loads(output.strip().splitlines()[-1])
+                result['server_requests'] = after['requests'] - before['requests']
+                result['bytes_per_s'] = (after['bytes_sent'] - before['bytes_sent']) / result['wall_s']
+                results.append(result)
+    finally:
+        server.kill()
+        server.wait()
+
+    report = {'config': config, 'results': results, 'timestamp': time.time()}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        # Chỉ so sánh có ý nghĩa khi cấu hình giống nhau
+        report['baseline_config_matches'] = baseline.get('config') == config
+        report['regressions'] = find_regressions(results, baseline, args.tolerance)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Server ảnh tổng hợp chạy cục bộ cho benchmark các bước (không cần mạng).
+
+    GET/HEAD /img/<id>.jpg   ảnh JPEG kích thước cấu hình được, nội dung khác nhau theo id
+    GET      /stats          số request và số byte đã gửi (JSON)
+
+Cấu hình:
+  - ``width``/``height``/``quality``: kích thước và chất lượng JPEG
+  - ``latency``/``jitter``: độ trễ trước mỗi response ảnh (giây)
+  - ``error_rate``: tỷ lệ id trả lỗi (404 hoặc 500), cố định theo id để các
+    bước gặp cùng một tập ảnh lỗi
+  - ``hosts``: số host khác nhau; mỗi host là một địa chỉ loopback riêng
+    127.0.0.<k> (Linux định tuyến cả dải 127.0.0.0/8 về máy) để giới hạn
+    theo host và connection pool hoạt động như với nhiều server thật
+
+Chạy riêng (in một dòng JSON chứa base URL của từng host):
+    python benchmarks/synthetic_server.py --hosts 4 --latency 0.05 --error-rate 0.02
+"""
+import argparse
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import urlparse
+
+import numpy as np
+from PIL import Image
+
+VARIANTS = 16   # Số ảnh nền khác nhau được mã hóa sẵn lúc khởi động
+
+
+def _stable_fraction(text):
+    return int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little') / 2 ** 64
+
+
+def render_variants(width, height, quality=85, count=VARIANTS, seed=0):
+    """Mã hóa sẵn ``count`` ảnh JPEG có nhiễu (khó nén như ảnh chụp thật)"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+    variants = []
+    for _ in range(count):
+        colors = rng.uniform(0, 255, size=(2, 3)).astype(np.float32)
+        pixels = colors[0] * x + colors[1] * y
+        pixels = pixels / 2 + rng.normal(0, 12, size=(height, width, 3)).astype(np.float32)
+        buffer = BytesIO()
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format='JPEG', quality=quality)
+        variants.append(buffer.getvalue())
+    return variants
+
+
+def with_comment(jpeg, text):
+    """Chèn đoạn COM ngay sau SOI: ảnh giữ nguyên điểm ảnh nhưng bytes khác nhau theo id"""
+    payload = text.encode('utf-8')
+    return jpeg[:2] + b'\xff\xfe' + struct.pack('>H', len(payload) + 2) + payload + jpeg[2:]
+
+
+class SyntheticImageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # giữ kết nối để connection pool của client được dùng lại
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type, extra_headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+            self.server.stats.add(len(body))
+        else:
+            self.server.stats.add(0)
+
+    def do_GET(self):
+        config = self.server.config
+        path = urlparse(self.path).path
+        if path == '/stats':
+            self._send(200, json.dumps(self.server.stats.snapshot()).encode('utf-8'), 'application/json')
+            return
+        if not (path.startswith('/img/') and path.endswith('.jpg')):
+            self._send(404, b'not found', 'text/plain')
+            return
+        try:
+            image_id = int(path[len('/img/'):-len('.jpg')])
+        except ValueError:
+            self._send(404, b'not found', 'text/plain')
+            return
+
+        delay = config.latency + random.uniform(0, config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        failure = _stable_fraction(f"error|{image_id}")
+        if failure < config.error_rate:
+            status = 404 if failure < config.error_rate / 2 else 500
+            self._send(status, b'error', 'text/plain')
+            return
+        body = with_comment(config.variants[image_id % len(config.variants)], f"id={image_id}")
+        self._send(200, body, 'image/jpeg', {'Last-Modified': config.last_modified})
+
+    do_HEAD = do_GET
+
+
+class ServerStats:
+    """Bộ đếm dùng chung cho mọi host"""
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def add(self, size):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += size
+
+    def snapshot(self):
+        with self._lock:
+            return {'requests': self.requests, 'bytes_sent': self.bytes_sent}
+
+
+class ServerConfig:
+    def __init__(self, width=1024, height=768, quality=85, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.width = width
+        self.height = height
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.variants = render_variants(width, height, quality)
+        self.last_modified = formatdate(time.time() - 24 * 3600, usegmt=True)  # ảnh "mới", không bị lọc theo tuổi
+
+
+class SyntheticImageServer:
+    """Một ThreadingHTTPServer cho mỗi host, cùng cấu hình và bộ đếm"""
+
+    def __init__(self, hosts=1, **config):
+        self.config = ServerConfig(**config)
+        self.stats = ServerStats()
+        self._servers = []
+        for k in range(max(1, hosts)):
+            server = ThreadingHTTPServer((f"127.0.0.{k + 1}", 0), SyntheticImageHandler)
+            server.daemon_threads = True
+            server.config = self.config
+            server.stats = self.stats
+            self._servers.append(server)
+        self.base_urls = [f"http://{server.server_address[0]}:{server.server_address[1]}"
+                          for server in self._servers]
+
+    def start(self):
+        for server in self._servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self
+
+    def shutdown(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+    def image_urls(self, count):
+        """``count`` URL ảnh khác nhau, chia đều lần lượt cho các host"""
+        return [f"{self.base_urls[i % len(self.base_urls)]}/img/{i}.jpg" for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server ảnh tổng hợp cho benchmark")
+    parser.add_argument('--hosts', type=int, default=1)
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=768)
+    parser.add_argument('--quality', type=int, default=85)
+    parser.add_argument('--latency', type=float, default=0.0, help="Độ trễ mỗi response ảnh (giây)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Độ trễ ngẫu nhiên cộng thêm tối đa (giây)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Tỷ lệ ảnh trả lỗi 404/500")
+    args = parser.parse_args()
+
+    server = SyntheticImageServer(hosts=args.hosts, width=args.width, height=args.height, quality=args.quality,
+                                  latency=args.latency, jitter=args.jitter, error_rate=args.error_rate).start()
+    print(json.dumps({'base_urls': server.base_urls}), flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
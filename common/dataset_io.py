@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""Đọc/ghi bảng dữ liệu giữa các bước dưới dạng Parquet (CSV vẫn dùng được).
+
+Định dạng được chọn theo đuôi file: ``.parquet`` hoặc ``.csv``. Với Parquet:
+  - schema có kiểu: ``resolution`` "2000x1500" được lưu thành hai cột số
+    ``width``/``height``, ``search_query``/``source_website`` mã hóa kiểu
+    dictionary, caption là chuỗi,
+  - chỉ đọc các cột cần (``columns``) và lọc ngay khi đọc (``filters``, dạng
+    danh sách điều kiện của pyarrow, ví dụ ``[('width', '>=', 800)]``), các
+    row group không thỏa điều kiện không bị giải mã.
+
+``filters`` chỉ nhận các cột có thật trong bảng (``width``/``height`` luôn
+có) với toán tử ``==``, ``=``, ``!=``, ``<``, ``<=``, ``>``, ``>=``, ``in``,
+``not in``. Lọc theo ``resolution`` bị từ chối (ValueError): cột chuỗi "WxH"
+so sánh theo thứ tự từ điển ("800x600" > "1000x900") và không có trong file
+Parquet, hãy lọc theo ``width``/``height``.
+
+DataFrame đọc từ hai định dạng giống nhau: luôn có ``width``/``height`` và cột
+``resolution`` dạng chuỗi như trước để code cũ không phải sửa. Khi ghi CSV,
+``width``/``height`` được bỏ đi để file giữ nguyên định dạng cũ.
+
+pyarrow chỉ cần khi đọc/ghi Parquet. Chuyển đổi từ dòng lệnh:
+    python common/dataset_io.py convert valid_urls_dataset_v12.csv valid_urls_dataset_v12.parquet
+    python common/dataset_io.py convert captions.parquet captions.csv
+"""
+import argparse
+import operator
+import os
+
+import pandas as pd
+
+DICTIONARY_COLUMNS = {'source_website', 'search_query', 'transform_hash', 'shard', 'caption_source'}
+STRING_COLUMNS = {'title', 'original_url', 'thumbnail_url', 'local_path', 'short_caption',
+                  'source_path', 'normalized_url'}
+INT_COLUMNS = {'width': 'int32', 'height': 'int32', 'page_number': 'int16', 'aug_seed': 'int64',
+               'shard_row': 'int64'}
+
+# Row group nhỏ để bộ lọc bỏ qua được từng phần của file và đọc theo từng đợt
+ROW_GROUP_SIZE = 64 * 1024
+
+RESOLUTION_PATTERN = r'^\s*(\d+)\s*[xX×]\s*(\d+)\s*$'
+
+_OPERATORS = {
+    '==': operator.eq, '=': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+}
+
+
+def is_parquet(path):
+    return str(path).lower().endswith(('.parquet', '.pq'))
+
+
+def split_resolution(resolution):
+    """Tách cột "WxH" thành hai Series số nguyên (width, height), thiếu thì là NA"""
+    parts = resolution.astype('string').str.extract(RESOLUTION_PATTERN)
+    return parts[0].astype('Int32'), parts[1].astype('Int32')
+
+
+def join_resolution(width, height):
+    resolution = width.astype('string') + 'x' + height.astype('string')
+    return resolution.astype(object).where(resolution.notna(), None)
+
+
+def _arrow_type(column):
+    import pyarrow as pa
+    if column in DICTIONARY_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    if column in STRING_COLUMNS:
+        return pa.string()
+    if column in INT_COLUMNS:
+        return getattr(pa, INT_COLUMNS[column])()
+    return None
+
+
+def _nullable_int_types():
+    import pyarrow as pa
+    return {pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype()}
+
+
+def to_arrow(df):
+    """DataFrame -> pyarrow.Table theo schema có kiểu (resolution được tách thành width/height)"""
+    import pyarrow as pa
+
+    if 'resolution' in df.columns:
+        width, height = split_resolution(df['resolution'])
+        position = df.columns.get_loc('resolution')
+        df = df.drop(columns=['resolution'] + [c for c in ('width', 'height') if c in df.columns])
+        df.insert(min(position, len(df.columns)), 'height', height)
+        df.insert(min(position, len(df.columns)), 'width', width)
+
+    arrays, fields = [], []
+    for column in df.columns:
+        series = df[column]
+        arrow_type = _arrow_type(column)
+        if column in STRING_COLUMNS or column in DICTIONARY_COLUMNS:
+            series = series.astype(object).where(series.notna(), None).map(
+                lambda value: value if value is None else str(value))
+        if column in DICTIONARY_COLUMNS:
+            array = pa.array(series, type=pa.string()).dictionary_encode()
+        elif column in INT_COLUMNS:
+            array = pa.array(pd.to_numeric(series, errors='coerce').astype('Int64'), from_pandas=True).cast(arrow_type)
+        elif arrow_type is not None:
+            array = pa.array(series, type=arrow_type, from_pandas=True)
+        else:
+            array = pa.array(series, from_pandas=True)
+        arrays.append(array)
+        fields.append(pa.field(str(column), array.type))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def _with_resolution(df):
+    """Bổ sung cột resolution/width/height còn thiếu để hai định dạng đọc ra giống nhau"""
+    if 'resolution' not in df.columns and {'width', 'height'} <= set(df.columns):
+        df.insert(df.columns.get_loc('width'), 'resolution', join_resolution(df['width'], df['height']))
+    elif 'resolution' in df.columns and 'width' not in df.columns:
+        width, height = split_resolution(df['resolution'])
+        position = df.columns.get_loc('resolution') + 1
+        df.insert(position, 'height', height)
+        df.insert(position, 'width', width)
+    return df
+
+
+def _filter_conditions(filters):
+    """Các điều kiện (cột, toán tử, giá trị) trong ``filters`` (AND hoặc OR của các nhóm AND)"""
+    for group in (filters or []):
+        yield from (group if isinstance(group, list) else [group])
+
+
+def _check_filters(filters, available):
+    """Từ chối sớm bằng ValueError các bộ lọc không hỗ trợ thay vì lỗi pyarrow/so sánh chuỗi"""
+    columns = set(available)
+    if 'resolution' in columns or {'width', 'height'} <= columns:
+        columns |= {'width', 'height'}
+    for condition in _filter_conditions(filters):
+        column, op, _ = condition
+        if column == 'resolution':
+            raise ValueError("Không lọc được theo 'resolution' (chuỗi \"WxH\"), "
+                             "hãy lọc theo 'width'/'height'")
+        if column not in columns:
+            raise ValueError(f"Không lọc được theo cột không có trong bảng: {column!r}")
+        if op not in _OPERATORS and op not in ('in', 'not in'):
+            raise ValueError(f"Toán tử lọc không hỗ trợ: {op!r}")
+
+
+def _apply_filters(df, filters):
+    """Lọc DataFrame theo cùng cú pháp ``filters`` của pyarrow (dùng khi đọc CSV)"""
+    if not filters:
+        return df
+    # Danh sách điều kiện đơn là AND; danh sách các danh sách là OR của các nhóm AND
+    groups = filters if isinstance(filters[0], list) else [filters]
+    mask = pd.Series(False, index=df.index)
+    for group in groups:
+        group_mask = pd.Series(True, index=df.index)
+        for column, op, value in group:
+            if op == 'in':
+                group_mask &= df[column].isin(value)
+            elif op == 'not in':
+                group_mask &= ~df[column].isin(value)
+            else:
+                group_mask &= _OPERATORS[op](df[column], value).fillna(False).astype(bool)
+        mask |= group_mask
+    return df[mask]
+
+
+def _source_columns(columns, filters, available):
+    """Các cột thật cần đọc từ file để trả về ``columns`` và tính ``filters``"""
+    needed = list(columns)
+    for condition in _filter_conditions(filters):
+        if condition[0] not in needed:
+            needed.append(condition[0])
+    source = []
+    for column in needed:
+        if column in available:
+            source.append(column)
+        elif column == 'resolution':
+            source += ['width', 'height']
+        elif column in ('width', 'height'):
+            source.append('resolution')
+    return list(dict.fromkeys(source))
+
+
+def read_table(path, columns=None, filters=None):
+    """Đọc bảng thành DataFrame, chỉ lấy ``columns`` và các dòng thỏa ``filters``"""
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        available = pq.read_schema(path).names
+        _check_filters(filters, available)
+        source = _source_columns(columns, filters, available) if columns is not None else None
+        table = pq.read_table(path, columns=source, filters=filters)
+        # Cột số nguyên có ô trống giữ kiểu Int của pandas thay vì float;
+        # dictionary thành category (ít bộ nhớ hơn chuỗi)
+        df = table.to_pandas(types_mapper=_nullable_int_types().get)
+    else:
+        with open(path, encoding='utf-8-sig') as f:
+            available = pd.read_csv(f, nrows=0).columns.tolist()
+        _check_filters(filters, available)
+        source = _source_columns(columns, filters, available) if columns is not None else None
+        df = pd.read_csv(path, usecols=source, encoding='utf-8-sig')
+        df = _apply_filters(_with_resolution(df), filters)
+
+    df = _with_resolution(df)
+    if columns is not None:
+        df = df[list(columns)]
+    return df.reset_index(drop=True)
+
+
+def write_table(df, path, compression='zstd', row_group_size=ROW_GROUP_SIZE):
+    """Ghi DataFrame ra Parquet hoặc CSV (utf-8-sig như trước) theo đuôi file, ghi nguyên tử"""
+    tmp_path = path + '.tmp'
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        pq.write_table(to_arrow(df), tmp_path, compression=compression, row_group_size=row_group_size)
+    else:
+        if 'resolution' in df.columns:
+            df = df.drop(columns=[c for c in ('width', 'height') if c in df.columns])
+        df.to_csv(tmp_path, index=False, encoding='utf-8-sig')
+    os.replace(tmp_path, path)
+
+
+def iter_records(df):
+    """Duyệt (chỉ số, dict của dòng) nhanh hơn nhiều so với df.iterrows()"""
+    return zip(df.index, df.to_dict('records'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chuyển đổi bảng dữ liệu giữa CSV và Parquet")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert', help="Chuyển đổi theo đuôi file đầu vào/đầu ra")
+    convert_parser.add_argument('source')
+    convert_parser.add_argument('destination')
+    convert_parser.add_argument('--columns', nargs='+', help="Chỉ giữ các cột này")
+    args = parser.parse_args()
+
+    df = read_table(args.source, columns=args.columns)
+    write_table(df, args.destination)
+    print(f"Đã ghi {len(df)} dòng vào {args.destination}")
+
+
+if __name__ == "__main__":
+    main()
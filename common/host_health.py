@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""Theo dõi tình trạng host dùng chung cho mọi bước tải ảnh qua HTTP.
+
+Lỗi kết nối/Timeout/SSL thường dồn vào một số ít host chết. Thay vì mỗi bước
+(crawl, kiểm tra URL, gán caption, augmentation) thử lại từng URL của các host
+đó với timeout đầy đủ:
+  - mỗi host có một circuit breaker: sau ``failure_threshold`` lỗi mạng/5xx
+    liên tiếp thì host bị ngắt trong ``open_seconds`` giây (nhân đôi sau mỗi
+    lần mở lại, tối đa ``max_open_seconds``); hết hạn thì cho một request thử
+    (half-open), thành công thì đóng lại; request thử không ghi kết quả trong
+    ``probe_seconds`` giây thì coi như bị bỏ dở và cho một request thử khác,
+  - response 429/503 có header ``Retry-After`` chặn host đúng khoảng thời gian
+    server yêu cầu,
+  - URL lỗi vĩnh viễn (404, 410, không phải ảnh) được lưu vào cache âm có hạn
+    dùng trong SQLite, các bước sau và lần chạy sau không gửi request nữa.
+Trạng thái ngắt của host cũng được lưu vào SQLite để lần chạy sau (hoặc tiến
+trình khác khởi động sau) không phải dò lại host chết.
+
+Cách dùng trong một bước:
+    health = get_default_host_health()
+    reason = health.check(url)          # None nếu được phép gửi request
+    ...
+    health.record_response(url, response.status_code, response.headers)
+    health.record_exception(url, error)
+
+Biến môi trường: HOST_HEALTH_PATH (mặc định <HTTP_CACHE_DIR>/host_health.sqlite),
+HOST_HEALTH_DISABLED=1 để tắt. Xem trạng thái:
+    python common/host_health.py report
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+
+DEFAULT_PATH = os.environ.get('HOST_HEALTH_PATH', os.path.join(
+    os.environ.get('HTTP_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.http_cache')),
+    'host_health.sqlite'))
+DISABLED = os.environ.get('HOST_HEALTH_DISABLED', '') not in ('', '0', 'false')
+
+FAILURE_THRESHOLD = 5          # Số lỗi liên tiếp để ngắt host
+OPEN_SECONDS = 60              # Thời gian ngắt lần đầu
+MAX_OPEN_SECONDS = 30 * 60     # Thời gian ngắt (hoặc Retry-After) tối đa
+PROBE_SECONDS = 120            # Request thử chưa ghi kết quả sau khoảng này thì cho thử request khác
+NEGATIVE_TTL = 7 * 24 * 3600   # Hạn dùng của cache URL lỗi
+NEGATIVE_STATUSES = {404, 410}
+RETRY_AFTER_STATUSES = {429, 503}
+
+# Lý do bỏ qua request mà check() trả về (chi tiết theo host xem report())
+SKIP_BAD_URL = "URL lỗi đã biết"
+SKIP_HOST_OPEN = "Host tạm ngắt"
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class HostUnavailable(requests.exceptions.ConnectionError):
+    """Request không được gửi vì URL đã biết là lỗi hoặc host đang bị ngắt"""
+
+
+def host_of(url):
+    return urlparse(url).netloc.lower()
+
+
+def parse_retry_after(value, now=None):
+    """Số giây phải chờ theo header Retry-After (số giây hoặc ngày giờ HTTP), None nếu không đọc được"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - (now or time.time()))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_network_error(error):
+    """Lỗi phía host (không kết nối được, timeout, SSL, hết lượt thử lại)"""
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                              requests.exceptions.RetryError, requests.exceptions.ChunkedEncodingError)
+                      ) and not isinstance(error, HostUnavailable)
+
+
+class HostState:
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0          # số lỗi liên tiếp
+        self.open_until = 0.0
+        self.open_seconds = OPEN_SECONDS
+        self.probing = False       # đang có request thử ở trạng thái half-open
+        self.probe_until = 0.0     # hạn của request thử (phòng khi nơi gọi không ghi kết quả)
+        self.reason = None
+        self.successes = 0
+        self.errors = 0
+        self.skipped = 0
+
+
+class HostHealth:
+    def __init__(self, path=DEFAULT_PATH, failure_threshold=FAILURE_THRESHOLD, open_seconds=OPEN_SECONDS,
+                 max_open_seconds=MAX_OPEN_SECONDS, negative_ttl=NEGATIVE_TTL, probe_seconds=PROBE_SECONDS,
+                 enabled=True):
+        self.failure_threshold = failure_threshold
+        self.probe_seconds = probe_seconds
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.negative_ttl = negative_ttl
+        self.enabled = enabled
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        if not enabled:
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS bad_urls ("
+            " url TEXT PRIMARY KEY, host TEXT NOT NULL, reason TEXT, expires_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS bad_urls_host ON bad_urls (host);"
+            "CREATE TABLE IF NOT EXISTS hosts ("
+            " host TEXT PRIMARY KEY, state TEXT NOT NULL, open_until REAL, open_seconds REAL,"
+            " reason TEXT, updated_at REAL);"
+        )
+        self._conn.commit()
+        # Host đang bị ngắt từ lần chạy trước (hoặc tiến trình khác)
+        for host, open_until, open_seconds, reason in self._conn.execute(
+                "SELECT host, open_until, open_seconds, reason FROM hosts WHERE state = ? AND open_until > ?",
+                (OPEN, time.time())):
+            state = self._hosts.setdefault(host, HostState())
+            state.state, state.open_until, state.open_seconds, state.reason = OPEN, open_until, open_seconds, reason
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = HostState()
+        return state
+
+    def _save_host(self, host, state):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO hosts (host, state, open_until, open_seconds, reason, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (host, state.state, state.open_until, state.open_seconds, state.reason, time.time()))
+        self._conn.commit()
+
+    def check(self, url):
+        """Lý do không nên gửi request tới ``url``, hoặc None nếu được phép"""
+        if not self.enabled:
+            return None
+        host = host_of(url)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT reason, expires_at FROM bad_urls WHERE url = ?", (url,)).fetchone()
+            state = self._host(host)
+            if row is not None and row[1] > now:
+                state.skipped += 1
+                return SKIP_BAD_URL
+            if state.state == CLOSED:
+                return None
+            # Còn trong thời gian ngắt, hoặc đã có một request thử đang chạy (chưa quá hạn)
+            if now < state.open_until or (state.probing and now < state.probe_until):
+                state.skipped += 1
+                return SKIP_HOST_OPEN
+            # Hết thời gian ngắt: chỉ cho một request thử
+            state.state = HALF_OPEN
+            state.probing = True
+            state.probe_until = now + self.probe_seconds
+            return None
+
+    def before_request(self, url):
+        """Như check() nhưng raise HostUnavailable nếu không được gửi request"""
+        reason = self.check(url)
+        if reason is not None:
+            raise HostUnavailable(f"{reason}: {url}")
+
+    def _open(self, host, state, reason, seconds):
+        state.state = OPEN
+        state.probing = False
+        state.reason = reason
+        state.open_until = time.time() + min(seconds, self.max_open_seconds)
+        self._save_host(host, state)
+
+    def record_success(self, url):
+        if not self.enabled:
+            return
+        host = host_of(url)
+        with self._lock:
+            state = self._host(host)
+            state.successes += 1
+            state.failures = 0
+            if state.state != CLOSED:
+                state.state = CLOSED
+                state.probing = False
+                state.open_seconds = self.open_seconds
+                state.reason = None
+                self._save_host(host, state)
+
+    def record_failure(self, url, reason):
+        """Một lỗi phía host: đủ số lỗi liên tiếp (hoặc request thử thất bại) thì ngắt host"""
+        if not self.enabled:
+            return
+        host = host_of(url)
+        with self._lock:
+            state = self._host(host)
+            state.errors += 1
+            state.failures += 1
+            if state.state == HALF_OPEN:
+                state.open_seconds = min(state.open_seconds * 2, self.max_open_seconds)
+                self._open(host, state, reason, state.open_seconds)
+            elif state.state == CLOSED and state.failures >= self.failure_threshold:
+                self._open(host, state, f"{state.failures} lỗi liên tiếp: {reason}", state.open_seconds)
+
+    def record_exception(self, url, error):
+        if is_network_error(error):
+            self.record_failure(url, type(error).__name__)
+        elif not isinstance(error, HostUnavailable):
+            # Lỗi không do host (URL sai, dữ liệu hỏng...): host vẫn trả lời được
+            self.record_success(url)
+
+    def record_response(self, url, status, headers=None):
+        """Cập nhật theo mã HTTP: Retry-After, lỗi 5xx, URL không tồn tại"""
+        if not self.enabled:
+            return
+        if status in RETRY_AFTER_STATUSES:
+            delay = parse_retry_after((headers or {}).get('Retry-After'))
+            if delay is not None:
+                host = host_of(url)
+                with self._lock:
+                    state = self._host(host)
+                    state.errors += 1
+                    self._open(host, state, f"Retry-After {delay:.0f}s (HTTP {status})", delay)
+                return
+        if status >= 500 or status == 429:
+            self.record_failure(url, f"HTTP {status}")
+            return
+        # Host vẫn trả lời bình thường (kể cả 4xx) nên không bị tính lỗi
+        self.record_success(url)
+        if status in NEGATIVE_STATUSES:
+            self.mark_bad(url, f"HTTP {status}")
+
+    def mark_bad(self, url, reason, ttl=None):
+        """Lưu URL vào cache âm: các bước khác bỏ qua URL này cho tới khi hết hạn"""
+        if not self.enabled:
+            return
+        expires_at = time.time() + (self.negative_ttl if ttl is None else ttl)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO bad_urls (url, host, reason, expires_at) VALUES (?, ?, ?, ?)",
+                               (url, host_of(url), reason, expires_at))
+            self._conn.commit()
+
+    def report(self):
+        """Trạng thái từng host đã gặp trong tiến trình này"""
+        now = time.time()
+        with self._lock:
+            return {host: {'state': state.state, 'consecutive_failures': state.failures,
+                           'open_for_s': max(0.0, state.open_until - now) if state.state != CLOSED else 0.0,
+                           'reason': state.reason, 'successes': state.successes, 'errors': state.errors,
+                           'skipped': state.skipped}
+                    for host, state in sorted(self._hosts.items())}
+
+    def summary(self):
+        """Một dòng tóm tắt: số host bị ngắt và số request đã bỏ qua"""
+        report = self.report()
+        opened = [host for host, state in report.items() if state['state'] != CLOSED]
+        skipped = sum(state['skipped'] for state in report.values())
+        return f"Host: {len(report)} đã gặp, {len(opened)} đang ngắt, bỏ qua {skipped} request"
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+
+
+_default_health = None
+_default_health_pid = None
+_default_health_lock = threading.Lock()
+
+
+def get_default_host_health():
+    """HostHealth dùng chung của tiến trình (tiến trình con tự mở kết nối SQLite riêng)"""
+    global _default_health, _default_health_pid
+    with _default_health_lock:
+        if _default_health is None or _default_health_pid != os.getpid():
+            _default_health = HostHealth(enabled=not DISABLED)
+            _default_health_pid = os.getpid()
+        return _default_health
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xem trạng thái host và cache URL lỗi")
+    parser.add_argument('command', choices=['report', 'clear'])
+    parser.add_argument('--path', default=DEFAULT_PATH)
+    args = parser.parse_args()
+
+    health = HostHealth(args.path)  # tạo bảng nếu chưa có
+    conn = sqlite3.connect(args.path)
+    if args.command == 'clear':
+        conn.executescript("DELETE FROM bad_urls; DELETE FROM hosts;")
+        conn.commit()
+        print("Đã xóa cache URL lỗi và trạng thái host")
+        return
+
+    now = time.time()
+    print("Host đang bị ngắt:")
+    for host, open_until, reason in conn.execute(
+            "SELECT host, open_until, reason FROM hosts WHERE state = ? AND open_until > ? ORDER BY host",
+            (OPEN, now)):
+        print(f"  {host:<40} còn {open_until - now:6.0f}s  {reason}")
+    print("URL lỗi còn hạn theo host:")
+    for host, count in conn.execute(
+            "SELECT host, COUNT(*) FROM bad_urls WHERE expires_at > ? GROUP BY host ORDER BY 2 DESC LIMIT 50",
+            (now,)):
+        print(f"  {host:<40} {count}")
+    conn.close()
+    health.close()
+
+
+if __name__ == "__main__":
+    main()
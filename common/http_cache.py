@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""Cache HTTP trên đĩa dùng chung cho các bước tiền xử lý, gán caption và augmentation.
+
+Mỗi URL chỉ cần tải qua mạng một lần: nội dung được lưu trên đĩa cùng
+ETag/Last-Modified, các lần sau đọc thẳng từ cache.
+  - Entry quá ``max_age`` giây được kiểm tra lại bằng conditional request
+    (If-None-Match / If-Modified-Since); server trả 304 thì dùng lại nội dung cũ.
+  - Tổng dung lượng bị giới hạn bởi ``max_bytes``, vượt quá thì xóa các
+    entry ít được dùng gần đây nhất (LRU).
+  - Chế độ offline chỉ phục vụ từ cache, URL chưa có sẽ báo CacheMiss.
+  - Request mạng đi qua host_health: URL lỗi đã biết hoặc host đang bị ngắt
+    báo HostUnavailable ngay (entry cũ, nếu có, vẫn được dùng).
+
+Cấu hình mặc định có thể đổi qua biến môi trường:
+    HTTP_CACHE_DIR, HTTP_CACHE_MAX_BYTES, HTTP_CACHE_MAX_AGE, HTTP_CACHE_OFFLINE=1
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from host_health import HostUnavailable, get_default_host_health
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'HTTP_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.http_cache')
+)
+DEFAULT_MAX_BYTES = int(os.environ.get('HTTP_CACHE_MAX_BYTES', 5 * 1024 ** 3))  # 5GB
+DEFAULT_MAX_AGE = float(os.environ.get('HTTP_CACHE_MAX_AGE', 30 * 24 * 3600))   # 30 ngày
+DEFAULT_OFFLINE = os.environ.get('HTTP_CACHE_OFFLINE', '') not in ('', '0', 'false')
+
+
+class CacheMiss(Exception):
+    """URL chưa có trong cache khi đang ở chế độ offline"""
+
+
+class CachedResponse:
+    """Kết quả trả về, có các thuộc tính chính giống requests.Response"""
+
+    def __init__(self, url, status_code, headers, content, from_cache):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.from_cache = from_cache
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"HTTP error {self.status_code} for url: {self.url}")
+
+
+class HTTPCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age=DEFAULT_MAX_AGE, offline=DEFAULT_OFFLINE, session=None, health=None):
+        self.cache_dir = cache_dir
+        self.health = health if health is not None else get_default_host_health()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.offline = offline
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._session = session
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'),
+                                     timeout=30, check_same_thread=False)
+        # WAL cho phép nhiều tiến trình cùng đọc/ghi chỉ mục
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " url TEXT PRIMARY KEY,"
+            " key TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " content_type TEXT,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " fetched_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+        self._conn.commit()
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    @property
+    def session(self):
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+        return self._session
+
+    def _body_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _lookup(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, size, content_type, etag, last_modified, fetched_at"
+                " FROM entries WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(('key', 'size', 'content_type', 'etag', 'last_modified', 'fetched_at'), row))
+        if not os.path.exists(self._body_path(entry['key'])):
+            return None
+        return entry
+
+    def _touch(self, url, fetched=False):
+        now = time.time()
+        with self._lock:
+            if fetched:
+                self._conn.execute(
+                    "UPDATE entries SET last_access = ?, fetched_at = ? WHERE url = ?", (now, now, url))
+            else:
+                self._conn.execute("UPDATE entries SET last_access = ? WHERE url = ?", (now, url))
+            self._conn.commit()
+
+    def _headers_of(self, entry):
+        headers = {'Content-Type': entry['content_type'] or '',
+                   'Content-Length': str(entry['size'])}
+        if entry['etag']:
+            headers['ETag'] = entry['etag']
+        if entry['last_modified']:
+            headers['Last-Modified'] = entry['last_modified']
+        return headers
+
+    def _read(self, url, entry, fetched=False):
+        """Response từ body đã lưu, hoặc None nếu body vừa bị xóa (evict ở luồng/tiến trình khác)"""
+        try:
+            with open(self._body_path(entry['key']), 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        self._touch(url, fetched)
+        return CachedResponse(url, 200, self._headers_of(entry), content, from_cache=True)
+
+    def _fetch(self, url, timeout, verify, headers):
+        try:
+            response = self.session.get(url, timeout=timeout, verify=verify, headers=headers)
+        except requests.exceptions.RequestException as e:
+            self.health.record_exception(url, e)
+            raise
+        self.health.record_response(url, response.status_code, response.headers)
+        return response
+
+    def _store(self, url, response):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        path = self._body_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(response.content)
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM entries WHERE url = ?", (url,)).fetchone()
+            self._total += len(response.content) - (old[0] if old else 0)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries"
+                " (url, key, size, content_type, etag, last_modified, fetched_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, key, len(response.content), response.headers.get('Content-Type'),
+                 response.headers.get('ETag'), response.headers.get('Last-Modified'), now, now)
+            )
+            self._conn.commit()
+        self._evict()
+
+    def _evict(self):
+        """Xóa các entry dùng ít gần đây nhất cho tới khi tổng dung lượng <= max_bytes"""
+        with self._lock:
+            if self._total <= self.max_bytes:
+                return
+            # Tính lại chính xác vì tiến trình khác có thể đã ghi thêm hoặc xóa bớt
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                self._total = total
+                return
+            victims = []
+            for url, key, size in self._conn.execute(
+                    "SELECT url, key, size FROM entries ORDER BY last_access ASC"):
+                if total <= self.max_bytes:
+                    break
+                victims.append((url, key))
+                total -= size
+            self._conn.executemany("DELETE FROM entries WHERE url = ?", [(u,) for u, _ in victims])
+            self._conn.commit()
+            self._total = total
+        for _, key in victims:
+            try:
+                os.remove(self._body_path(key))
+            except OSError:
+                pass
+
+    def get(self, url, timeout=10, verify=False, headers=None, revalidate=False):
+        """Tải URL qua cache.
+
+        Entry còn hạn được trả về ngay, không gọi mạng. Entry quá hạn (hoặc khi
+        ``revalidate=True``) được kiểm tra lại bằng conditional request.
+        Chỉ response 200 mới được lưu vào cache. Body bị xóa giữa lúc tra chỉ
+        mục và lúc đọc (evict) thì coi như chưa có trong cache.
+        """
+        entry = self._lookup(url)
+
+        if self.offline:
+            cached = self._read(url, entry) if entry is not None else None
+            if cached is None:
+                raise CacheMiss(url)
+            return cached
+
+        request_headers = dict(headers or {})
+        if entry is not None and not revalidate and time.time() - entry['fetched_at'] < self.max_age:
+            cached = self._read(url, entry)
+            if cached is not None:
+                return cached
+            entry = None
+        if entry is not None:
+            if entry['etag']:
+                request_headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                request_headers['If-Modified-Since'] = entry['last_modified']
+
+        reason = self.health.check(url)
+        if reason is not None:
+            # Host đang bị ngắt: dùng bản cũ thay vì chờ timeout
+            cached = self._read(url, entry) if entry is not None else None
+            if cached is not None:
+                return cached
+            raise HostUnavailable(f"{reason}: {url}")
+
+        response = self._fetch(url, timeout, verify, request_headers)
+
+        if response.status_code == 304 and entry is not None:
+            cached = self._read(url, entry, fetched=True)
+            if cached is not None:
+                return cached
+            # Body bị xóa sau khi gửi conditional request: tải lại đầy đủ
+            response = self._fetch(url, timeout, verify, dict(headers or {}))
+
+        if response.status_code == 200:
+            self._store(url, response)
+
+        return CachedResponse(url, response.status_code, response.headers,
+                              response.content, from_cache=False)
+
+    def cached_headers(self, url):
+        """Header đã lưu của URL (không gọi mạng), hoặc None nếu chưa có trong cache"""
+        entry = self._lookup(url)
+        return CaseInsensitiveDict(self._headers_of(entry)) if entry is not None else None
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {'entries': entries, 'bytes': total, 'max_bytes': self.max_bytes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+        if self._session is not None:
+            self._session.close()
+
+
+_default_cache = None
+_default_cache_pid = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Cache dùng chung của tiến trình, tạo lần đầu khi cần.
+
+    Tiến trình con (process pool) tự mở kết nối SQLite riêng thay vì dùng
+    lại kết nối kế thừa từ tiến trình cha.
+    """
+    global _default_cache, _default_cache_pid
+    with _default_cache_lock:
+        if _default_cache is None or _default_cache_pid != os.getpid():
+            _default_cache = HTTPCache()
+            _default_cache_pid = os.getpid()
+        return _default_cache
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Giải mã ảnh ở độ phân giải gần với kích thước cần dùng.
+
+Với JPEG, Pillow có thể giải mã trực tiếp ở 1/2, 1/4 hoặc 1/8 độ phân giải
+(DCT scaling, ``Image.draft``) nên ảnh 4000x3000 cần thu về 800px không phải
+giải mã đủ 12 triệu điểm ảnh rồi mới bỏ đi. Các định dạng khác vẫn được giải
+mã đầy đủ như trước.
+
+Dùng chung cho bước gán caption (thu nhỏ tối đa 800px, mã hóa lại JPEG gọn
+để gửi Gemini) và bước augmentation (giải mã vừa đủ >= 512px).
+"""
+from io import BytesIO
+
+from PIL import Image
+
+CAPTION_MAX_SIZE = (800, 800)
+JPEG_QUALITY = 85
+
+
+def open_image(data, min_size=None, mode='RGB'):
+    """Giải mã ảnh từ bytes.
+
+    ``min_size=(w, h)``: với JPEG, chọn mức giảm DCT nhỏ nhất mà ảnh vẫn có
+    chiều rộng >= w và chiều cao >= h. ``mode``: chuyển sang mode này nếu khác
+    (None để giữ nguyên).
+    Trả về (ảnh, định dạng gốc, kích thước gốc).
+    """
+    image = Image.open(BytesIO(data))
+    source_format = image.format
+    source_size = image.size
+    if min_size is not None and source_format == 'JPEG':
+        image.draft(mode if mode in ('RGB', 'L') else None, min_size)
+    image.load()
+    if mode is not None and image.mode != mode:
+        image = image.convert(mode)
+    return image, source_format, source_size
+
+
+def fit_within(size, max_size):
+    """Kích thước sau khi thu nhỏ ``size`` vào khung ``max_size`` (giữ tỷ lệ, không phóng to)"""
+    scale = min(max_size[0] / size[0], max_size[1] / size[1], 1.0)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def load_thumbnail(data, max_size=CAPTION_MAX_SIZE, mode='RGB'):
+    """Giải mã ảnh và thu nhỏ vào khung ``max_size`` (giống thumbnail LANCZOS trước đây)"""
+    with Image.open(BytesIO(data)) as probe:
+        target = fit_within(probe.size, max_size)
+    image, _, _ = open_image(data, min_size=target, mode=mode)
+    if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
+        image.thumbnail(max_size, Image.Resampling.LANCZOS)
+    return image
+
+
+def encode_jpeg(image, quality=JPEG_QUALITY):
+    """Mã hóa lại ảnh thành JPEG gọn (dùng làm payload gửi model)"""
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
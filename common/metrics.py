@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""Số đo hiệu năng dùng chung cho các bước: độ trễ, số byte, số lần thử lại, mã HTTP theo host.
+
+Các hàm nóng (download_image, get_prediction, load_image_from_url, transforms,
+save_image, ...) được bọc bằng ``instrument(stage)`` hoặc ghi trực tiếp:
+  - stage_latency_seconds{stage}            histogram độ trễ mỗi lần gọi
+  - stage_calls_total{stage, outcome}       ok / empty (trả None, rỗng) / error (exception)
+  - stage_bytes_total{stage}                số byte tải về hoặc ghi ra
+  - stage_retries_total{stage}              số lần thử lại
+  - http_responses_total{stage, host, status}  mã HTTP (hoặc loại lỗi) theo host
+  - http_phase_seconds{stage, phase}        thời gian từng pha của một lần tải:
+      headers      từ lúc gửi request tới khi nhận xong header (DNS, kết nối,
+                   TLS và thời gian server chờ trước byte đầu tiên)
+      first_chunk  từ khi có header tới chunk body đầu tiên
+      body         phần còn lại của body (băng thông của host)
+
+Nhờ đó biết được một lần chạy chậm là do một host chậm/lỗi, do model hay do
+mã hóa JPEG. Xuất số đo:
+  - dạng text của Prometheus: ``start_http_server(port)``, GET /metrics
+    (GET /metrics.json trả snapshot JSON)
+  - snapshot JSON ghi định kỳ ra file: ``start_snapshot_writer(path, interval)``
+
+Cấu hình qua biến môi trường (áp dụng khi get_default_metrics() được gọi lần đầu):
+    METRICS_PORT=9108                 chạy endpoint Prometheus
+    METRICS_SNAPSHOT=metrics.json     ghi snapshot JSON định kỳ ("{pid}" được thay bằng pid)
+    METRICS_INTERVAL=10               số giây giữa hai lần ghi snapshot
+    PROFILE_STAGE=transforms          chạy cProfile cho các lần gọi của một bước
+    PROFILE_OUTPUT=profile.prof       file kết quả cProfile (mặc định profile_<stage>_<pid>.prof)
+
+Mỗi tiến trình có bộ số đo riêng (process pool của bước augment cũng vậy, xem
+init_worker_metrics()), nên dùng "{pid}" trong METRICS_SNAPSHOT khi chạy nhiều
+tiến trình.
+"""
+import atexit
+import bisect
+import cProfile
+import functools
+import json
+import multiprocessing.util
+import os
+import pstats
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Histogram số lần quan sát theo các ngưỡng cố định (giống histogram của Prometheus)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # phần tử cuối: lớn hơn ngưỡng cuối (+Inf)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Ước lượng phân vị bằng cận trên của bucket chứa nó"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ''
+    text = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in items)
+    return '{' + text + '}'
+
+
+class Metrics:
+    """Bộ counter và histogram có nhãn, an toàn khi dùng từ nhiều luồng"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}     # tên -> {nhãn: giá trị}
+        self._histograms = {}   # tên -> {nhãn: Histogram}
+        self.started_at = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def record_call(self, stage, seconds, outcome='ok'):
+        self.observe('stage_latency_seconds', seconds, stage=stage)
+        self.inc('stage_calls_total', stage=stage, outcome=outcome)
+
+    def record_response(self, stage, url, status):
+        """Mã HTTP (hoặc tên lỗi khi không có response) của một request, theo host"""
+        self.inc('http_responses_total', stage=stage, host=urlparse(url).netloc, status=status)
+
+    def record_phase(self, stage, phase, seconds):
+        """Thời gian một pha của request HTTP (headers / first_chunk / body)"""
+        self.observe('http_phase_seconds', seconds, stage=stage, phase=phase)
+
+    def add_bytes(self, stage, size):
+        self.inc('stage_bytes_total', size, stage=stage)
+
+    def add_retries(self, stage, count=1):
+        if count:
+            self.inc('stage_retries_total', count, stage=stage)
+
+    def to_prometheus(self):
+        """Toàn bộ số đo ở định dạng text của Prometheus"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Số đo dạng dict (ghi ra JSON được)"""
+        with self._lock:
+            counters = {name: [dict(key, value=value) for key, value in sorted(series.items())]
+                        for name, series in self._counters.items()}
+            histograms = {
+                name: [dict(key, count=h.count, sum=h.sum, mean=h.sum / h.count if h.count else None,
+                            p50=h.quantile(0.5), p99=h.quantile(0.99),
+                            buckets=dict(zip([str(b) for b in h.buckets] + ['+Inf'], h.counts)))
+                       for key, h in sorted(series.items())]
+                for name, series in self._histograms.items()
+            }
+        return {'timestamp': time.time(), 'pid': os.getpid(), 'uptime_s': time.time() - self.started_at,
+                'counters': counters, 'histograms': histograms}
+
+    def write_snapshot(self, path):
+        path = path.replace('{pid}', str(os.getpid()))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+    def start_snapshot_writer(self, path, interval=10):
+        """Ghi snapshot mỗi ``interval`` giây trong luồng nền, và lần cuối khi thoát"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.write_snapshot(path)
+        threading.Thread(target=loop, daemon=True, name='metrics-snapshot').start()
+        atexit.register(self.write_snapshot, path)
+
+    def start_http_server(self, port, host='127.0.0.1'):
+        """Endpoint /metrics (Prometheus) và /metrics.json chạy trong luồng nền"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = metrics.to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(metrics.snapshot()).encode('utf-8'), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True, name='metrics-http').start()
+        return server
+
+
+class StageProfiler:
+    """cProfile chỉ cho các lần gọi của một bước, gộp kết quả của mọi luồng khi thoát"""
+
+    def __init__(self, stage, output=None):
+        self.stage = stage
+        self.output = output or f"profile_{stage}_{{pid}}.prof"
+        self._local = threading.local()
+        self._profiles = []
+        self._lock = threading.Lock()
+        atexit.register(self.dump)
+
+    def _profile(self):
+        # cProfile chỉ đo luồng đang gọi enable(): mỗi luồng một Profile riêng
+        profile = getattr(self._local, 'profile', None)
+        if profile is None:
+            profile = self._local.profile = cProfile.Profile()
+            self._local.depth = 0
+            with self._lock:
+                self._profiles.append(profile)
+        return profile
+
+    def __enter__(self):
+        profile = self._profile()
+        if self._local.depth == 0:
+            profile.enable()
+        self._local.depth += 1
+
+    def __exit__(self, *exc):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            self._local.profile.disable()
+
+    def dump(self):
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        path = self.output.replace('{pid}', str(os.getpid()))
+        stats.dump_stats(path)
+        return path
+
+
+_default_metrics = None
+_default_metrics_lock = threading.Lock()
+_profiler = None
+
+
+def get_default_metrics():
+    """Bộ số đo dùng chung của tiến trình; lần đầu gọi thì bật các cách xuất theo biến môi trường"""
+    global _default_metrics, _profiler
+    with _default_metrics_lock:
+        if _default_metrics is None:
+            _default_metrics = Metrics()
+            if os.environ.get('METRICS_PORT'):
+                _default_metrics.start_http_server(int(os.environ['METRICS_PORT']))
+            if os.environ.get('METRICS_SNAPSHOT'):
+                _default_metrics.start_snapshot_writer(os.environ['METRICS_SNAPSHOT'],
+                                                       float(os.environ.get('METRICS_INTERVAL', 10)))
+            if os.environ.get('PROFILE_STAGE'):
+                _profiler = StageProfiler(os.environ['PROFILE_STAGE'], os.environ.get('PROFILE_OUTPUT'))
+        return _default_metrics
+
+
+def init_worker_metrics():
+    """Bộ số đo riêng cho một tiến trình con của process pool (gọi trong initializer).
+
+    Tiến trình con không chạy atexit nên snapshot và profile cuối cùng được ghi
+    qua multiprocessing.util.Finalize khi tiến trình thoát. Tiến trình con không
+    mở endpoint Prometheus (trùng cổng với tiến trình chính); snapshot ghi ra file
+    riêng theo pid (thêm ".{pid}" nếu METRICS_SNAPSHOT chưa có "{pid}").
+    """
+    global _default_metrics, _profiler
+    with _default_metrics_lock:
+        _default_metrics = None
+        _profiler = None
+    os.environ.pop('METRICS_PORT', None)
+    snapshot = os.environ.get('METRICS_SNAPSHOT')
+    if snapshot and '{pid}' not in snapshot:
+        snapshot = os.environ['METRICS_SNAPSHOT'] = f"{snapshot}.{{pid}}"
+    metrics = get_default_metrics()
+    if snapshot:
+        multiprocessing.util.Finalize(metrics, metrics.write_snapshot, args=(snapshot,), exitpriority=10)
+    if _profiler is not None:
+        multiprocessing.util.Finalize(_profiler, _profiler.dump, exitpriority=10)
+    return metrics
+
+
+def set_profiled_stage(stage, output=None):
+    """Bật cProfile cho một bước từ code (thay cho biến môi trường PROFILE_STAGE)"""
+    global _profiler
+    get_default_metrics()
+    _profiler = StageProfiler(stage, output) if stage else None
+    return _profiler
+
+
+def _is_empty(result):
+    if result is None or result is False:
+        return True
+    try:
+        return len(result) == 0
+    except TypeError:
+        return False
+
+
+def instrument(stage):
+    """Decorator: đo độ trễ và kết quả (ok/empty/error) mỗi lần gọi hàm của ``stage``"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = get_default_metrics()
+            profiler = _profiler if _profiler is not None and _profiler.stage == stage else None
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                if profiler is not None:
+                    with profiler:
+                        result = func(*args, **kwargs)
+                else:
+                    result = func(*args, **kwargs)
+                outcome = 'empty' if _is_empty(result) else 'ok'
+                return result
+            finally:
+                metrics.record_call(stage, time.perf_counter() - start, outcome)
+        return wrapper
+    return decorator
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Xem snapshot số đo hoặc file cProfile")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    show_parser = subparsers.add_parser('show', help="Tóm tắt độ trễ và lỗi từ một snapshot JSON")
+    show_parser.add_argument('snapshot')
+    profile_parser = subparsers.add_parser('profile', help="In các hàm tốn thời gian nhất từ file .prof")
+    profile_parser.add_argument('path')
+    profile_parser.add_argument('--top', type=int, default=25)
+    args = parser.parse_args()
+
+    if args.command == 'profile':
+        pstats.Stats(args.path).sort_stats('cumulative').print_stats(args.top)
+        return
+
+    with open(args.snapshot, encoding='utf-8') as f:
+        snapshot = json.load(f)
+    for row in snapshot['histograms'].get('stage_latency_seconds', []):
+        print(f"{row['stage']:<22} {row['count']:>7} lần  trung bình {1000 * row['mean']:8.1f}ms  "
+              f"p50 <= {row['p50']}s  p99 <= {row['p99']}s")
+    for name in ('stage_calls_total', 'stage_bytes_total', 'stage_retries_total', 'http_responses_total'):
+        for row in snapshot['counters'].get(name, []):
+            labels = ' '.join(f"{k}={v}" for k, v in row.items() if k != 'value')
+            print(f"{name:<22} {labels:<60} {row['value']}")
+
+
+if __name__ == "__main__":
+    main()
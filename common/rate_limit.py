@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Công cụ giới hạn tốc độ gọi API, an toàn khi dùng từ nhiều thread.
+
+- TokenBucket: giới hạn số đơn vị (request, token...) mỗi phút. Tốc độ phải > 0;
+  nơi dùng coi 0 là không giới hạn thì không tạo bucket.
+- AdaptiveConcurrency: giới hạn số lời gọi đồng thời theo kiểu AIMD, giảm một
+  nửa khi gặp lỗi 429/quota và tăng dần trở lại khi các lời gọi thành công.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, capacity=None):
+        if rate_per_minute <= 0:
+            raise ValueError(f"rate_per_minute phải lớn hơn 0, nhận được {rate_per_minute}")
+        self.rate = rate_per_minute / 60.0  # Số đơn vị được nạp lại mỗi giây
+        # Mặc định cho phép dồn tối đa lượng của 10 giây
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate * 10)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount=1):
+        """Chờ tới khi đủ ``amount`` đơn vị rồi trừ đi"""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    def __init__(self, initial=4, minimum=1, maximum=32, cooldown=5.0):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cooldown = cooldown
+        self.active = 0
+        self.rate_limited = 0
+        self._successes = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    self._cond.wait(pause)
+                elif self.active >= self.limit:
+                    self._cond.wait()
+                else:
+                    self.active += 1
+                    return
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def on_success(self):
+        """Tăng giới hạn thêm 1 sau mỗi ``limit`` lời gọi thành công liên tiếp"""
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def on_rate_limit(self):
+        """Gặp 429/quota: giảm một nửa giới hạn và tạm dừng cấp slot mới"""
+        with self._cond:
+            self.rate_limited += 1
+            self.limit = max(self.minimum, self.limit // 2)
+            self._successes = 0
+            self._paused_until = max(self._paused_until, time.monotonic() + self.cooldown)
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""Chạy liền mạch crawl -> kiểm tra URL -> gán caption -> augment cho một lần crawl mới.
+
+Thay cho việc chạy lần lượt từng bước (bước sau chờ bước trước xong toàn bộ),
+mỗi ảnh đi qua các giai đoạn ngay khi giai đoạn trước xong với nó:
+
+    tìm kiếm (cache) --> download --> validate --> caption --> augment
+                          luồng       luồng       luồng       luồng + ProcessPool
+
+Các giai đoạn chờ mạng (tải ảnh, HEAD, gọi model) chạy chồng lên phần augment
+tốn CPU. Mỗi giai đoạn có số luồng riêng và hàng đợi có giới hạn (xem
+streaming.py). Ảnh đã có trên đĩa (vừa tải ở giai đoạn download hoặc có sẵn
+local_path) không cần HEAD request ở giai đoạn validate. Trạng thái từng ảnh lưu trong SQLite: dừng giữa chừng rồi chạy
+lại thì chỉ các ảnh chưa xong được xử lý tiếp, từ giai đoạn còn dở.
+
+Các giai đoạn dùng lại code của từng bước:
+    traffic_raw.download_image, url_validator.check_image_url,
+    label_short_captions.get_prediction, augment_pipeline.augment_task
+
+Chạy:
+    python pipeline/run_pipeline.py --output-dir pipeline/output
+    python pipeline/run_pipeline.py --input delta.csv      # bắt đầu từ CSV đã crawl, bỏ qua tìm kiếm/tải
+    python pipeline/run_pipeline.py --search-backend http --search-url http://127.0.0.1:8900/search.json \\
+        --search-cache /tmp/fake_search_cache --fake-model  # chạy thử với fake_serpapi.py
+Kết quả: <output-dir>/captions.csv và <output-dir>/augmented/captions_augmented.csv
+(được dựng lại từ trạng thái sau mỗi lần chạy).
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+
+import pandas as pd
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# Module dùng chung và các bước của pipeline nằm ở các thư mục khác trong repo
+for subdir in ('common', '1.crawl_data/python', '2.data_preprocessing/python',
+               '3.labels_short_captions/python', '4.Image_data_augument/python'):
+    sys.path.insert(0, os.path.join(ROOT_DIR, subdir))
+
+import traffic_raw
+from search_stage import CachedSearch, HTTPBackend, SerpApiBackend, SERPAPI_ENDPOINT, SEARCH_RPM
+from url_validator import check_image_url, create_session
+from label_short_captions import (CaptionRateController, FakeCaptionClient, get_default_client, get_prediction,
+                                  init_gemini, OPTIMIZED_PROMPT)
+from data_augument import RESULT_COLUMNS, VIRTUAL_COLUMNS, PACKED_COLUMNS, OUTPUT_CSV, download_image_bytes
+from augment_pipeline import _init_worker, augment_task
+from http_cache import get_default_cache
+from dataset_io import read_table, write_table, iter_records
+from streaming import DONE, DropItem, PipelineState, Stage, StreamingPipeline
+
+OUTPUT_DIR = os.path.join(ROOT_DIR, 'pipeline', 'output')
+SEARCH_CACHE_DIR = os.path.join(ROOT_DIR, '1.crawl_data', 'output', 'search_cache')
+
+DOWNLOAD_WORKERS = traffic_raw.CONCURRENCY
+VALIDATE_WORKERS = 8
+CAPTION_WORKERS = 8
+AUGMENT_WORKERS = os.cpu_count() or 1
+QUEUE_SIZE = 64
+PER_HOST_LIMIT = traffic_raw.PER_HOST_LIMIT
+PROGRESS_INTERVAL = 10   # giây giữa hai lần in tiến độ
+
+CAPTION_COLUMNS = ['title', 'original_url', 'thumbnail_url', 'source_website', 'resolution',
+                   'search_query', 'page_number', 'local_path', 'short_caption']
+
+
+class HostLimits:
+    """Giới hạn số request đồng thời tới cùng một host"""
+
+    def __init__(self, limit=PER_HOST_LIMIT):
+        self.limit = limit
+        self._semaphores = defaultdict(lambda: threading.BoundedSemaphore(self.limit))
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            return self._semaphores[urlparse(url).netloc]
+
+
+def read_local_image(data):
+    """Bytes của ảnh crawler đã lưu (nếu có) để các giai đoạn sau không phải tải lại"""
+    path = data.get('local_path')
+    if isinstance(path, str) and os.path.isfile(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    return None
+
+
+def build_stages(args, client, pool):
+    host_limits = HostLimits(args.per_host)
+    download_session = traffic_raw.create_session_with_retries(args.download_workers, args.download_workers)
+    validate_session = create_session(args.validate_workers)
+    http_cache = get_default_cache()
+    controller = CaptionRateController(args.rpm, args.tpm, max_concurrency=args.caption_workers)
+    augment_dir = os.path.join(args.output_dir, 'augmented')
+
+    def download(item):
+        url = item.data['original_url']
+        outcome = {}
+        with host_limits.get(url):
+            saved_path = traffic_raw.download_image(url, item.data['search_query'], download_session,
+                                                    outcome=outcome)
+        if not saved_path:
+            reason = outcome.get('reason', "không tải được ảnh")
+            if outcome.get('retry'):
+                raise RuntimeError(reason)  # host tạm ngắt, timeout, 5xx: thử lại ở lần chạy sau
+            raise DropItem(reason)
+        item.data['local_path'] = saved_path
+
+    def validate(item):
+        url = item.data['original_url']
+        path = item.data.get('local_path')
+        if isinstance(path, str) and os.path.isfile(path):
+            # Ảnh đã tải đủ vào kho (response 200, Content-Type ảnh, qua filter):
+            # HEAD request không cho biết thêm gì
+            return
+        with host_limits.get(url):
+            ok, error = check_image_url(url, session=validate_session, http_cache=http_cache)
+        if ok is None:
+            raise RuntimeError(error)  # host tạm ngắt: thử lại ở lần chạy sau
+        if not ok:
+            raise DropItem(error)
+
+    def caption(item):
+        result = get_prediction(item.data['original_url'], OPTIMIZED_PROMPT, client=client,
+                                controller=controller, image_bytes=read_local_image(item.data))
+        if not result:
+            raise RuntimeError("không nhận được caption")  # thử lại ở lần chạy sau
+        item.data['short_caption'] = result
+
+    def augment(item):
+        data = read_local_image(item.data)
+        if data is None:
+            data = download_image_bytes(item.data['original_url'])
+        if data is None:
+            raise RuntimeError("không tải được ảnh để augment")
+        results = pool.submit(augment_task, item.seq, item.data, augment_dir, data=data,
+                              virtual=args.virtual, packed=args.packed).result()
+        if not results:
+            raise DropItem("không giải mã được ảnh")
+        item.data['augmented'] = results
+
+    return [
+        Stage('download', download, args.download_workers, args.queue_size),
+        Stage('validate', validate, args.validate_workers, args.queue_size),
+        Stage('caption', caption, args.caption_workers, args.queue_size),
+        Stage('augment', augment, args.augment_workers, args.queue_size),
+    ]
+
+
+def feed_search(pipeline, args):
+    """Nguồn item: kết quả tìm kiếm (đi qua cache), mỗi ảnh là một item"""
+    queries = args.queries or traffic_raw.search_queries
+    for query, page, images in traffic_raw.iter_search_pages(queries, None, args.search_workers, args.pages):
+        for image in images or []:
+            url = image.get('original')
+            if url:
+                pipeline.submit(url, traffic_raw.build_image_info(image, query, page, None))
+
+
+def feed_table(pipeline, path):
+    """Nguồn item: bảng đã crawl sẵn (CSV/Parquet), bắt đầu từ giai đoạn validate"""
+    df = read_table(path).drop(columns=['width', 'height'], errors='ignore')
+    df = df.astype(object).where(df.notna(), None)
+    for _, row in iter_records(df):
+        if row.get('original_url'):
+            pipeline.submit(row['original_url'], row, start=1)
+
+
+def export_results(state, output_dir, virtual=False, packed=False):
+    """Dựng lại CSV caption và CSV augmented từ các item đã xong"""
+    captions, augmented = [], []
+    for _, data in state.iter_data(DONE):
+        augmented.extend(data.pop('augmented', []))
+        captions.append(data)
+
+    captions_path = os.path.join(output_dir, 'captions.csv')
+    augmented_path = os.path.join(output_dir, 'augmented', os.path.basename(OUTPUT_CSV))
+    columns = [c for c in CAPTION_COLUMNS if not captions or c in captions[0]] or None
+    write_table(pd.DataFrame(captions, columns=columns), captions_path)
+    augmented_columns = VIRTUAL_COLUMNS if virtual else PACKED_COLUMNS if packed else RESULT_COLUMNS
+    write_table(pd.DataFrame(augmented, columns=augmented_columns), augmented_path)
+    return captions_path, augmented_path, len(captions), len(augmented)
+
+
+def report_progress(pipeline, interval, stop):
+    while not stop.wait(interval):
+        logging.info(pipeline.progress())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy liền mạch crawl -> validate -> caption -> augment")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help="Thư mục kết quả và trạng thái")
+    parser.add_argument('--state', help="File SQLite trạng thái (mặc định: <output-dir>/pipeline_state.sqlite)")
+    parser.add_argument('--input', help="Bắt đầu từ bảng đã crawl (CSV/Parquet) thay vì tìm kiếm")
+    parser.add_argument('--queries', nargs='+', help="Từ khóa tìm kiếm (mặc định: danh sách trong traffic_raw.py)")
+    parser.add_argument('--pages', type=int, default=traffic_raw.PAGES_PER_QUERY, help="Số trang mỗi từ khóa")
+    parser.add_argument('--search-backend', choices=['serpapi', 'http'], default='serpapi')
+    parser.add_argument('--search-url', default=SERPAPI_ENDPOINT, help="Endpoint cho --search-backend http")
+    parser.add_argument('--search-cache', default=SEARCH_CACHE_DIR, help="Thư mục cache response tìm kiếm")
+    parser.add_argument('--search-workers', type=int, default=traffic_raw.SEARCH_WORKERS)
+    parser.add_argument('--search-rpm', type=float, default=SEARCH_RPM)
+    parser.add_argument('--offline', action='store_true', help="Chỉ dùng kết quả tìm kiếm đã cache")
+    parser.add_argument('--download-workers', type=int, default=DOWNLOAD_WORKERS)
+    parser.add_argument('--validate-workers', type=int, default=VALIDATE_WORKERS)
+    parser.add_argument('--caption-workers', type=int, default=CAPTION_WORKERS)
+    parser.add_argument('--augment-workers', type=int, default=AUGMENT_WORKERS,
+                        help="Số tiến trình augment (mặc định: số lõi CPU)")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help="Kích thước hàng đợi trước mỗi giai đoạn")
+    parser.add_argument('--per-host', type=int, default=PER_HOST_LIMIT,
+                        help="Số request đồng thời tối đa tới một host (download/validate)")
+    parser.add_argument('--rpm', type=int, default=1000, help="Giới hạn request/phút của model caption (0 = không giới hạn)")
+    parser.add_argument('--tpm', type=int, default=1000000, help="Giới hạn token/phút của model caption (0 = không giới hạn)")
+    parser.add_argument('--fake-model', action='store_true', help="Dùng model caption giả cục bộ")
+    output_format = parser.add_mutually_exclusive_group()
+    output_format.add_argument('--virtual', action='store_true', help="Không ghi ảnh augmented, chỉ ghi seed")
+    output_format.add_argument('--packed', action='store_true',
+                               help="Ghi ảnh augmented vào shard uint8 đọc bằng memory map (packed_store.py)")
+    parser.add_argument('--progress-interval', type=float, default=PROGRESS_INTERVAL,
+                        help="Số giây giữa hai lần in tiến độ (0: không in)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    os.makedirs(os.path.join(args.output_dir, 'augmented', 'images'), exist_ok=True)
+
+    # Kho ảnh của crawler nằm trong thư mục kết quả của pipeline
+    traffic_raw.IMAGES_DIR = os.path.join(args.output_dir, 'crawl_images')
+    os.makedirs(traffic_raw.IMAGES_DIR, exist_ok=True)
+    backend = HTTPBackend(args.search_url) if args.search_backend == 'http' else SerpApiBackend()
+    traffic_raw.set_searcher(CachedSearch(backend, args.search_cache, offline=args.offline,
+                                          rate_per_minute=args.search_rpm))
+
+    if args.fake_model:
+        client = FakeCaptionClient()
+    else:
+        init_gemini(os.environ.get('GEMINI_API_KEY', ''))
+        client = get_default_client()
+
+    state = PipelineState(args.state or os.path.join(args.output_dir, 'pipeline_state.sqlite'))
+    # Tiến trình augment được tạo khi các luồng đã chạy: fork lúc đó có thể sao chép
+    # cả lock đang bị giữ (logging, cache...) và treo tiến trình con, nên dùng forkserver
+    pool = ProcessPoolExecutor(max_workers=args.augment_workers, initializer=_init_worker,
+                               mp_context=multiprocessing.get_context('forkserver'))
+    pipeline = StreamingPipeline(build_stages(args, client, pool), state)
+    if args.input:
+        pipeline.stages[0].workers = 1  # item từ bảng bắt đầu sau giai đoạn download
+
+    stop = threading.Event()
+    if args.progress_interval > 0:
+        threading.Thread(target=report_progress, args=(pipeline, args.progress_interval, stop),
+                         daemon=True).start()
+    try:
+        pipeline.start()
+        if args.input:
+            feed_table(pipeline, args.input)
+        else:
+            feed_search(pipeline, args)
+        pipeline.finish()
+    finally:
+        stop.set()
+        pool.shutdown()
+
+    print(pipeline.summary())
+    print(f"Trạng thái: {state.counts()}")
+    captions_path, augmented_path, captions, augmented = export_results(state, args.output_dir, args.virtual,
+                                                                          args.packed)
+    state.close()
+    print(f"Đã ghi {captions} dòng vào {captions_path}, {augmented} dòng vào {augmented_path}")
+    if not args.input:
+        stats = traffic_raw.get_searcher().stats()
+        print(f"Tìm kiếm ({stats['backend']}): {stats['hits']} lần dùng cache, {stats['misses']} lần gọi backend")
+
+
+if __name__ == "__main__":
+    main()
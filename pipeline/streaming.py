@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""Khung pipeline dạng stream: các giai đoạn nối với nhau bằng hàng đợi có giới hạn.
+
+    nguồn --> [hàng đợi] --> giai đoạn 1 (N1 luồng) --> [hàng đợi] --> giai đoạn 2 (N2 luồng) --> ...
+
+- Mỗi giai đoạn có số luồng riêng, hàng đợi đầu vào có kích thước cố định:
+  giai đoạn sau chậm thì hàng đợi đầy, giai đoạn trước bị chặn khi ``put``
+  (backpressure) nên bộ nhớ không tăng theo số ảnh.
+- Trạng thái từng item (giai đoạn cuối cùng đã xong + dữ liệu) được lưu trong
+  SQLite ngay sau mỗi giai đoạn. Chạy lại thì item đã xong/bị loại được bỏ qua,
+  item dở dang tiếp tục từ giai đoạn kế tiếp.
+- Hàm xử lý của giai đoạn sửa ``item.data`` tại chỗ; raise ``DropItem`` để loại
+  item (không thử lại), lỗi khác được ghi lại và item được thử lại ở lần chạy sau.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+_STOP = object()
+
+PENDING = 'pending'   # đang xử lý hoặc lỗi, chạy lại sẽ tiếp tục
+DONE = 'done'         # đã qua mọi giai đoạn
+DROPPED = 'dropped'   # bị loại (ảnh lỗi, URL hỏng...)
+
+
+class DropItem(Exception):
+    """Loại item khỏi pipeline, không thử lại khi chạy lại"""
+
+
+class Item:
+    def __init__(self, key, seq, data):
+        self.key = key
+        self.seq = seq      # số thứ tự cố định của item, giữ nguyên giữa các lần chạy
+        self.data = data
+
+
+class PipelineState:
+    """Trạng thái từng item trong SQLite, dùng để chạy tiếp sau khi bị dừng"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT UNIQUE NOT NULL,"
+            " stage TEXT NOT NULL, status TEXT NOT NULL, data TEXT NOT NULL,"
+            " error TEXT, updated_at REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        """(seq, giai đoạn đã xong, status, data) hoặc None nếu item chưa có"""
+        with self._lock:
+            row = self._conn.execute("SELECT seq, stage, status, data FROM items WHERE key = ?",
+                                     (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], row[2], json.loads(row[3])
+
+    def add(self, key, data, stage=''):
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO items (key, stage, status, data, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (key, stage, PENDING, json.dumps(data, ensure_ascii=False, default=str), time.time()))
+            self._conn.commit()
+        return cursor.lastrowid
+
+    def complete(self, key, stage, data, final=False):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE items SET stage = ?, status = ?, data = ?, error = NULL, updated_at = ? WHERE key = ?",
+                (stage, DONE if final else PENDING, json.dumps(data, ensure_ascii=False, default=str),
+                 time.time(), key))
+            self._conn.commit()
+
+    def mark(self, key, status, error):
+        """Ghi lỗi của item; ``status=DROPPED`` để không xử lý lại"""
+        with self._lock:
+            self._conn.execute("UPDATE items SET status = ?, error = ?, updated_at = ? WHERE key = ?",
+                               (status, error, time.time(), key))
+            self._conn.commit()
+
+    def iter_data(self, status=DONE):
+        """Duyệt (seq, data) các item có ``status`` theo thứ tự thêm vào"""
+        with self._lock:
+            rows = self._conn.execute("SELECT seq, data FROM items WHERE status = ? ORDER BY seq",
+                                      (status,)).fetchall()
+        for seq, data in rows:
+            yield seq, json.loads(data)
+
+    def counts(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status"))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Stage:
+    """Một giai đoạn: ``workers`` luồng gọi ``func(item)`` cho từng item trong hàng đợi"""
+
+    def __init__(self, name, func, workers=1, queue_size=64):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._exited = 0
+        self._lock = threading.Lock()
+
+    def _count(self, field, elapsed):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+            self.busy_seconds += elapsed
+
+
+class StreamingPipeline:
+    """Chạy các ``Stage`` nối tiếp nhau, lưu trạng thái item vào ``state`` (PipelineState)"""
+
+    def __init__(self, stages, state):
+        self.stages = stages
+        self.state = state
+        self.skipped = 0     # item đã xong/bị loại ở lần chạy trước
+        self.resumed = 0     # item dở dang được chạy tiếp
+        self._seen = set()
+        self._threads = []
+        self._started_at = None
+
+    def start(self):
+        self._started_at = time.time()
+        for index, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                thread = threading.Thread(target=self._work, args=(index,), daemon=True,
+                                          name=f"{stage.name}-{worker}")
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, key, data, start=0):
+        """Đưa item vào pipeline từ giai đoạn ``start``; chặn khi hàng đợi đầy.
+
+        Item đã có trong trạng thái thì tiếp tục sau giai đoạn cuối cùng đã xong.
+        """
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+
+        record = self.state.get(key)
+        if record is None:
+            seq = self.state.add(key, data, self.stages[start - 1].name if start else '')
+        else:
+            seq, stage_name, status, data = record
+            if status != PENDING:
+                self.skipped += 1
+                return False
+            names = [stage.name for stage in self.stages]
+            start = names.index(stage_name) + 1 if stage_name in names else 0
+            self.resumed += 1
+            if start >= len(self.stages):
+                self.state.complete(key, stage_name, data, final=True)
+                return False
+        self.stages[start].queue.put(Item(key, seq, data))
+        return True
+
+    def _work(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item = stage.queue.get()
+            if item is _STOP:
+                break
+            start = time.perf_counter()
+            try:
+                stage.func(item)
+            except DropItem as e:
+                self.state.mark(item.key, DROPPED, f"{stage.name}: {e}")
+                stage._count('dropped', time.perf_counter() - start)
+                continue
+            except Exception as e:
+                logging.error(f"[{stage.name}] Lỗi xử lý {item.key}: {e}")
+                self.state.mark(item.key, PENDING, f"{stage.name}: {e}")
+                stage._count('failed', time.perf_counter() - start)
+                continue
+            stage._count('processed', time.perf_counter() - start)
+            self.state.complete(item.key, stage.name, item.data, final=next_stage is None)
+            if next_stage is not None:
+                next_stage.queue.put(item)  # chặn khi giai đoạn sau đang quá tải
+
+        # Luồng cuối cùng của giai đoạn dừng thì báo dừng cho giai đoạn sau
+        with stage._lock:
+            stage._exited += 1
+            last = stage._exited == stage.workers
+        if last and next_stage is not None:
+            for _ in range(next_stage.workers):
+                next_stage.queue.put(_STOP)
+
+    def finish(self):
+        """Báo hết item đầu vào và chờ mọi giai đoạn xử lý xong"""
+        for _ in range(self.stages[0].workers):
+            self.stages[0].queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def progress(self):
+        return ' | '.join(
+            f"{stage.name}: {stage.processed} xong, {stage.dropped} loại, {stage.failed} lỗi, "
+            f"hàng đợi {stage.queue.qsize()}/{stage.queue.maxsize}"
+            for stage in self.stages)
+
+    def summary(self):
+        elapsed = time.time() - self._started_at if self._started_at else 0.0
+        lines = [f"Tổng thời gian: {elapsed:.1f}s (bỏ qua {self.skipped} item đã xong, "
+                 f"chạy tiếp {self.resumed} item dở dang)"]
+        for stage in self.stages:
+            # Tỷ lệ thời gian các luồng của giai đoạn thực sự bận: gần 100% là nút cổ chai
+            busy = stage.busy_seconds / max(elapsed * stage.workers, 1e-9)
+            lines.append(f"  {stage.name:<10} {stage.workers:>3} luồng: {stage.processed} xong, "
+                         f"{stage.dropped} loại, {stage.failed} lỗi, bận {100 * busy:.0f}%")
+        return '\n'.join(lines)
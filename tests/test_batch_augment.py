@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra BatchAugmenter: phần biến đổi không gian của lô có seed giống render_variant từng ảnh"""
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '4.Image_data_augument', 'python'))
+from batch_augment import BatchAugmenter, split_pipeline
+from data_augument import AUG_SIZE, render_variant, transforms
+
+
+def make_images(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, size=(600, 700, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def test_seeded_batch_matches_render_variant():
+    _, _, geometric = split_pipeline(transforms)
+    augmenter = BatchAugmenter(pipeline=geometric)
+    images = make_images(4)
+
+    batch = augmenter.augment(images, seed=7)
+
+    seeds = np.random.default_rng(7).integers(2 ** 31, size=len(images))
+    expected = np.stack([render_variant(image, int(seed), geometric) for image, seed in zip(images, seeds)])
+    assert batch.shape == (4, AUG_SIZE, AUG_SIZE, 3)
+    assert np.array_equal(batch, expected)
+
+
+def test_full_pipeline_is_deterministic_across_threads():
+    images = make_images(3, seed=1)
+    expected = BatchAugmenter().augment(images, seed=3)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: BatchAugmenter().augment(images, seed=3), range(4)))
+    for result in results:
+        assert np.array_equal(result, expected)
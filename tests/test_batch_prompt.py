@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra tách câu trả lời gộp nhiều ảnh về từng ảnh của batch_prompt"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '3.labels_short_captions', 'python'))
+from batch_prompt import MAX_CAPTION_WORDS, build_batch_parts, parse_batch_response
+
+
+@pytest.mark.parametrize('line', [
+    '1: Xe máy kẹt trên cầu',
+    '1. Xe máy kẹt trên cầu',
+    '1) Xe máy kẹt trên cầu',
+    'Ảnh 1: Xe máy kẹt trên cầu',
+    '- **1**: Xe máy kẹt trên cầu',
+    '1: "Xe máy kẹt trên cầu"',
+    '  1 –  **Xe máy kẹt trên cầu**  ',
+])
+def test_line_formats_are_accepted(line):
+    assert parse_batch_response(line, 1) == {1: 'Xe máy kẹt trên cầu'}
+
+
+def test_preamble_and_out_of_range_are_ignored():
+    text = 'Đây là mô tả các ảnh:\n\n1: Đường phố vắng\n2: Xe buýt dừng đỗ\n4: Thừa ra\n0: Sai số'
+    assert parse_batch_response(text, 3) == {1: 'Đường phố vắng', 2: 'Xe buýt dừng đỗ'}
+
+
+def test_duplicated_and_invalid_captions_are_dropped():
+    long_caption = ' '.join(['chữ'] * (MAX_CAPTION_WORDS + 1))
+    text = f'1: Ngã tư đông đúc\n2: Một\n2: Hai\n3: {long_caption}\n4: ""'
+    assert parse_batch_response(text, 4) == {1: 'Ngã tư đông đúc'}
+
+
+def test_empty_response():
+    assert parse_batch_response(None, 3) == {}
+    assert parse_batch_response('', 3) == {}
+
+
+def test_build_batch_parts_labels_each_image():
+    parts = build_batch_parts('Mô tả ảnh.', ['img-a', 'img-b'])
+    assert 'Mô tả ảnh.' in parts[0] and '2 ảnh' in parts[0]
+    assert parts[1:] == ['Ảnh 1:', 'img-a', 'Ảnh 2:', 'img-b']
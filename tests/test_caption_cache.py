@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra khóa của cache caption: cùng ảnh/prompt/model/tham số mới trúng cache"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '3.labels_short_captions', 'python'))
+from caption_cache import CaptionCache, hash_bytes
+
+IMAGE = hash_bytes(b'jpeg bytes')
+PROMPT = 'Mô tả ngắn gọn tình trạng giao thông trong ảnh.'
+MODEL = 'gemini-1.5-flash'
+PARAMS = {'temperature': 0.2, 'max_output_tokens': 64}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = CaptionCache(str(tmp_path / 'caption_cache.sqlite'))
+    cache.put(IMAGE, PROMPT, MODEL, 'Đường đông xe', params=PARAMS)
+    yield cache
+    cache.close()
+
+
+def test_same_key_hits_regardless_of_params_order(cache):
+    reordered = {'max_output_tokens': 64, 'temperature': 0.2}
+    assert cache.get(IMAGE, PROMPT, MODEL, params=reordered) == 'Đường đông xe'
+    # Cùng nội dung ảnh dù tải từ URL khác
+    assert cache.get(hash_bytes(b'jpeg bytes'), PROMPT, MODEL, params=PARAMS) == 'Đường đông xe'
+
+
+@pytest.mark.parametrize('image, prompt, model, params', [
+    (hash_bytes(b'other bytes'), PROMPT, MODEL, PARAMS),
+    (IMAGE, PROMPT + ' ', MODEL, PARAMS),
+    (IMAGE, PROMPT, 'gemini-1.5-pro', PARAMS),
+    (IMAGE, PROMPT, MODEL, {'temperature': 0.7, 'max_output_tokens': 64}),
+    (IMAGE, PROMPT, MODEL, None),
+])
+def test_any_key_part_change_misses(cache, image, prompt, model, params):
+    assert cache.get(image, prompt, model, params=params) is None
+
+
+def test_stats_count_hits_and_misses(cache):
+    cache.get(IMAGE, PROMPT, MODEL, params=PARAMS)
+    cache.get(IMAGE, PROMPT, 'gemini-1.5-pro', params=PARAMS)
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (1, 1, 1)
+    assert stats['hit_rate'] == 0.5
+
+
+def test_prune_by_model(cache):
+    cache.put(IMAGE, PROMPT, 'gemini-1.5-pro', 'Xe cộ thưa thớt', params=PARAMS)
+    assert cache.prune() == 0
+    assert cache.prune(model=MODEL) == 1
+    assert cache.get(IMAGE, PROMPT, MODEL, params=PARAMS) is None
+    assert cache.get(IMAGE, PROMPT, 'gemini-1.5-pro', params=PARAMS) == 'Xe cộ thưa thớt'
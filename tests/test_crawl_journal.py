@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra nhật ký crawl: resume bỏ qua phần đã xong, compile ra JSON/CSV như trước"""
+import json
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '1.crawl_data', 'python'))
+from crawl_journal import FIELDNAMES, CrawlJournal, compile_journal
+
+
+def image_info(query, page, index):
+    return {
+        'title': f'Ảnh {index}',
+        'original_url': f'https://example.com/{query}/{index}.jpg',
+        'thumbnail_url': f'https://example.com/thumb/{index}.jpg',
+        'source_website': 'example.com',
+        'resolution': '800x600',
+        'search_query': query,
+        'page_number': page,
+        'local_path': f'images/{index}.jpg',
+    }
+
+
+def test_resume_skips_done_and_drops_partial_line(tmp_path):
+    path = str(tmp_path / 'crawl.jsonl')
+    journal = CrawlJournal(path)
+    journal.append_image(image_info('kẹt xe', 1, 0))
+    journal.mark_page_done('kẹt xe', 1)
+    journal.append_image(image_info('kẹt xe', 2, 1))
+    journal.close()
+    # Tiến trình bị dừng khi đang ghi dở một dòng
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"title": "dở')
+
+    journal = CrawlJournal(path, resume=True)
+    assert journal.is_page_done('kẹt xe', 1)
+    assert not journal.is_page_done('kẹt xe', 2)
+    assert journal.is_image_done('kẹt xe', 2, 'https://example.com/kẹt xe/1.jpg')
+    journal.append_image(image_info('kẹt xe', 2, 2))
+    journal.close()
+
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 4
+    assert [json.loads(line).get('title') for line in lines] == ['Ảnh 0', None, 'Ảnh 1', 'Ảnh 2']
+
+
+def test_compile_matches_json_dump_and_to_csv(tmp_path):
+    path = str(tmp_path / 'crawl.jsonl')
+    images = [image_info('kẹt xe', 1, 0), image_info('tai nạn', 1, 1), image_info('kẹt xe', 2, 2)]
+    journal = CrawlJournal(path)
+    for info in images:
+        journal.append_image(info)
+    journal.mark_page_done('kẹt xe', 1)
+    journal.close()
+
+    json_path, csv_path = str(tmp_path / 'metadata.json'), str(tmp_path / 'images.csv')
+    counts = compile_journal(path, json_path, csv_path)
+
+    assert counts == {'kẹt xe': 2, 'tai nạn': 1}
+    with open(json_path, encoding='utf-8') as f:
+        assert f.read() == json.dumps(images, ensure_ascii=False, indent=2)
+    expected_csv = str(tmp_path / 'expected.csv')
+    pd.DataFrame(images, columns=FIELDNAMES).to_csv(expected_csv, index=False, encoding='utf-8-sig')
+    with open(csv_path, 'rb') as f, open(expected_csv, 'rb') as g:
+        assert f.read() == g.read()
+
+
+def test_compile_empty_journal(tmp_path):
+    json_path, csv_path = str(tmp_path / 'metadata.json'), str(tmp_path / 'images.csv')
+    assert not compile_journal(str(tmp_path / 'missing.jsonl'), json_path, csv_path)
+    with open(json_path, encoding='utf-8') as f:
+        assert json.load(f) == []
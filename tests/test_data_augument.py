@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra ảnh gốc được lưu: chỉ JPEG RGB thuần được ghi thẳng bytes, còn lại mã hóa lại RGB"""
+import os
+import sys
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageCms
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '4.Image_data_augument', 'python'))
+from data_augument import ORIENTATION_TAG, augment_bytes
+
+ROW = {
+    'original_url': 'https://example.com/a.jpg',
+    'source_website': 'example.com',
+    'resolution': '1200x800',
+    'search_query': 'q',
+    'short_caption': 'c',
+}
+
+
+def encode_jpeg(image, **kwargs):
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', **kwargs)
+    return buffer.getvalue()
+
+
+def rgb_image():
+    return Image.new('RGB', (1200, 800), (200, 10, 10))
+
+
+def rotated_jpeg():
+    image = rgb_image()
+    exif = image.getexif()
+    exif[ORIENTATION_TAG] = 6
+    return encode_jpeg(image, exif=exif)
+
+
+def icc_jpeg():
+    profile = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+    return encode_jpeg(rgb_image(), icc_profile=profile)
+
+
+def save_original(tmp_path, data):
+    os.makedirs(tmp_path / 'images')
+    results = augment_bytes(data, ROW, 0, str(tmp_path), virtual=True)
+    path = results[0]['local_path']
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_plain_rgb_jpeg_is_written_unchanged(tmp_path):
+    data = encode_jpeg(rgb_image())
+    assert save_original(tmp_path, data) == data
+
+
+@pytest.mark.parametrize('data, size', [
+    (encode_jpeg(Image.new('CMYK', (1200, 800), (0, 200, 200, 0))), (1200, 800)),
+    (rotated_jpeg(), (800, 1200)),
+    (icc_jpeg(), (1200, 800)),
+])
+def test_non_plain_jpeg_is_reencoded_as_rgb(tmp_path, data, size):
+    saved = save_original(tmp_path, data)
+    assert saved != data
+    image = Image.open(BytesIO(saved))
+    assert image.mode == 'RGB'
+    assert image.size == size
+    assert image.getexif().get(ORIENTATION_TAG, 1) == 1
+    assert not image.info.get('icc_profile')
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra chuẩn hóa URL (URL nào bị coi là trùng) của dataset_compiler"""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '2.data_preprocessing', 'python'))
+from dataset_compiler import DatasetIndex, normalize_url
+
+
+@pytest.mark.parametrize('first, second', [
+    ('http://example.com/a.jpg', 'https://example.com/a.jpg'),
+    ('https://www.example.com/a.jpg', 'https://example.com/a.jpg'),
+    ('https://EXAMPLE.com:443/a.jpg', 'https://example.com/a.jpg'),
+    ('https://example.com//img//a.jpg/', 'https://example.com/img/a.jpg'),
+    ('https://example.com/a.jpg?utm_source=fb&utm_medium=x', 'https://example.com/a.jpg'),
+    ('https://example.com/a.jpg?fbclid=abc&id=1', 'https://example.com/a.jpg?id=1'),
+    ('https://example.com/a.jpg?b=2&a=1', 'https://example.com/a.jpg?a=1&b=2'),
+    ('https://example.com/uploads/a-300x200.jpg', 'https://example.com/uploads/a.jpg'),
+    ('https://images.imgix.net/a.jpg?w=300&auto=format&ixlib=js', 'https://images.imgix.net/a.jpg?w=1200'),
+    ('https://i0.wp.com/example.com/a.jpg?resize=300,200&ssl=1', 'https://i0.wp.com/example.com/a.jpg'),
+])
+def test_same_image_collides(first, second):
+    assert normalize_url(first) == normalize_url(second)
+
+
+@pytest.mark.parametrize('first, second', [
+    # Khóa chung trên server thường có thể chọn ảnh khác: không được gộp
+    ('https://example.com/img.php?v=1', 'https://example.com/img.php?v=2'),
+    ('https://example.com/photo?id=7&size=large', 'https://example.com/photo?id=7&size=small'),
+    ('https://example.com/photo?id=7&format=png', 'https://example.com/photo?id=7'),
+    ('https://example.com/thumb.php?src=a.jpg&w=300', 'https://example.com/thumb.php?src=a.jpg&w=600'),
+    ('https://example.com/image?source=cam1', 'https://example.com/image?source=cam2'),
+    ('https://example.com/a.jpg', 'https://example.com/b.jpg'),
+    ('https://example.com/A.jpg', 'https://example.com/a.jpg'),
+    ('https://example.com:8080/a.jpg', 'https://example.com/a.jpg'),
+    ('https://cdn1.example.com/a.jpg', 'https://cdn2.example.com/a.jpg'),
+])
+def test_different_images_stay_distinct(first, second):
+    assert normalize_url(first) != normalize_url(second)
+
+
+def test_read_version_dedupes_before_dropna(tmp_path):
+    # Như notebook: dòng đầu tiên của URL thiếu dữ liệu thì URL bị bỏ, không lấy dòng trùng sau
+    path = tmp_path / 'traffic_images_dataset_v1.csv'
+    pd.DataFrame({
+        'original_url': ['https://example.com/a.jpg', 'http://www.example.com/a.jpg', 'https://example.com/b.jpg', None],
+        'source_website': [None, 'example.com', 'example.com', 'example.com'],
+        'resolution': ['800x600', '800x600', '640x480', '640x480'],
+        'search_query': ['q', 'q', 'q', 'q'],
+        'local_path': ['a.jpg', 'a.jpg', 'b.jpg', 'c.jpg'],
+    }).to_csv(path, index=False)
+
+    index = DatasetIndex(str(tmp_path / 'index.sqlite'))
+    try:
+        df = index._read_version(str(path))
+    finally:
+        index.close()
+    assert df['original_url'].tolist() == ['https://example.com/b.jpg']
+    assert 'width' not in df.columns
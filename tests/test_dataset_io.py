@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra đọc/ghi bảng CSV và Parquet của dataset_io"""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from dataset_io import read_table, write_table
+
+
+def make_df():
+    return pd.DataFrame({
+        'original_url': ['https://a.com/1.jpg', 'https://b.com/2.jpg', 'https://c.com/3.jpg'],
+        'source_website': ['a.com', 'b.com', 'a.com'],
+        'resolution': ['2000x1500', '800x600', '1000x900'],
+        'search_query': ['áo dài', 'phở', 'áo dài'],
+    })
+
+
+@pytest.fixture(params=['csv', 'parquet'])
+def table_path(request, tmp_path):
+    path = str(tmp_path / f'table.{request.param}')
+    write_table(make_df(), path)
+    return path
+
+
+def test_filter_on_width_is_numeric(table_path):
+    df = read_table(table_path, filters=[('width', '>=', 900)])
+    assert df['original_url'].tolist() == ['https://a.com/1.jpg', 'https://c.com/3.jpg']
+
+
+def test_filter_groups_are_or_of_and(table_path):
+    df = read_table(table_path, columns=['original_url'],
+                    filters=[[('width', '<', 900)], [('search_query', '==', 'áo dài'), ('height', '>', 1000)]])
+    assert df['original_url'].tolist() == ['https://a.com/1.jpg', 'https://b.com/2.jpg']
+
+
+@pytest.mark.parametrize('filters, message', [
+    ([('resolution', '>=', '900x600')], 'width'),
+    ([('nope', '==', 1)], 'nope'),
+    ([('width', '~', 1)], '~'),
+])
+def test_unsupported_filters_are_rejected(table_path, filters, message):
+    with pytest.raises(ValueError, match=message):
+        read_table(table_path, filters=filters)
+
+
+def test_csv_parquet_round_trip(tmp_path):
+    df = make_df()
+    df.loc[1, 'resolution'] = None
+    df['page_number'] = [1, 2, 3]
+    df['short_caption'] = ['Đường đông xe', None, 'Xe buýt, xe máy "kẹt" cứng']
+    csv_path, parquet_path, back_path = (str(tmp_path / name) for name in ('a.csv', 'a.parquet', 'b.csv'))
+    write_table(df, csv_path)
+
+    write_table(read_table(csv_path), parquet_path)
+    write_table(read_table(parquet_path), back_path)
+
+    with open(csv_path, 'rb') as f, open(back_path, 'rb') as g:
+        assert f.read() == g.read()
+    parquet = read_table(parquet_path, columns=['original_url', 'width', 'height', 'resolution'])
+    assert parquet['width'].tolist()[::2] == [2000, 1000]
+    assert parquet['width'].isna().tolist() == [False, True, False]
+    assert parquet['resolution'].tolist()[::2] == ['2000x1500', '1000x900']
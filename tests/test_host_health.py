@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra circuit breaker theo host: closed -> open -> half-open -> closed"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import host_health
+from host_health import CLOSED, HALF_OPEN, OPEN, SKIP_BAD_URL, SKIP_HOST_OPEN, HostHealth
+
+URL = 'http://flaky.example/a.jpg'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(host_health.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def health(tmp_path):
+    health = HostHealth(str(tmp_path / 'host_health.sqlite'), failure_threshold=3, open_seconds=60,
+                        probe_seconds=30)
+    yield health
+    health.close()
+
+
+def state_of(health):
+    return health.report()['flaky.example']['state']
+
+
+def test_open_half_open_closed(health, clock):
+    for _ in range(2):
+        health.record_failure(URL, 'Timeout')
+    assert health.check(URL) is None
+    health.record_failure(URL, 'Timeout')
+    assert state_of(health) == OPEN
+    assert health.check(URL) == SKIP_HOST_OPEN
+
+    clock.now += 61
+    assert health.check(URL) is None            # request thử duy nhất
+    assert state_of(health) == HALF_OPEN
+    assert health.check(URL) == SKIP_HOST_OPEN  # request khác chờ kết quả request thử
+    health.record_success(URL)
+    assert state_of(health) == CLOSED
+    assert health.check(URL) is None
+
+
+def test_failed_probe_reopens_for_longer(health, clock):
+    for _ in range(3):
+        health.record_failure(URL, 'Timeout')
+    clock.now += 61
+    assert health.check(URL) is None
+    health.record_failure(URL, 'Timeout')
+    assert state_of(health) == OPEN
+    clock.now += 61
+    assert health.check(URL) == SKIP_HOST_OPEN  # lần ngắt sau dài gấp đôi
+    clock.now += 60
+    assert health.check(URL) is None
+
+
+def test_probe_without_result_expires(health, clock):
+    for _ in range(3):
+        health.record_failure(URL, 'Timeout')
+    clock.now += 61
+    assert health.check(URL) is None            # nơi gọi không bao giờ ghi kết quả
+    clock.now += 29
+    assert health.check(URL) == SKIP_HOST_OPEN
+    clock.now += 2
+    assert health.check(URL) is None            # request thử quá hạn: cho thử lại
+    health.record_success(URL)
+    assert state_of(health) == CLOSED
+
+
+def test_not_found_goes_to_negative_cache(health, clock):
+    health.record_response(URL, 404)
+    assert health.check(URL) == SKIP_BAD_URL
+    assert health.check('http://flaky.example/b.jpg') is None
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra cache HTTP: kiểm tra lại bằng ETag, xóa LRU theo dung lượng, chế độ offline"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import http_cache
+from host_health import HostHealth
+from http_cache import CacheMiss, HTTPCache
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeSession:
+    """Server giả: trả 304 khi If-None-Match trùng ETag hiện tại"""
+
+    def __init__(self):
+        self.bodies = {}
+        self.calls = []
+
+    def get(self, url, timeout=None, verify=None, headers=None):
+        self.calls.append((url, dict(headers or {})))
+        if url not in self.bodies:
+            return FakeResponse(404)
+        content, etag = self.bodies[url]
+        if (headers or {}).get('If-None-Match') == etag:
+            return FakeResponse(304, headers={'ETag': etag})
+        return FakeResponse(200, content, {'Content-Type': 'image/jpeg', 'ETag': etag})
+
+    def close(self):
+        pass
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(http_cache.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def server():
+    return FakeSession()
+
+
+@pytest.fixture
+def make_cache(tmp_path, server):
+    caches = []
+
+    def make_cache(**kwargs):
+        health = HostHealth(str(tmp_path / 'host_health.sqlite'))
+        cache = HTTPCache(str(tmp_path / 'cache'), session=server, health=health, **kwargs)
+        caches.append((cache, health))
+        return cache
+
+    yield make_cache
+    for cache, health in caches:
+        cache.close()
+        health.close()
+
+
+def test_fresh_entry_is_served_without_network(make_cache, server, clock):
+    server.bodies['http://a.example/1.jpg'] = (b'one', '"v1"')
+    cache = make_cache(max_age=60)
+
+    first = cache.get('http://a.example/1.jpg')
+    second = cache.get('http://a.example/1.jpg')
+
+    assert (first.from_cache, second.from_cache) == (False, True)
+    assert second.content == b'one'
+    assert len(server.calls) == 1
+
+
+def test_stale_entry_is_revalidated_with_etag(make_cache, server, clock):
+    url = 'http://a.example/1.jpg'
+    server.bodies[url] = (b'one', '"v1"')
+    cache = make_cache(max_age=60)
+    cache.get(url)
+
+    clock.now += 120
+    unchanged = cache.get(url)
+    assert server.calls[-1][1]['If-None-Match'] == '"v1"'
+    assert unchanged.from_cache and unchanged.content == b'one'
+
+    # 304 làm mới fetched_at: lần sau không cần gọi mạng
+    cache.get(url)
+    assert len(server.calls) == 2
+
+    clock.now += 120
+    server.bodies[url] = (b'two', '"v2"')
+    changed = cache.get(url)
+    assert not changed.from_cache and changed.content == b'two'
+    assert cache.cached_headers(url)['ETag'] == '"v2"'
+
+
+def test_least_recently_used_entries_are_evicted(make_cache, server, clock):
+    for name in 'abc':
+        server.bodies[f'http://a.example/{name}.jpg'] = (name.encode() * 10, f'"{name}"')
+    cache = make_cache(max_bytes=25)
+
+    cache.get('http://a.example/a.jpg')
+    clock.now += 1
+    cache.get('http://a.example/b.jpg')
+    clock.now += 1
+    cache.get('http://a.example/a.jpg')  # a được dùng lại, b thành cũ nhất
+    clock.now += 1
+    cache.get('http://a.example/c.jpg')
+
+    assert cache.stats()['bytes'] == 20
+    assert cache.cached_headers('http://a.example/b.jpg') is None
+    assert cache.cached_headers('http://a.example/a.jpg') is not None
+    assert cache.cached_headers('http://a.example/c.jpg') is not None
+
+
+def test_offline_serves_cache_and_raises_on_miss(make_cache, server, clock):
+    server.bodies['http://a.example/1.jpg'] = (b'one', '"v1"')
+    make_cache().get('http://a.example/1.jpg')
+
+    offline = make_cache(offline=True, max_age=0)
+    assert offline.get('http://a.example/1.jpg').content == b'one'
+    with pytest.raises(CacheMiss):
+        offline.get('http://a.example/2.jpg')
+    assert len(server.calls) == 1
+
+
+def test_non_200_is_not_cached(make_cache, server, clock):
+    cache = make_cache()
+    assert cache.get('http://a.example/missing.jpg').status_code == 404
+    assert cache.cached_headers('http://a.example/missing.jpg') is None
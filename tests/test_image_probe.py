@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra đọc định dạng/kích thước ảnh từ các byte đầu của image_probe"""
+import os
+import sys
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '1.crawl_data', 'python'))
+from image_probe import probe_image_size
+
+
+def encode(fmt, size=(640, 480), mode='RGB', **kwargs):
+    buffer = BytesIO()
+    Image.new(mode, size, 128 if mode == 'L' else (10, 20, 30)).save(buffer, format=fmt, **kwargs)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('data, expected', [
+    (encode('JPEG'), ('jpeg', 640, 480)),
+    (encode('JPEG', progressive=True), ('jpeg', 640, 480)),
+    # Segment EXIF/ICC đứng trước SOF phải được bỏ qua
+    (encode('JPEG', exif=Image.Exif(), icc_profile=b'\0' * 3000), ('jpeg', 640, 480)),
+    (encode('PNG', size=(1201, 7)), ('png', 1201, 7)),
+    (encode('GIF', mode='L'), ('gif', 640, 480)),
+    (encode('BMP', size=(33, 65)), ('bmp', 33, 65)),
+    (encode('WEBP'), ('webp', 640, 480)),
+    (encode('WEBP', lossless=True), ('webp', 640, 480)),
+])
+def test_probe_reads_header_size(data, expected):
+    assert probe_image_size(data[:4096]) == expected
+
+
+@pytest.mark.parametrize('data', [
+    encode('PNG')[:20],
+    encode('JPEG', icc_profile=b'\0' * 3000)[:1024],
+    b'<html>not an image</html>',
+    b'',
+])
+def test_probe_returns_none_when_incomplete_or_unknown(data):
+    assert probe_image_size(data) is None
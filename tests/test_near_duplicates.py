@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra truy vấn bán kính Hamming của MultiIndexHash so với so sánh vét cạn, và ngưỡng pHash"""
+import io
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '2.data_preprocessing', 'python'))
+from near_duplicates import DHASH_THRESHOLD, THRESHOLD, MultiIndexHash, compute_hashes, hamming
+
+
+def _flip(value, bits, rng):
+    for position in rng.sample(range(64), bits):
+        value ^= 1 << position
+    return value
+
+
+def _brute_force(hashes, phash, dhash, radius, dhash_radius):
+    return sorted((item_id, hamming(phash, other_phash)) for item_id, (other_phash, other_dhash) in hashes.items()
+                  if hamming(phash, other_phash) <= radius and hamming(dhash, other_dhash) <= dhash_radius)
+
+
+@pytest.mark.parametrize('radius', [0, 3, 4, THRESHOLD, 8, 11])
+def test_query_matches_brute_force(radius):
+    rng = random.Random(radius)
+    index = MultiIndexHash()
+    centers = [(rng.getrandbits(64), rng.getrandbits(64)) for _ in range(20)]
+    item_id = 0
+    for phash, dhash in centers:
+        index.add(item_id, phash, dhash)
+        item_id += 1
+        # Hash gần tâm ở mọi khoảng cách quanh bán kính, kể cả đúng bằng bán kính
+        for bits in range(radius + 3):
+            index.add(item_id, _flip(phash, bits, rng), _flip(dhash, rng.randint(0, 14), rng))
+            item_id += 1
+    for _ in range(200):
+        index.add(item_id, rng.getrandbits(64), rng.getrandbits(64))
+        item_id += 1
+
+    for phash, dhash in centers + [(rng.getrandbits(64), rng.getrandbits(64)) for _ in range(10)]:
+        expected = _brute_force(index.hashes, phash, dhash, radius, DHASH_THRESHOLD)
+        assert sorted(index.query(phash, dhash, radius, DHASH_THRESHOLD)) == expected
+
+
+def _scene(seed):
+    """Ảnh 640x480 mượt (nội suy từ lưới màu ngẫu nhiên), giống ảnh chụp hơn nhiễu trắng"""
+    colors = np.random.default_rng(seed).uniform(0, 255, (6, 8, 3)).astype(np.uint8)
+    return Image.fromarray(colors).resize((640, 480), Image.Resampling.BICUBIC)
+
+
+def _jpeg(image, quality=95):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def test_threshold_separates_copies_from_distinct_images():
+    hashes = [compute_hashes(_jpeg(_scene(seed))) for seed in range(6)]
+    for seed, (phash, dhash, _, _) in enumerate(hashes):
+        copy_phash, copy_dhash, width, _ = compute_hashes(_jpeg(_scene(seed).resize((320, 240)), quality=70))
+        assert width == 320
+        assert hamming(phash, copy_phash) <= THRESHOLD
+        assert hamming(dhash, copy_dhash) <= DHASH_THRESHOLD
+        for other in hashes[seed + 1:]:
+            assert hamming(phash, other[0]) > THRESHOLD
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra TokenBucket (nạp lại theo thời gian) và AdaptiveConcurrency (AIMD)"""
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import rate_limit
+from rate_limit import AdaptiveConcurrency, TokenBucket
+
+
+class FakeTime:
+    """Đồng hồ giả: sleep chỉ cộng thêm thời gian"""
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def fake_time(monkeypatch):
+    fake_time = FakeTime()
+    monkeypatch.setattr(rate_limit, 'time', fake_time)
+    return fake_time
+
+
+def test_token_bucket_rejects_non_positive_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+def test_token_bucket_allows_burst_then_waits_for_refill(fake_time):
+    bucket = TokenBucket(60, capacity=3)  # 1 đơn vị mỗi giây
+    for _ in range(3):
+        bucket.acquire()
+    assert fake_time.slept == []
+
+    bucket.acquire()
+    assert fake_time.slept == [pytest.approx(1.0)]
+
+    fake_time.now += 100  # Nạp lại không vượt quá capacity
+    bucket.acquire(2)
+    bucket.acquire()
+    assert len(fake_time.slept) == 1
+
+
+def test_token_bucket_caps_amount_at_capacity(fake_time):
+    bucket = TokenBucket(60, capacity=2)
+    bucket.acquire(10)
+    assert fake_time.slept == []
+
+
+def test_adaptive_concurrency_halves_and_grows_back(fake_time):
+    limiter = AdaptiveConcurrency(initial=8, minimum=2, maximum=9, cooldown=5.0)
+    limiter.on_rate_limit()
+    assert limiter.limit == 4
+    limiter.on_rate_limit()
+    limiter.on_rate_limit()
+    assert limiter.limit == 2
+    assert limiter.rate_limited == 3
+
+    # Cần ``limit`` lần thành công liên tiếp để tăng thêm 1
+    limiter.on_success()
+    assert limiter.limit == 2
+    limiter.on_success()
+    assert limiter.limit == 3
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.limit == 9
+
+
+def test_adaptive_concurrency_blocks_beyond_limit():
+    limiter = AdaptiveConcurrency(initial=1, cooldown=0.0)
+    entered = threading.Event()
+
+    def worker():
+        with limiter.slot():
+            entered.set()
+
+    limiter.acquire()
+    thread = threading.Thread(target=worker)
+    thread.start()
+    assert not entered.wait(0.1)
+    limiter.release()
+    assert entered.wait(5)
+    thread.join()
+    assert limiter.active == 0
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra pipeline stream: chạy lại chỉ tiếp tục item dở dang từ giai đoạn kế tiếp"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pipeline'))
+from streaming import DONE, DROPPED, PENDING, DropItem, PipelineState, Stage, StreamingPipeline
+
+
+def run(state_path, keys, fetch, label):
+    state = PipelineState(state_path)
+    pipeline = StreamingPipeline([Stage('fetch', fetch, workers=2), Stage('label', label, workers=2)], state)
+    pipeline.start()
+    for key in keys:
+        pipeline.submit(key, {'key': key})
+    pipeline.finish()
+    return pipeline, state
+
+
+def test_resume_continues_after_last_completed_stage(tmp_path):
+    state_path = str(tmp_path / 'state.sqlite')
+    keys = ['a', 'b', 'c', 'd']
+    fetched, labelled = [], []
+
+    def fetch(item):
+        if item.data['key'] == 'd':
+            raise DropItem("ảnh lỗi")
+        fetched.append(item.data['key'])
+        item.data['bytes'] = item.data['key'] * 2
+
+    def flaky_label(item):
+        if item.data['key'] == 'b':
+            raise RuntimeError("quota")
+        labelled.append(item.data['key'])
+        item.data['caption'] = item.data['bytes'].upper()
+
+    pipeline, state = run(state_path, keys, fetch, flaky_label)
+    assert state.counts() == {DONE: 2, PENDING: 1, DROPPED: 1}
+    assert state.get('b')[1] == 'fetch'
+    state.close()
+
+    def label(item):
+        labelled.append(item.data['key'])
+        item.data['caption'] = item.data['bytes'].upper()
+
+    pipeline, state = run(state_path, keys, fetch, label)
+    assert (pipeline.skipped, pipeline.resumed) == (3, 1)
+    # b không phải tải lại: dữ liệu của giai đoạn fetch được lấy từ trạng thái đã lưu
+    assert sorted(fetched) == ['a', 'b', 'c']
+    assert sorted(labelled) == ['a', 'b', 'c']
+    assert state.counts() == {DONE: 3, DROPPED: 1}
+    # Thứ tự seq giữ nguyên theo lần thêm đầu tiên
+    assert [data['caption'] for _, data in state.iter_data()] == ['AA', 'BB', 'CC']
+    assert [data['key'] for _, data in state.iter_data(DROPPED)] == ['d']
+    state.close()
+
+
+def test_duplicate_keys_are_submitted_once(tmp_path):
+    state = PipelineState(str(tmp_path / 'state.sqlite'))
+    seen = []
+    pipeline = StreamingPipeline([Stage('only', lambda item: seen.append(item.key))], state)
+    pipeline.start()
+    assert pipeline.submit('a', {})
+    assert not pipeline.submit('a', {})
+    pipeline.finish()
+    assert seen == ['a']
+    state.close()
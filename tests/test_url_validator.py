@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra validate_dataframe: URL của host đang bị ngắt không được coi là hợp lệ"""
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '2.data_preprocessing', 'python'))
+import url_validator
+from host_health import SKIP_HOST_OPEN, HostHealth
+
+
+def test_tripped_host_rows_are_not_clean(tmp_path, monkeypatch):
+    health = HostHealth(str(tmp_path / 'host_health.sqlite'), failure_threshold=2)
+    for _ in range(2):
+        health.record_failure('http://dead.invalid/x.jpg', 'ConnectTimeout')
+    monkeypatch.setattr(url_validator, 'get_default_host_health', lambda: health)
+
+    df = pd.DataFrame({'original_url': ['http://dead.invalid/a.jpg', 'http://dead.invalid/b.jpg'],
+                       'search_query': ['q', 'q']})
+    clean_df, failed_urls, error_stats = url_validator.validate_dataframe(df, use_http_cache=False)
+
+    assert clean_df.empty
+    assert error_stats == {SKIP_HOST_OPEN: 2}
+    assert url_validator.retry_rows(df, failed_urls)['original_url'].tolist() == df['original_url'].tolist()
+    health.close()
+
+
+def test_host_open_results_are_not_cached(tmp_path):
+    cache = url_validator.ResultCache(str(tmp_path / 'cache.sqlite'))
+    cache.put_many({'http://a/1.jpg': (True, None), 'http://a/2.jpg': (None, SKIP_HOST_OPEN),
+                    'http://a/3.jpg': (False, 'Timeout'), 'http://a/4.jpg': (False, 'Lỗi HTTP 404')})
+    assert cache.get_fresh(['http://a/1.jpg', 'http://a/2.jpg', 'http://a/3.jpg', 'http://a/4.jpg']) == {
+        'http://a/1.jpg': (True, None), 'http://a/4.jpg': (False, 'Lỗi HTTP 404')}
+    cache.close()
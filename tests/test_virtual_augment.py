@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra augmentation ảo: biến thể tạo lại từ ảnh nguồn + seed luôn giống nhau"""
+import os
+import sys
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '4.Image_data_augument', 'python'))
+from data_augument import (AUG_SIZE, NUM_AUGMENTATIONS, VIRTUAL_COLUMNS, ResultWriter, augment_bytes,
+                           decode_image, process_image, render_variant)
+from virtual_augment import VirtualAugmentDataset
+
+
+def make_jpeg(seed):
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(600, 700, 3), dtype=np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def virtual_csv(tmp_path):
+    os.makedirs(tmp_path / 'images')
+    path = str(tmp_path / 'captions_augmented.csv')
+    writer = ResultWriter(path, VIRTUAL_COLUMNS)
+    for idx in range(2):
+        row = {
+            'original_url': f'https://example.com/{idx}.jpg',
+            'source_website': 'example.com',
+            'resolution': '700x600',
+            'search_query': 'kẹt xe',
+            'short_caption': f'Caption {idx}',
+        }
+        writer.write(augment_bytes(make_jpeg(idx), row, idx, str(tmp_path), virtual=True))
+    writer.close()
+    return path
+
+
+def test_variants_are_rebuilt_identically(virtual_csv):
+    first = VirtualAugmentDataset(virtual_csv)
+    second = VirtualAugmentDataset(virtual_csv)
+    assert len(first) == 2 * NUM_AUGMENTATIONS
+
+    for index in range(len(first)):
+        item = first[index]
+        assert item['image'].shape == (AUG_SIZE, AUG_SIZE, 3)
+        assert np.array_equal(item['image'], second[index]['image'])
+        with open(item['source_path'], 'rb') as f:
+            source = process_image(decode_image(f.read())[0])
+        assert np.array_equal(item['image'], render_variant(source, item['aug_seed']))
+
+    # Các biến thể của cùng một ảnh phải khác nhau
+    assert not np.array_equal(first[0]['image'], first[1]['image'])
+
+
+def test_extra_variants_start_with_recorded_ones(virtual_csv):
+    recorded = VirtualAugmentDataset(virtual_csv)
+    extended = VirtualAugmentDataset(virtual_csv, variants_per_source=NUM_AUGMENTATIONS + 2)
+    assert len(extended) == 2 * (NUM_AUGMENTATIONS + 2)
+
+    recorded_seeds = [item[2] for item in recorded.items]
+    extended_seeds = [item[2] for item in extended.items]
+    per_source = NUM_AUGMENTATIONS + 2
+    assert extended_seeds[:NUM_AUGMENTATIONS] == recorded_seeds[:NUM_AUGMENTATIONS]
+    assert extended_seeds[per_source:per_source + NUM_AUGMENTATIONS] == recorded_seeds[NUM_AUGMENTATIONS:]
+
+    shifted = VirtualAugmentDataset(virtual_csv, variants_per_source=NUM_AUGMENTATIONS, base_seed=1)
+    assert [item[2] for item in shifted.items] != recorded_seeds
+
+
+def test_changed_transform_hash_is_rejected(virtual_csv):
+    with open(virtual_csv, encoding='utf-8-sig') as f:
+        content = f.read()
+    rows = content.splitlines()
+    header = rows[0].split(',')
+    column = header.index('transform_hash')
+    for i, line in enumerate(rows[1:], start=1):
+        cells = line.split(',')
+        if cells[column]:
+            cells[column] = 'deadbeef'
+            rows[i] = ','.join(cells)
+    with open(virtual_csv, 'w', encoding='utf-8-sig') as f:
+        f.write('\n'.join(rows) + '\n')
+
+    with pytest.raises(ValueError):
+        VirtualAugmentDataset(virtual_csv)
+    assert len(VirtualAugmentDataset(virtual_csv, strict=False)) == 2 * NUM_AUGMENTATIONS